@@ -1,18 +1,19 @@
 import pycoq.serapi
+import pycoq.pool
 # import pycoq.log
 import logging
 
-# import serlib.parser
+import serlib.parser
 
-# from serlib.parser import SExpParser
 
-
-from typing import Iterable, List, Tuple
+from typing import Iterable, List, Tuple, Optional
 
 
 async def evaluate_agent_on_stream(cfg: pycoq.common.LocalKernelConfig, agent, props: Iterable[str],
-                                   agent_parameters = {}, section_name = "section0000", logfname=None):
-    async with pycoq.serapi.CoqSerapi(cfg, logfname=logfname) as coq:
+                                   agent_parameters = {}, section_name = "section0000", logfname=None,
+                                   timeout: Optional[float] = None):
+    async with pycoq.serapi.CoqSerapi(cfg, logfname=logfname, timeout=timeout) as coq:
+        coq.checkpoint()
         for prop in props:
             result = await coq.execute(f"Section {section_name}.")
             last_sids = result[3]
@@ -25,18 +26,20 @@ async def evaluate_agent_on_stream(cfg: pycoq.common.LocalKernelConfig, agent, p
             if len(result[2]) > 0:
                 logging.debug("evaluate_agent_session: Error in proposition")
                 logging.debug(result[2])
-                yield (prop, -2)
+                agent_result = -2
             else:
                 agent_result = await agent(coq, **agent_parameters)
                 
-                result = await coq.cancel_completed(last_sids)
+            # reset to the checkpoint held by coq, which follows a restart of the kernel in resilient mode
+            await coq.reset()
 
-                logging.debug("evaluate_agent_session: most recent agent section cancelled; ready to evaluate another proposition")
-                yield (prop, agent_result)    
+            logging.debug("evaluate_agent_session: session reset to baseline; ready to evaluate another proposition")
+            yield (prop, agent_result)    
 
                 
 async def evaluate_agent_in_session(coq: pycoq.serapi.CoqSerapi, agent, prop: str, name: str, agent_parameters = {}):
     logging.debug(prop)
+    baseline = coq.tip()
     result = await coq.execute(prop)
     last_sids = result[3]
     if len(last_sids) != 1 or len(result[2]) > 0:
@@ -52,7 +55,7 @@ async def evaluate_agent_in_session(coq: pycoq.serapi.CoqSerapi, agent, prop: st
         else:
             defi = None
         
-        _ = await coq.cancel_completed(last_sids)
+        _ = await coq.reset_to(baseline)
         
         if defi is None:
             return (agent_result, None)
@@ -73,11 +76,14 @@ async def evaluate_agent_in_session(coq: pycoq.serapi.CoqSerapi, agent, prop: st
                 
                 
     
-async def evaluate_agent(cfg: pycoq.common.LocalKernelConfig, agent, prop: str, name: str, agent_parameters = {}, logfname=None):
+async def evaluate_agent(cfg: pycoq.common.LocalKernelConfig, agent, prop: str, name: str, agent_parameters = {}, logfname=None,
+                         pool: Optional[pycoq.pool.KernelPool] = None, timeout: Optional[float] = None):
     """
     input: 
     prop: proposition statement in coq - gallina grammar on a single line"
     agent: coq_env -> coq_env 
+    pool: if given the kernel is taken prewarmed from the pool
+    timeout: deadline in seconds of each coq-serapi command, a tactic past it fails with CoqTimeout
 
     creates coq env and loads the proposition statement 
     calls agent and pass env to the agent
@@ -89,7 +95,9 @@ async def evaluate_agent(cfg: pycoq.common.LocalKernelConfig, agent, prop: str,
     #  (-2, None) agent was not called because coq did not parse the theorem statement
     """
 
-    async with pycoq.serapi.CoqSerapi(cfg, logfname=logfname) as coq:
+    session = (pycoq.serapi.CoqSerapi(cfg, logfname=logfname, timeout=timeout) if pool is None
+               else pool.coq_serapi(cfg, logfname=logfname, timeout=timeout))
+    async with session as coq:
         _, _, coq_exc, _ = await coq.execute(prop)
         if len(coq_exc) > 0:
             logging.debug("evaluate_agent: Error in proposition")
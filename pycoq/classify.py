@@ -0,0 +1,196 @@
+'''
+lexical classification of coq sentences
+
+classify() tags the consecutive sentences of a file (as split by pycoq.split) from their first
+keywords and the number of proofs opened before them, without a kernel:
+
+    statement    Theorem, Lemma, ..., Goal, Next Obligation, a Definition without := body
+    definition   Definition, Fixpoint, ... with a := body
+    proof        Proof. / Proof using ... / Proof with ...
+    proof_end    Qed, Defined, Admitted, Abort, Save, Proof <term>.
+    bullet       only bullets or braces (- + * { }), as split by coq-serapi
+    tactic       any other sentence in a proof
+    vernac       any other sentence out of a proof
+
+a sentence the lexical rules cannot decide (an Instance without body may or may not open a proof,
+a command of a plugin may open one, a tactic out of a proof or a Qed without a proof mean an
+opening was missed) is tagged ambiguous; verify_tags() decides the ambiguous tags with a kernel
+from the transition of the goals around them ([] -> str opens a proof, str -> [] closes it), the
+other sentences are executed in chunks without goal queries
+
+example:
+    tags = classify(pycoq.split.coq_stmts_of_source('Basics.v'))
+    [tag.kind for tag in tags]    # ['vernac', ..., 'statement', 'proof', 'tactic', 'proof_end', ...]
+    tags[i].coarse                # 'vernac' | 'proof_start' | 'tactic' | 'proof_end'
+'''
+import logging
+import re
+
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import pycoq.split
+
+
+STATEMENT = 'statement'
+DEFINITION = 'definition'
+PROOF = 'proof'
+PROOF_END = 'proof_end'
+BULLET = 'bullet'
+TACTIC = 'tactic'
+VERNAC = 'vernac'
+
+# coarse kinds of the sentence index (see pycoq.sentence_index)
+COARSE_VERNAC = 'vernac'
+COARSE_PROOF_START = 'proof_start'
+COARSE_TACTIC = 'tactic'
+COARSE_PROOF_END = 'proof_end'
+
+COARSE_KINDS = {STATEMENT: COARSE_PROOF_START, DEFINITION: COARSE_VERNAC, PROOF: COARSE_TACTIC,
+                PROOF_END: COARSE_PROOF_END, BULLET: COARSE_TACTIC, TACTIC: COARSE_TACTIC,
+                VERNAC: COARSE_VERNAC}
+
+STATEMENT_KEYWORDS = {'Theorem', 'Lemma', 'Fact', 'Remark', 'Corollary', 'Proposition',
+                      'Property', 'Example', 'Goal', 'Derive'}
+
+# definitions open a proof when they have no body (no :=)
+DEFINITION_KEYWORDS = {'Definition', 'Fixpoint', 'CoFixpoint', 'Let', 'Instance'}
+
+# without body these may not open a proof (an Instance of a class without fields)
+AMBIGUOUS_DEFINITION_KEYWORDS = {'Instance'}
+
+# commands of plugins and sentences with two keywords that may open a proof
+AMBIGUOUS_KEYWORDS = {'Equations', 'Function', 'Obligation', 'Solve', 'Existing'}
+
+PROOF_END_KEYWORDS = {'Qed', 'Defined', 'Admitted', 'Abort', 'Save'}
+
+# Proof. and the Proof forms that do not close the proof
+PROOF_PATTERN = re.compile(r'Proof\s*(\.|using\b|with\b)')
+
+# bullets and braces before the keyword of a sentence
+# (the split of pycoq.split leaves the bullets and braces that close a proof in front of its Qed)
+BULLETS_PATTERN = re.compile(r'\s*((?:[-+*]+|[{}]|\d+\s*:\s*\{|\s+)*)')
+# attributes and modifiers before the keyword of a sentence
+ATTRIBUTES_PATTERN = re.compile(r'(#\[[^\]]*\]\s*|(Local|Global|Program|Polymorphic|Monomorphic)\s+)*')
+KEYWORDS_PATTERN = re.compile(r'([A-Za-z_][\w\']*)(?:\s+([A-Za-z_][\w\']*))?')
+
+
+class SentenceTag(NamedTuple):
+    ''' tag of a sentence: its kind, first keyword, bullets and braces before the keyword,
+    the number of proofs open before it and if the lexical rules could not decide its kind
+    '''
+    kind: str
+    keyword: str
+    bullets: str
+    depth: int
+    ambiguous: bool = False
+
+    @property
+    def coarse(self) -> str:
+        return COARSE_KINDS[self.kind]
+
+    @property
+    def opens_proof(self) -> bool:
+        return self.kind == STATEMENT
+
+    @property
+    def closes_proof(self) -> bool:
+        return self.kind == PROOF_END
+
+
+def lexical_kind(text: str, keyword: str, second: str, bullets: str, depth: int):
+    ''' (kind, ambiguous) of the sentence text without comments, bullets and attributes '''
+    if not keyword:
+        if bullets:
+            return BULLET, depth == 0
+        return (TACTIC, False) if depth > 0 else (VERNAC, False)
+    if keyword in STATEMENT_KEYWORDS or (keyword, second) in {('Next', 'Obligation'), ('Add', 'Morphism'),
+                                                             ('Add', 'Parametric')}:
+        return STATEMENT, False
+    if keyword in DEFINITION_KEYWORDS:
+        if ':=' in text:
+            return DEFINITION, False
+        return STATEMENT, keyword in AMBIGUOUS_DEFINITION_KEYWORDS
+    if keyword in PROOF_END_KEYWORDS:
+        return PROOF_END, depth == 0
+    if keyword == 'Proof':
+        if PROOF_PATTERN.match(text):
+            return PROOF, depth == 0
+        return PROOF_END, depth == 0
+    if depth > 0:
+        return TACTIC, False
+    return VERNAC, keyword in AMBIGUOUS_KEYWORDS or keyword[0].islower()
+
+
+def classify(stmts: Sequence[str], kinds: Optional[Dict[int, str]] = None) -> List[SentenceTag]:
+    '''
+    tags the consecutive sentences stmts of a file (see the module docstring);
+    kinds gives the kind of some sentences by index (e.g. decided by verify_tags()),
+    these are not ambiguous and the depth of the sentences after them follows them
+    '''
+    kinds = {} if kinds is None else kinds
+    tags = []
+    depth = 0
+    for i, stmt in enumerate(stmts):
+        text = pycoq.split.remove_comment(stmt)
+        match = BULLETS_PATTERN.match(text)
+        bullets = ''.join(match.group(1).split())
+        text = text[match.end():]
+        text = text[ATTRIBUTES_PATTERN.match(text).end():]
+        match = KEYWORDS_PATTERN.match(text)
+        keyword, second = (match.group(1), match.group(2)) if match else ('', None)
+        if i in kinds:
+            kind, ambiguous = kinds[i], False
+        else:
+            kind, ambiguous = lexical_kind(text, keyword, second, bullets, depth)
+        tags.append(SentenceTag(kind, keyword, bullets, depth, ambiguous))
+        if kind == STATEMENT:
+            depth += 1
+        elif kind == PROOF_END:
+            depth = 0 if (keyword, second) == ('Abort', 'All') else max(depth - 1, 0)
+    return tags
+
+
+def kind_of_goals(tag: SentenceTag, goals_before, goals_after) -> str:
+    ''' kind of the sentence of tag from the goals before and after it (str in proof mode, [] out of it) '''
+    if isinstance(goals_before, list) and isinstance(goals_after, str):
+        return STATEMENT
+    if isinstance(goals_before, str) and isinstance(goals_after, list):
+        return PROOF_END
+    if isinstance(goals_after, str):
+        return tag.kind if tag.kind in (STATEMENT, PROOF, PROOF_END, BULLET) else TACTIC
+    return tag.kind if tag.kind == DEFINITION else VERNAC
+
+
+async def verify_tags(coq: 'pycoq.serapi.CoqSerapi', stmts: Sequence[str], tags: Optional[List[SentenceTag]] = None,
+                      timeout: Optional[float] = None) -> List[SentenceTag]:
+    '''
+    decides the ambiguous tags of stmts (classify(stmts) by default) with the kernel of coq:
+    the sentences are executed from the current state of coq, the goals are queried only around
+    the ambiguous ones; every decision reclassifies the sentences after it, which may make them
+    ambiguous in turn; the tags from a sentence that fails on remain lexical (and ambiguous if they were);
+    coq is restored to its state of the call (CoqSerapi.reset_to())
+    '''
+    tags = classify(stmts) if tags is None else tags
+    kinds: Dict[int, str] = {}
+    done = 0
+    baseline = coq.tip()
+    try:
+        while True:
+            i = next((i for i in range(done, len(tags)) if tags[i].ambiguous), None)
+            if i is None:
+                break
+            _, _, coqexns, _ = await coq.execute_many(list(stmts[done:i]), timeout=timeout)
+            if coqexns:
+                logging.warning(f"pycoq.classify: verification stopped before sentence {i}: {coqexns}")
+                break
+            goals_before = await coq.query_local_ctx_and_goals()
+            _, _, coqexns, _ = await coq.execute(stmts[i], timeout=timeout)
+            if coqexns:
+                logging.warning(f"pycoq.classify: verification stopped at sentence {i}: {coqexns}")
+                break
+            kinds[i] = kind_of_goals(tags[i], goals_before, await coq.query_local_ctx_and_goals())
+            done = i + 1
+            tags = classify(stmts, kinds)
+    finally:
+        await coq.reset_to(baseline)
+    return tags
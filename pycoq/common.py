@@ -4,7 +4,7 @@ import re
 
 from dataclasses_json import dataclass_json
 from dataclasses import dataclass, field
-from typing import List, Dict
+from typing import List, Dict, Optional
 from pycoq.pycoq_trace_config import CONTEXT_EXT
 
 # import pycoq.log
@@ -87,8 +87,10 @@ class LocalKernelConfig():
 
 @dataclass
 class RemoteKernelConfig():
-    hostname: str
-    port: int
+    """ address of a pycoq.remote.KernelServer, unix_path takes precedence over hostname, port """
+    hostname: str = 'localhost'
+    port: int = 8911
+    unix_path: Optional[str] = None
 
 
 def context_fname(target_fname):
@@ -144,13 +146,13 @@ def coqc_args(args: IQR) -> List[str]:
 
 def serapi_kernel_config(kernel='sertop', opam_switch=None, opam_root=None, args=None,
                          pwd=os.getcwd(), remote=False):
-    assert remote == False  # support for remote kernel not yet implemented
-
+    """ config of the sertop kernel command,
+    if remote the kernel is run by pycoq.remote.KernelServer in the environment of the server
+    """
     if opam_switch is None:
-        env = os.environ
         if args == None:
             args = []
-        return LocalKernelConfig(command=[kernel] + args, env=os.environ, pwd=pwd)
+        return LocalKernelConfig(command=[kernel] + args, env={} if remote else os.environ, pwd=pwd)
 
     executable = 'opam'
     root_prefix = [] if opam_root is None else ['--root', opam_root]
@@ -163,7 +165,7 @@ def serapi_kernel_config(kernel='sertop', opam_switch=None, opam_root=None, args
             + ['--', kernel]
             + args_suffix)
 
-    env = {'HOME': os.environ['HOME']}
+    env = {} if remote else {'HOME': os.environ['HOME']}
     return LocalKernelConfig(command=[executable] + args, env=env, pwd=pwd)
 
 
@@ -23,7 +23,9 @@ DEFAULT_CONFIG = defaultdict(None, {
     "log_level": 4,
     # "log_filename": Path('~/pycoq.log').expanduser()
     "log_filename": Path('~/data/pycoq.log').expanduser(),
-    "strace_logdir": Path('~/data/trace_log').expanduser()
+    "strace_logdir": Path('~/data/trace_log').expanduser(),
+    # cache of the sentence offsets of source files found by coq-serapi, see pycoq.split
+    "split_cachedir": Path('~/data/pycoq_split_cache').expanduser()
 })
 
 PYCOQ_CONFIG_FILE = os.path.join(os.getenv('HOME'), '.pycoq')
@@ -110,6 +112,10 @@ def get_strace_logdir():
     return get_var("strace_logdir")
 
 
+def get_split_cachedir():
+    return os.path.expandvars(os.path.expanduser(get_var("split_cachedir")))
+
+
 def touch_file(path2file: str):
     print('creating log file: ', path2file)
     Path(path2file).expanduser().touch()
@@ -0,0 +1,127 @@
+'''
+content addressed store of proof states as printed by coq-serapi (Query ((pp ((pp_format PpStr)))) Goals)
+
+the text of a proof state is split into entries: a hypothesis, a separator line, a conclusion, a blank
+line, each with its continuation lines (the following lines indented deeper than its first line)
+
+GoalStore interns every entry (text -> canonical str) and every proof state (tuple of canonical
+entries -> canonical ProofState), so consecutive proof states that share hypotheses or conclusions
+hold references to the same strings and equal proof states are the same object
+
+example:
+    store = GoalStore()
+    state = store.intern('\\n  n : nat\\n============================\\nn + 0 = n')
+    state.text() == '\\n  n : nat\\n============================\\nn + 0 = n'
+    state.goals() == [Goal(hyps=('  n : nat',), concl='n + 0 = n')]
+    store.memory().stored_bytes  # size of the canonical objects
+'''
+import re
+import sys
+
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Tuple
+
+
+SEPARATOR_PATTERN = re.compile(r'\s*={3,}\s*')
+
+
+class Goal(NamedTuple):
+    ''' hypotheses and conclusion of a goal, references to the canonical entries of the store '''
+    hyps: Tuple[str, ...]
+    concl: str
+
+
+class ProofState(tuple):
+    ''' proof state as the tuple of its canonical entries (the lines of the text with continuations) '''
+
+    def text(self) -> str:
+        return '\n'.join(self)
+
+    def goals(self) -> List[Goal]:
+        ''' the goals: hypotheses up to a separator, the conclusion after it up to a blank line '''
+        goals, hyps, concl, in_concl = [], [], [], False
+        for entry in self:
+            if SEPARATOR_PATTERN.fullmatch(entry):
+                in_concl = True
+            elif not entry.strip():
+                if in_concl:
+                    goals.append(Goal(tuple(hyps), '\n'.join(concl)))
+                    hyps, concl, in_concl = [], [], False
+            elif in_concl:
+                concl.append(entry)
+            else:
+                hyps.append(entry)
+        if in_concl:
+            goals.append(Goal(tuple(hyps), '\n'.join(concl)))
+        return goals
+
+
+@dataclass
+class GoalStoreStats:
+    ''' memory accounting of a GoalStore
+    stored_bytes is the size of the canonical entries and proof states held by the store,
+    text_bytes the size of the texts of all the interned proof states as independent strings
+    '''
+    n_interned: int
+    n_states: int
+    n_entries: int
+    stored_bytes: int
+    text_bytes: int
+
+    @property
+    def ratio(self) -> float:
+        ''' text_bytes / stored_bytes, the memory saved by the sharing '''
+        return self.text_bytes / self.stored_bytes if self.stored_bytes else 1.0
+
+
+def split_entries(text: str) -> List[str]:
+    ''' splits text into entries, the lines with their continuation lines '''
+    entries: List[str] = []
+    indent = None
+    for line in text.split('\n'):
+        line_indent = len(line) - len(line.lstrip())
+        if (indent is not None and line.strip() and line_indent > indent
+                and not SEPARATOR_PATTERN.fullmatch(line) and not SEPARATOR_PATTERN.fullmatch(entries[-1])):
+            entries[-1] += '\n' + line
+        else:
+            entries.append(line)
+            indent = line_indent if line.strip() else None
+    return entries
+
+
+class GoalStore():
+    ''' hash consing of proof states and their entries, see the module docstring '''
+
+    def __init__(self):
+        self._entries: Dict[str, str] = {}
+        self._states: Dict[ProofState, ProofState] = {}
+        self._n_interned = 0
+        self._text_bytes = 0
+
+    def intern(self, text: str) -> ProofState:
+        ''' returns the canonical proof state of text '''
+        self._n_interned += 1
+        self._text_bytes += sys.getsizeof(text)
+        entries = self._entries
+        state = ProofState(entries.setdefault(entry, entry) for entry in split_entries(text))
+        return self._states.setdefault(state, state)
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, state: ProofState):
+        return state in self._states
+
+    def clear(self):
+        self._entries.clear()
+        self._states.clear()
+        self._n_interned = 0
+        self._text_bytes = 0
+
+    def memory(self) -> GoalStoreStats:
+        stored_bytes = (sum(sys.getsizeof(entry) for entry in self._entries)
+                        + sum(sys.getsizeof(state) for state in self._states)
+                        + sys.getsizeof(self._entries) + sys.getsizeof(self._states))
+        return GoalStoreStats(n_interned=self._n_interned, n_states=len(self._states),
+                              n_entries=len(self._entries), stored_bytes=stored_bytes,
+                              text_bytes=self._text_bytes)
@@ -1,10 +1,13 @@
 import asyncio
 import dataclasses
+import os
+import signal
 import time
-from typing import Union
+from typing import Optional, Union
 
 from pycoq.common import LocalKernelConfig, RemoteKernelConfig
 from pycoq.common import TIMEOUT_TERMINATE
+from pycoq.stream import ChunkedLineReader, LazySexp, SPILL_THRESHOLD
 
 # import pycoq.log
 import logging
@@ -16,12 +19,19 @@ PIPE_BUFFER_LIMIT = 2048 * 1024 * 1024  # 2048 Mb
 from pdb import set_trace as st
 
 
+async def readline_bytes(stream, timeout=None) -> bytes:
+    """ reads line from stream without decoding
+    raises asyncio.TimeoutError if timeout is exceeded
+    """
+    return await asyncio.wait_for(stream.readline(), timeout=timeout)
+
+
 async def readline(stream, timeout=None) -> str:
     """ reads line from stream 
     raises asyncio.TimeoutError if timeout is exceeded
     """
 
-    line = await asyncio.wait_for(stream.readline(), timeout=timeout)
+    line = await readline_bytes(stream, timeout)
     return line.decode()
 
 
@@ -45,7 +55,11 @@ async def readlines(stream, count=None, timeout=None, quiet=True):
 
 
 class LocalKernel():
-    """ implements interface readline, readlines, writeline to a local kernel """
+    """ implements interface readline, readlines, writeline to a local kernel
+
+    every line of the kernel stdout is handed to the reader, (Feedback ...) lines are dropped
+    by the reader of CoqSerapi according to its feedback policy (see pycoq.serapi.CoqSerapi)
+    """
 
     def __init__(self, cfg: LocalKernelConfig):
         self.cfg = cfg
@@ -57,6 +71,11 @@ class LocalKernel():
     async def __aexit__(self, exception_type, exception_value, traceback):
         await self.terminate(timeout=TIMEOUT_TERMINATE)
 
+    @property
+    def returncode(self):
+        """ returncode of the kernel process, None if it is running or not started """
+        return None if self._proc is None else self._proc.returncode
+
     async def start(self):
         """
         Starts serapi process through the "sertop" command in cmd. What seems to happen is that sertop is a interactive
@@ -80,8 +99,10 @@ class LocalKernel():
             env=env,
             cwd=cwd,
             limit=PIPE_BUFFER_LIMIT,
+            # the kernel leads a process group: signals reach sertop behind a wrapper (opam exec)
+            start_new_session=True,
         )
-        self._reader = self._proc.stdout
+        self._reader = ChunkedLineReader(self._proc.stdout)
         self._reader_err = self._proc.stderr
         self._writer = self._proc.stdin
         logging.info(f"process with {self._proc.pid} started as")
@@ -99,6 +120,16 @@ class LocalKernel():
         line = await readline(self._reader, timeout)
         return line
 
+    async def readline_bytes(self, timeout=None) -> bytes:
+        """ reads line from kernel stdout without decoding """
+        return await readline_bytes(self._reader, timeout)
+
+    async def readline_sexp(self, timeout=None, spill_threshold=SPILL_THRESHOLD) -> Optional[LazySexp]:
+        """ reads line from kernel stdout as a pycoq.stream.LazySexp, spilled to a temporary file
+        if it is longer than spill_threshold bytes; None at EOF
+        """
+        return await asyncio.wait_for(self._reader.readline_sexp(spill_threshold), timeout=timeout)
+
     async def readline_err(self, timeout=None) -> str:
         """ reads line from kernel stderr """
         line = await readline(self._reader_err, timeout)
@@ -129,6 +160,28 @@ class LocalKernel():
         data = line + '\n'
         await self.write(data)
 
+    def _signal_group(self, sig):
+        """ sends sig to the process group of the kernel (the wrapper command and sertop) """
+        os.killpg(self._proc.pid, sig)
+
+    async def interrupt(self):
+        """ sends SIGINT to the kernel process group, coq-serapi answers the command in process with CoqExn """
+        if self._proc is not None and self._proc.returncode is None:
+            try:
+                self._signal_group(signal.SIGINT)
+            except ProcessLookupError:
+                pass
+
+    async def wait(self):
+        """ waits for the kernel process to exit, returns its returncode """
+        return await self._proc.wait()
+
+    async def respawn(self) -> 'LocalKernel':
+        """ returns a new started kernel with the config of this one """
+        kernel = LocalKernel(self.cfg)
+        await kernel.start()
+        return kernel
+
     async def _nice_terminate(self, timeout=None):
         self._writer.write_eof()
         await self._writer.wait_closed()
@@ -141,11 +194,11 @@ class LocalKernel():
             await asyncio.wait_for(self._nice_terminate(), timeout=timeout)
         except (asyncio.TimeoutError, BrokenPipeError, ConnectionResetError):
             try:
-                self._proc.terminate()
+                self._signal_group(signal.SIGTERM)
                 await asyncio.wait_for(self._proc.wait(), timeout=timeout)
             except  asyncio.TimeoutError:
                 try:
-                    self._proc.kill()
+                    self._signal_group(signal.SIGKILL)
                     await asyncio.wait_for(self._proc.wait(), timeout=timeout)
                 except asyncio.TimeoutError:
                     raise TimeoutError(f"LocalKernel.terminate() did not succeed with timeout={timeout}")
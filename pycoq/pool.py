@@ -0,0 +1,130 @@
+'''
+pool of prewarmed coq-serapi kernels
+
+starting sertop through opam and loading the prelude dominates short sessions,
+a KernelPool keeps idle kernels already started for each kernel config
+and refills them in the background while the handed out ones are in use
+'''
+import asyncio
+import logging
+
+from contextlib import asynccontextmanager
+from typing import Dict, List, Set, Tuple
+
+import pycoq.serapi
+from pycoq.common import LocalKernelConfig, TIMEOUT_TERMINATE
+from pycoq.kernel import LocalKernel
+
+
+def pool_key(cfg: LocalKernelConfig) -> Tuple:
+    """ kernels are interchangeable if they run the same command in the same directory and environment:
+    the command of pycoq.opam.get_opam_serapi_cfg_for_coq_ctxt contains the switch,
+    the IQR load path arguments and the topfile, the environment may select the switch (OPAMSWITCH, PATH)
+    """
+    return (tuple(cfg.command), cfg.pwd, tuple(sorted((cfg.env or {}).items())))
+
+
+class KernelPool():
+    """
+    keeps size started idle kernels ready for each kernel config
+
+    kernels are not reused: a session runs on a kernel of its own and release() terminates it,
+    the pool only starts the kernels of the next sessions ahead of time
+
+    usage:
+    ```
+        async with KernelPool(size=2) as pool:
+            async with pool.coq_serapi(cfg) as coq:
+                await coq.execute(stmt)
+    ```
+    """
+
+    def __init__(self, size: int = 1):
+        self.size = size
+        self._idle: Dict[Tuple, List[LocalKernel]] = {}
+        self._starting: Dict[Tuple, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.close()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def prewarm(self, cfg: LocalKernelConfig):
+        """ starts kernels in the background until size kernels are idle or starting for cfg """
+        key = pool_key(cfg)
+        missing = self.size - len(self._idle.get(key, [])) - self._starting.get(key, 0)
+        for _ in range(missing):
+            self._starting[key] = self._starting.get(key, 0) + 1
+            self._spawn(self._start_kernel(key, cfg))
+
+    async def _start_kernel(self, key: Tuple, cfg: LocalKernelConfig):
+        kernel = LocalKernel(cfg)
+        try:
+            await kernel.start()
+        except Exception as exc:
+            logging.error(f"KernelPool: failed to start kernel {cfg.command}: {exc}")
+            return
+        finally:
+            self._starting[key] -= 1
+        self._idle.setdefault(key, []).append(kernel)
+
+    def _take_idle(self, key: Tuple):
+        idle = self._idle.get(key, [])
+        while idle:
+            kernel = idle.pop(0)
+            if kernel.returncode is None:
+                return kernel
+            logging.info(f"KernelPool: discarding idle kernel that exited with code {kernel.returncode}")
+        return None
+
+    async def acquire(self, cfg: LocalKernelConfig) -> LocalKernel:
+        """ returns a started kernel for cfg, prewarmed if one is idle,
+        and refills the pool in the background
+        """
+        key = pool_key(cfg)
+        kernel = self._take_idle(key)
+        if kernel is None:
+            kernel = LocalKernel(cfg)
+            await kernel.start()
+        self.prewarm(cfg)
+        return kernel
+
+    def release(self, kernel: LocalKernel):
+        """ terminates a kernel handed out by the pool in the background """
+        if kernel.returncode is None:
+            self._spawn(kernel.terminate(timeout=TIMEOUT_TERMINATE))
+
+    @asynccontextmanager
+    async def kernel(self, cfg: LocalKernelConfig) -> LocalKernel:
+        """ async context manager handing out a started kernel for cfg """
+        kernel = await self.acquire(cfg)
+        try:
+            yield kernel
+        finally:
+            self.release(kernel)
+
+    @asynccontextmanager
+    async def coq_serapi(self, cfg: LocalKernelConfig, **kwargs) -> pycoq.serapi.CoqSerapi:
+        """ async context manager handing out CoqSerapi on a pooled kernel for cfg,
+        kwargs are passed to CoqSerapi
+        """
+        async with self.kernel(cfg) as kernel:
+            async with pycoq.serapi.CoqSerapi(kernel, **kwargs) as coq:
+                yield coq
+
+    async def close(self):
+        """ terminates idle kernels and waits for background starts and terminations """
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        idle, self._idle = self._idle, {}
+        await asyncio.gather(*(kernel.terminate(timeout=TIMEOUT_TERMINATE)
+                               for kernels in idle.values() for kernel in kernels),
+                             return_exceptions=True)
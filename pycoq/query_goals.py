@@ -1,264 +1,378 @@
-# ''' helper functions to parse return of coq-serapi Query () Goals '''
-#
-# import numpy as np
-#
-# from dataclasses_json import dataclass_json
-# from dataclasses import dataclass
-# from typing import List, Tuple, Optional
-#
-#
-# import serlib.parser
-#
-#
-#
-# @dataclass
-# class SExpr:
-#     post_fix: np.array
-#     ann: np.array
-#     par: serlib.parser.SExpParser
-#     root: int
-#
-#     def children(self):
-#         for child in serlib.cparser.children(self.post_fix, self.ann, self.root):
-#             yield SExpr(self.post_fix, self.ann, self.par, child)
-#
-#
-#     def __repr__(self):
-#         return (repr(list(self.children())) if (self.post_fix[self.root] <= 0) else
-#                 self.par.inv_dict[self.post_fix[self.root]].decode())
-#
-#     def is_leaf(self):
-#         return self.post_fix[self.root] > 0
-#
-#
-#
-# Constr = SExpr
-# Info = SExpr
-# Name = SExpr
-#
-# @dataclass_json
-# @dataclass
-# class Hyp:
-#     '''
-#     coq-serapi/serlib/ser_goals.ml 'a hyp = (Names.Id.t list * 'a option * 'a)
-#     '''
-#     ids: List[Name]
-#     define: Optional[Constr]
-#     typ: Constr
-#
-# @dataclass_json
-# @dataclass
-# class RGoal:
-#     '''
-#     coq-serapi/serlib/ser-goals  type Constr.t reified_goal
-#     '''
-#     info: Info
-#     target: Constr
-#     hyp: List[Hyp]
-#
-# @dataclass_json
-# @dataclass
-# class SerapiGoals:
-#     ''' coq-serapi/serlib/ser_goals.ml   type Constr.t reified_goal ser_goals '''
-#     goals: List[RGoal]
-#     stack: List[Tuple[List[RGoal], List[RGoal]]]
-#     shelf: List[RGoal]
-#     given_up: List[RGoal]
-#     bullet: Optional[str]
-#
-#     def empty(self) -> bool:
-#         return len(self.goals) == 0 and len(self.stack) == 0 and len(self.shelf) == 0
-#
-#
-#
-# def srepr(par: serlib.parser.SExpParser, post_fix, ann, root, output) -> str:
-#     if root == None:
-#         return None
-#     if output == str:
-#         start_pos = ann[root]
-#         end_pos = root + 1
-#         return par.to_sexp(post_fix[start_pos:end_pos])
-#     elif output == int:
-#         if isinstance(root, int):
-#             return root
-#         elif isinstance(root, np.int32):
-#             return root.item()
-#         else:
-#             raise ValueError(f"Root type of {root} is not int nor numpy.int32 for compressed int repr")
-#     else:
-#         return SExpr(post_fix, ann, par, root)
-#
-#
-#
-#
-#
-# def parse_ids(par, post_fix, ann, root, output) -> List[Name]:
-#     '''
-#     returns a list of id names
-#     '''
-#     id_list = serlib.cparser.children(post_fix, ann, root).tolist()
-#     return [srepr(par, post_fix, ann, id, output) for id in id_list]
-#
-# def parse_hyp(par, post_fix, ann, root, output) ->Hyp:
-#     '''
-#     returns a hypotheses
-#     '''
-#     _ids, _define, _typ = serlib.cparser.children(post_fix, ann, root).tolist()
-#     _define = serlib.cparser.children(post_fix, ann, _define).tolist()
-#     if len(_define) == 0:
-#         _define = None
-#     elif len(_define) > 1:
-#         raise ValueError(f"definition of hypothesis does not match Optional")
-#     else:
-#         _define = _define[0]
-#     return Hyp(ids=parse_ids(par, post_fix, ann, _ids, output), define=srepr(par, post_fix, ann, _define, output), typ=srepr(par, post_fix, ann, _typ, output))
-#
-#
-# def parse_list_hyp(par, post_fix, ann, list_hyp, output) -> List[Hyp]:
-#     '''
-#     returns a list of hypotheses
-#     '''
-#     _hyps = serlib.cparser.children(post_fix, ann, list_hyp).tolist()
-#     return [parse_hyp(par, post_fix, ann, _hyp, output) for _hyp in _hyps]
-#
-# def parse_rgoal(par, post_fix, ann, root, output) -> RGoal:
-#     '''
-#     returns reified goal
-#     '''
-#     _info, _ty, _list_hyp = serlib.cparser.children(post_fix, ann, root).tolist()
-#
-#     head, info = serlib.cparser.children(post_fix, ann, _info).tolist()
-#     if par.to_sexp([post_fix[head]]) != 'info':
-#         raise ValueError("the input field {_info} does not match info")
-#
-#
-#     head, ty = serlib.cparser.children(post_fix, ann, _ty).tolist()
-#     if par.to_sexp([post_fix[head]]) != 'ty':
-#         raise ValueError("the input field {_ty} does not match ty")
-#
-#     head, list_hyp = serlib.cparser.children(post_fix, ann, _list_hyp).tolist()
-#     if par.to_sexp([post_fix[head]]) != 'hyp':
-#         raise ValueError("the input field {_list_hyp} does not match hyp")
-#
-#     return RGoal(info=srepr(par, post_fix, ann, info, output),
-#                  target=srepr(par, post_fix, ann, ty, output),
-#                  hyp=parse_list_hyp(par, post_fix, ann, list_hyp, output))
-#
-# def parse_goals(par, post_fix, ann, node, output):
-#     '''
-#     returns a list of reified goals
-#     '''
-#     goals = serlib.cparser.children(post_fix, ann, node).tolist()
-#     return [parse_rgoal(par, post_fix, ann, goal, output) for goal in goals]
-#
-#
-#
-# def parse_stack(par, post_fix, ann, root, output) -> List[Tuple[List[RGoal], List[RGoal]]]:
-#     '''
-#     stack of goal views is implemented as a list
-#     focusing on a goal moves other goals from a current view on top of the stack
-#
-#     a stack element consists of hidden view goals
-#     it is implemented as a pair of List of RGoals
-#
-#     the second element of the pair is a hidden view at a given stack depth
-#     consisting of the list of goals
-#     '''
-#     items = serlib.cparser.children(post_fix, ann, root).tolist()
-#     res = []
-#     for item in items:
-#         _first, _second = serlib.cparser.children(post_fix, ann, item).tolist()
-#         first = parse_goals(par, post_fix, ann, _first, output)
-#         second = parse_goals(par, post_fix, ann, _second, output)
-#         res.append((first, second))
-#     return res
-#
-#
-# def parse_serapi_goals(par: serlib.parser.SExpParser,
-#                        post_fix: np.ndarray,
-#                        ann: np.ndarray,
-#                        output: type) -> SerapiGoals:
-#     '''
-#
-#     parses the return of coq-serapi command Query () Goals
-#     according to the specification in
-#     https://github.com/ejgallego/coq-serapi/blob/v8.13/serapi/serapi_protocol.ml
-#     https://github.com/ejgallego/coq-serapi/blob/v8.13/serapi/serapi_goals.ml
-#
-#
-#     Query () Goals returns [CoqGoal g]
-#
-#     CoqGoal of Constr.t serapi_goals.reified_goal serapi_goals.ser_goals
-#
-#     type 'a hyp = (Names.Id.t list * 'a option * 'a)
-#
-#     type info =
-#     { evar : Evar.t
-#     ; name : Names.Id.t option
-#     }
-#
-#     type 'a reified_goal =
-#     { info : info
-#     ; ty   : 'a
-#     ; hyp  : 'a hyp list
-#     }
-#
-#     type 'a ser_goals =
-#     { goals : 'a list
-#     ; stack : ('a list * 'a list) list
-#     ; shelf : 'a list
-#     ; given_up : 'a list
-#     ; bullet : Pp.t option
-#     }
-#     '''
-#
-#     root = ann.shape[0] - 1
-#     head, args = serlib.cparser.children(post_fix, ann, root).tolist()
-#     if par.to_sexp([post_fix[head]]) != 'ObjList':
-#         raise ValueError("the input s-expression does not match ObjList")
-#
-#     goal = serlib.cparser.children(post_fix, ann, args).tolist()
-#     if len(goal) == 0:
-#         return None
-#     if len(goal) != 1:
-#         raise ValueError(f"the input :{goal}: does not match [CoqGoal g] specification")
-#
-#     coq_goal = goal[0]
-#     head, args = serlib.cparser.children(post_fix, ann, coq_goal).tolist()
-#
-#     if par.to_sexp([post_fix[head]]) != 'CoqGoal':
-#         raise ValueError(f"the input {coq_goal}  not match CoqGoal()")
-#
-#     args = serlib.cparser.children(post_fix, ann, args).tolist()
-#
-#     if len(args) != 5:
-#         raise ValueError(f"can't match {len(args)} with goals, stack, shelf, given_up, bullet")
-#
-#     _goals, _stack, _shelf, _given_up, _bullet = args
-#
-#     head, goals = serlib.cparser.children(post_fix, ann, _goals)
-#     if par.to_sexp([post_fix[head]]) != 'goals':
-#         raise ValueError(f"can't match {head} with goals")
-#
-#     head, stack = serlib.cparser.children(post_fix, ann, _stack)
-#     if par.to_sexp([post_fix[head]]) != 'stack':
-#         raise ValueError(f"can't match {head} with stack")
-#
-#     head, shelf = serlib.cparser.children(post_fix, ann, _shelf,)
-#     if par.to_sexp([post_fix[head]]) != 'shelf':
-#         raise ValueError(f"can't match {head} with shelf")
-#
-#     head, given_up = serlib.cparser.children(post_fix, ann,_given_up)
-#     if par.to_sexp([post_fix[head]]) != 'given_up':
-#         raise ValueError(f"can't match {head} with given_up")
-#
-#     head, bullet = serlib.cparser.children(post_fix, ann,_bullet)
-#     if par.to_sexp([post_fix[head]]) != 'bullet':
-#         raise ValueError(f"can't match {head} with bullet")
-#
-#     return SerapiGoals(goals=parse_goals(par, post_fix, ann, goals, output),
-#                        stack=parse_stack(par, post_fix, ann, stack, output),
-#                        shelf=parse_goals(par, post_fix, ann, shelf, output),
-#                        given_up=parse_goals(par, post_fix, ann, given_up, output),
-#                        bullet=srepr(par, post_fix, ann, bullet, output))
-#
+''' helper functions to parse return of coq-serapi Query () Goals
+
+The response is encoded once into the postfix representation of
+serlib.parser.SExpParser and annotated. SerapiGoalsView and the views
+it hands out (goals, hypotheses, targets) are node indices into these
+shared arrays resolved on access: len(view.goals) or view.goals[0].target
+do not build the rest of the tree. parse_serapi_goals materializes the
+SerapiGoals dataclass from the view.
+'''
+
+import functools
+
+import numpy as np
+
+from dataclasses_json import dataclass_json
+from dataclasses import dataclass
+from typing import List, Tuple, Optional, Sequence, Union
+
+
+import serlib.parser
+import serlib.cparser
+
+
+@dataclass
+class SExpr:
+    post_fix: np.array
+    ann: np.array
+    par: serlib.parser.SExpParser
+    root: int
+
+    def children(self):
+        for child in serlib.cparser.children(self.post_fix, self.ann, self.root):
+            yield SExpr(self.post_fix, self.ann, self.par, child)
+
+    def __repr__(self):
+        return (repr(list(self.children())) if (self.post_fix[self.root] <= 0) else
+                self.par.inv_dict[self.post_fix[self.root]].decode())
+
+    def is_leaf(self):
+        return self.post_fix[self.root] > 0
+
+    def postfix(self) -> np.ndarray:
+        ''' postfix encoding of the subtree, a view of the shared buffer '''
+        return self.post_fix[self.ann[self.root]:self.root + 1]
+
+    def sexp(self) -> str:
+        return self.par.to_sexp(self.postfix())
+
+
+Constr = SExpr
+Info = SExpr
+Name = SExpr
+
+@dataclass_json
+@dataclass
+class Hyp:
+    '''
+    coq-serapi/serlib/ser_goals.ml 'a hyp = (Names.Id.t list * 'a option * 'a)
+    '''
+    ids: List[Name]
+    define: Optional[Constr]
+    typ: Constr
+
+@dataclass_json
+@dataclass
+class RGoal:
+    '''
+    coq-serapi/serlib/ser-goals  type Constr.t reified_goal
+    '''
+    info: Info
+    target: Constr
+    hyp: List[Hyp]
+
+@dataclass_json
+@dataclass
+class SerapiGoals:
+    ''' coq-serapi/serlib/ser_goals.ml   type Constr.t reified_goal ser_goals '''
+    goals: List[RGoal]
+    stack: List[Tuple[List[RGoal], List[RGoal]]]
+    shelf: List[RGoal]
+    given_up: List[RGoal]
+    bullet: Optional[str]
+
+    def empty(self) -> bool:
+        return len(self.goals) == 0 and len(self.stack) == 0 and len(self.shelf) == 0
+
+
+
+def srepr(par: serlib.parser.SExpParser, post_fix, ann, root, output) -> str:
+    if root == None:
+        return None
+    if output == str:
+        start_pos = ann[root]
+        end_pos = root + 1
+        return par.to_sexp(post_fix[start_pos:end_pos])
+    elif output == int:
+        if isinstance(root, int):
+            return root
+        elif isinstance(root, np.int32):
+            return root.item()
+        else:
+            raise ValueError(f"Root type of {root} is not int nor numpy.int32 for compressed int repr")
+    else:
+        return SExpr(post_fix, ann, par, root)
+
+
+def children(post_fix, ann, root) -> List[int]:
+    return serlib.cparser.children(post_fix, ann, root).tolist()
+
+
+def match_field(par: serlib.parser.SExpParser, post_fix, ann, root, name: str) -> int:
+    '''
+    returns the value node of the record field (name value) at root
+    '''
+    fields = children(post_fix, ann, root)
+    if len(fields) != 2 or post_fix[fields[0]] != par.dict.get(name.encode(), -1):
+        raise ValueError(f"the input {srepr(par, post_fix, ann, root, str)} does not match ({name} _)")
+    return fields[1]
+
+
+class NodeView:
+    ''' node root of the annotated postfix encoding post_fix, ann of the parser par '''
+
+    def __init__(self, par: serlib.parser.SExpParser, post_fix: np.ndarray, ann: np.ndarray, root: int):
+        self.par = par
+        self.post_fix = post_fix
+        self.ann = ann
+        self.root = root
+
+    def sexpr(self, node: Optional[int] = None) -> SExpr:
+        return SExpr(self.post_fix, self.ann, self.par, self.root if node is None else node)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({srepr(self.par, self.post_fix, self.ann, self.root, str)})"
+
+
+class ListView(NodeView, Sequence):
+    ''' sequence of the views item(par, post_fix, ann, node) of the elements of the list at root '''
+
+    def __init__(self, par, post_fix, ann, root, item):
+        super().__init__(par, post_fix, ann, root)
+        self._item = item
+
+    def __len__(self):
+        return -int(self.post_fix[self.root])
+
+    @functools.cached_property
+    def _children(self) -> List[int]:
+        return children(self.post_fix, self.ann, self.root)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(self.par, self.post_fix, self.ann, node) for node in self._children[index]]
+        return self._item(self.par, self.post_fix, self.ann, self._children[index])
+
+
+class HypView(NodeView):
+    ''' view of 'a hyp = (Names.Id.t list * 'a option * 'a) '''
+
+    @functools.cached_property
+    def _parts(self) -> List[int]:
+        parts = children(self.post_fix, self.ann, self.root)
+        if len(parts) != 3:
+            raise ValueError(f"can't match {self} with ids, define, typ")
+        return parts
+
+    @property
+    def ids(self) -> List[Name]:
+        return [self.sexpr(node) for node in children(self.post_fix, self.ann, self._parts[0])]
+
+    @property
+    def define(self) -> Optional[Constr]:
+        define = children(self.post_fix, self.ann, self._parts[1])
+        if len(define) > 1:
+            raise ValueError(f"definition of hypothesis does not match Optional")
+        return self.sexpr(define[0]) if define else None
+
+    @property
+    def typ(self) -> Constr:
+        return self.sexpr(self._parts[2])
+
+    def materialize(self, output=SExpr) -> Hyp:
+        ids, define, typ = self._parts
+        define = children(self.post_fix, self.ann, define)
+        if len(define) > 1:
+            raise ValueError(f"definition of hypothesis does not match Optional")
+        return Hyp(ids=[srepr(self.par, self.post_fix, self.ann, node, output)
+                        for node in children(self.post_fix, self.ann, ids)],
+                   define=srepr(self.par, self.post_fix, self.ann, define[0] if define else None, output),
+                   typ=srepr(self.par, self.post_fix, self.ann, typ, output))
+
+
+class RGoalView(NodeView):
+    ''' view of the reified goal {info; ty; hyp} '''
+
+    @functools.cached_property
+    def _parts(self) -> List[int]:
+        parts = children(self.post_fix, self.ann, self.root)
+        if len(parts) != 3:
+            raise ValueError(f"can't match {self} with info, ty, hyp")
+        return [match_field(self.par, self.post_fix, self.ann, part, name)
+                for part, name in zip(parts, ['info', 'ty', 'hyp'])]
+
+    @property
+    def info(self) -> Info:
+        return self.sexpr(self._parts[0])
+
+    @property
+    def target(self) -> Constr:
+        return self.sexpr(self._parts[1])
+
+    @property
+    def hyps(self) -> ListView:
+        return ListView(self.par, self.post_fix, self.ann, self._parts[2], HypView)
+
+    def materialize(self, output=SExpr) -> RGoal:
+        info, target, _ = self._parts
+        return RGoal(info=srepr(self.par, self.post_fix, self.ann, info, output),
+                     target=srepr(self.par, self.post_fix, self.ann, target, output),
+                     hyp=[hyp.materialize(output) for hyp in self.hyps])
+
+
+class SerapiGoalsView:
+    '''
+    view of the return of coq-serapi command Query () Goals
+    (ObjList()) out of proof mode, otherwise (ObjList((CoqGoal ser_goals))) with
+
+    type 'a ser_goals =
+    { goals : 'a list
+    ; stack : ('a list * 'a list) list
+    ; shelf : 'a list
+    ; given_up : 'a list
+    ; bullet : Pp.t option
+    }
+
+    goals, shelf, given_up are sequences of RGoalView
+    '''
+
+    FIELDS = ['goals', 'stack', 'shelf', 'given_up', 'bullet']
+
+    def __init__(self, par: serlib.parser.SExpParser, post_fix: np.ndarray, ann: Optional[np.ndarray] = None):
+        self.par = par
+        self.post_fix = post_fix
+        self.ann = serlib.cparser.annotate(post_fix) if ann is None else ann
+
+        root = self.ann.shape[0] - 1
+        head, args = children(post_fix, self.ann, root)
+        if post_fix[head] != par.dict.get(b'ObjList', -1):
+            raise ValueError("the input s-expression does not match ObjList")
+
+        goal = children(post_fix, self.ann, args)
+        if len(goal) > 1:
+            raise ValueError(f"the input :{goal}: does not match [CoqGoal g] specification")
+        self._fields: Optional[List[int]] = None
+        if goal:
+            head, args = children(post_fix, self.ann, goal[0])
+            if post_fix[head] != par.dict.get(b'CoqGoal', -1):
+                raise ValueError(f"the input {goal[0]}  not match CoqGoal()")
+            args = children(post_fix, self.ann, args)
+            if len(args) != 5:
+                raise ValueError(f"can't match {len(args)} with goals, stack, shelf, given_up, bullet")
+            self._fields = [match_field(par, post_fix, self.ann, arg, name) for arg, name in zip(args, self.FIELDS)]
+
+    @classmethod
+    def of_sexp(cls, par: serlib.parser.SExpParser, serapi_goals: Union[str, bytes, memoryview]) -> 'SerapiGoalsView':
+        if isinstance(serapi_goals, str):
+            serapi_goals = serapi_goals.encode()
+        return cls(par, par.postfix_of_bytestring(serapi_goals))
+
+    def in_proof_mode(self) -> bool:
+        return self._fields is not None
+
+    def _goals(self, field: int) -> Sequence[RGoalView]:
+        if self._fields is None:
+            return ()
+        return ListView(self.par, self.post_fix, self.ann, self._fields[field], RGoalView)
+
+    @property
+    def goals(self) -> Sequence[RGoalView]:
+        return self._goals(0)
+
+    @property
+    def stack(self) -> List[Tuple[Sequence[RGoalView], Sequence[RGoalView]]]:
+        '''
+        stack of goal views is implemented as a list
+        focusing on a goal moves other goals from a current view on top of the stack
+
+        a stack element consists of hidden view goals
+        it is implemented as a pair of List of RGoals
+
+        the second element of the pair is a hidden view at a given stack depth
+        consisting of the list of goals
+        '''
+        if self._fields is None:
+            return []
+        res = []
+        for item in children(self.post_fix, self.ann, self._fields[1]):
+            first, second = children(self.post_fix, self.ann, item)
+            res.append((ListView(self.par, self.post_fix, self.ann, first, RGoalView),
+                        ListView(self.par, self.post_fix, self.ann, second, RGoalView)))
+        return res
+
+    @property
+    def shelf(self) -> Sequence[RGoalView]:
+        return self._goals(2)
+
+    @property
+    def given_up(self) -> Sequence[RGoalView]:
+        return self._goals(3)
+
+    @property
+    def bullet(self) -> Optional[SExpr]:
+        return None if self._fields is None else SExpr(self.post_fix, self.ann, self.par, self._fields[4])
+
+    def n_stack(self) -> int:
+        return 0 if self._fields is None else -int(self.post_fix[self._fields[1]])
+
+    def empty(self) -> bool:
+        return len(self.goals) == 0 and self.n_stack() == 0 and len(self.shelf) == 0
+
+    def materialize(self, output=SExpr) -> Optional[SerapiGoals]:
+        if self._fields is None:
+            return None
+        return SerapiGoals(goals=[goal.materialize(output) for goal in self.goals],
+                           stack=[([goal.materialize(output) for goal in first],
+                                   [goal.materialize(output) for goal in second])
+                                  for first, second in self.stack],
+                           shelf=[goal.materialize(output) for goal in self.shelf],
+                           given_up=[goal.materialize(output) for goal in self.given_up],
+                           bullet=srepr(self.par, self.post_fix, self.ann, self._fields[4], output))
+
+    def __repr__(self):
+        if self._fields is None:
+            return "SerapiGoalsView(not in proof mode)"
+        return f"SerapiGoalsView(goals={len(self.goals)}, stack={self.n_stack()}, shelf={len(self.shelf)})"
+
+
+def parse_serapi_goals(par: serlib.parser.SExpParser,
+                       post_fix: np.ndarray,
+                       ann: np.ndarray,
+                       output: type) -> SerapiGoals:
+    '''
+
+    parses the return of coq-serapi command Query () Goals
+    according to the specification in
+    https://github.com/ejgallego/coq-serapi/blob/v8.13/serapi/serapi_protocol.ml
+    https://github.com/ejgallego/coq-serapi/blob/v8.13/serapi/serapi_goals.ml
+
+
+    Query () Goals returns [CoqGoal g]
+
+    CoqGoal of Constr.t serapi_goals.reified_goal serapi_goals.ser_goals
+
+    type 'a hyp = (Names.Id.t list * 'a option * 'a)
+
+    type info =
+    { evar : Evar.t
+    ; name : Names.Id.t option
+    }
+
+    type 'a reified_goal =
+    { info : info
+    ; ty   : 'a
+    ; hyp  : 'a hyp list
+    }
+
+    type 'a ser_goals =
+    { goals : 'a list
+    ; stack : ('a list * 'a list) list
+    ; shelf : 'a list
+    ; given_up : 'a list
+    ; bullet : Pp.t option
+    }
+
+    the nodes are represented according to output: str (s-expression), int (node index in post_fix)
+    or SExpr; returns None out of proof mode
+    '''
+    return SerapiGoalsView(par, post_fix, ann).materialize(output)
@@ -0,0 +1,550 @@
+'''
+networked coq-serapi kernels
+
+KernelServer fronts local kernels (sertop processes) over TCP or a Unix socket,
+RemoteKernel implements the readline, readlines, writeline interface of
+pycoq.kernel.LocalKernel on top of a connection to a KernelServer;
+several RemoteKernel sessions can share one RemoteConnection
+
+the protocol is line based, every frame is
+
+    <op> <session> <payload>\n
+
+the kernel output lines are forwarded as they are (a coq-serapi response is one line),
+the other payloads are json encoded; the client reads the frames by chunks, an OUT line longer
+than the spill_threshold of its RemoteKernel is spilled to a temporary file while it is received
+
+client to server:
+    OPEN <session> <json of LocalKernelConfig>   starts a kernel for session
+    IN <session> <json string>                   writes line to the kernel stdin
+    INT <session>                                interrupts the kernel (SIGINT)
+    CLOSE <session>                              terminates the kernel
+server to client:
+    OPENED <session>                             kernel is started
+    OUT <session> <line>                         raw line from the kernel stdout
+    ERR <session> <line>                         raw line from the kernel stderr
+    EOF <session> <returncode>                   kernel stdout is closed
+    ERROR <session> <json string>                error message of the session, e.g. kernel failed to start,
+                                                 session is not open or its kernel exited,
+                                                 malformed frame (session -1 if it has none)
+
+the server starts only the kernel commands built by pycoq.opam for coq-serapi (see check_kernel_command),
+the environment of the kernel is the one of the server updated with the allowed variables of the client
+and its working directory must be inside one of the allowed directories of the server;
+the coq sentences sent to a kernel run with the privileges of the server, serve only trusted clients
+
+example:
+```
+    pycoq-kernel-server --port 8911 &
+
+    remote_cfg = pycoq.common.RemoteKernelConfig(hostname='bigmem', port=8911)
+    async with pycoq.remote.RemoteKernel(remote_cfg, pycoq.opam.opam_serapi_cfg(coq_ctxt)) as kernel:
+        async with pycoq.serapi.CoqSerapi(kernel) as coq:
+            await coq.execute(stmt)
+```
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+
+from typing import Dict, Optional, Tuple, List, Set, Union
+
+from pycoq.common import LocalKernelConfig, RemoteKernelConfig, TIMEOUT_TERMINATE
+from pycoq.kernel import LocalKernel, PIPE_BUFFER_LIMIT
+from pycoq.stream import ChunkedLineReader, LazySexp, SPILL_THRESHOLD
+
+DEFAULT_PORT = RemoteKernelConfig.port
+DEFAULT_ALLOWED_EXECUTABLES = ['sertop']
+
+# options of sertop in the commands of pycoq.opam.get_opam_serapi_cfg_for_coq_ctxt
+SERTOP_VALUE_OPTIONS = {'-I', '-Q', '-R', '--topfile'}
+SERTOP_FLAGS = {'--debug'}
+OPAM_SWITCH = re.compile(r'[A-Za-z0-9_.+~][A-Za-z0-9_.+~-]*')
+
+
+def frame(op: str, session: int, payload: str = '') -> bytes:
+    return f'{op} {session} {payload}\n'.encode()
+
+
+def frame_line(op: str, session: int, bline: bytes) -> bytes:
+    """ frame forwarding a raw kernel output line """
+    return f'{op} {session} '.encode() + (bline if bline.endswith(b'\n') else bline + b'\n')
+
+
+def parse_frame(bline: bytes) -> Tuple[str, int, bytes]:
+    """ returns op, session and the payload with the newline of the frame """
+    op, session, payload = bline.split(b' ', 2)
+    return op.decode(), int(session), payload
+
+
+def check_kernel_command(command: List[str], allowed_executables: List[str],
+                         opam_root: Optional[str] = None) -> Optional[str]:
+    """ returns None if command is a kernel command the server may run, otherwise the reason to refuse it
+
+    the accepted commands are
+        <executable> <options>
+        opam exec [--root <opam_root>] --switch <switch> -- <executable> <options>
+    where executable is one of allowed_executables (looked up in the PATH of the server)
+    and the options are -I, -Q, -R, --topfile with a value and --debug
+    """
+    args = list(command)
+    if args[:2] == ['opam', 'exec']:
+        args = args[2:]
+        if args[:1] == ['--root']:
+            if opam_root is None or args[1:2] != [opam_root]:
+                return f"opam root {args[1:2]} is not the opam root of the server"
+            args = args[2:]
+        if args[:1] != ['--switch'] or len(args) < 2 or not OPAM_SWITCH.fullmatch(args[1]):
+            return f"expected opam exec --switch <switch> -- in {command}"
+        if args[2:3] != ['--']:
+            return f"expected -- after the opam switch in {command}"
+        args = args[3:]
+    if not args or args[0] not in allowed_executables:
+        return f"executable of {command} is not one of {allowed_executables}"
+    options = args[1:]
+    while options:
+        option = options.pop(0)
+        if option in SERTOP_FLAGS:
+            continue
+        if option not in SERTOP_VALUE_OPTIONS or not options or options[0].startswith('-'):
+            return f"option {option} of {command} is not allowed"
+        options.pop(0)
+    return None
+
+
+def is_inside(path: str, dirs: List[str]) -> bool:
+    """ returns True if the real path of path is one of dirs or below it """
+    path = os.path.realpath(path)
+    return any(os.path.commonpath([path, os.path.realpath(d)]) == os.path.realpath(d) for d in dirs)
+
+
+async def open_connection(cfg: RemoteKernelConfig):
+    """ opens stream to the kernel server at cfg """
+    if cfg.unix_path is not None:
+        return await asyncio.open_unix_connection(cfg.unix_path, limit=PIPE_BUFFER_LIMIT)
+    return await asyncio.open_connection(cfg.hostname, cfg.port, limit=PIPE_BUFFER_LIMIT)
+
+
+class RemoteConnection():
+    """ connection to a KernelServer multiplexing several kernel sessions """
+
+    def __init__(self, cfg: RemoteKernelConfig):
+        self.cfg = cfg
+        self._reader = None
+        self._writer = None
+        self._dispatcher = None
+        self._sessions: Dict[int, 'RemoteKernel'] = {}
+        self._next_session = 0
+
+    async def connect(self):
+        reader, self._writer = await open_connection(self.cfg)
+        self._reader = ChunkedLineReader(reader)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.close()
+
+    def register(self, kernel: 'RemoteKernel') -> int:
+        session, self._next_session = self._next_session, self._next_session + 1
+        self._sessions[session] = kernel
+        return session
+
+    async def send(self, op: str, session: int, payload: str = ''):
+        self._writer.write(frame(op, session, payload))
+        await self._writer.drain()
+
+    async def _dispatch(self):
+        """ routes frames from the server to the sessions;
+        the line of an OUT frame is read by chunks and spilled if it is longer than the
+        spill_threshold of its session
+        """
+        try:
+            while True:
+                op = (await self._reader.readword()).strip()
+                if not op:
+                    break
+                session = int(await self._reader.readword())
+                kernel = self._sessions.get(session)
+                payload: Union[bytes, LazySexp]
+                if op == b'OUT' and kernel is not None and kernel.spill_threshold is not None:
+                    line = await self._reader.readline_sexp(kernel.spill_threshold)
+                    if line is None:
+                        break
+                    payload = line if line.spilled else line.data
+                else:
+                    payload = await self._reader.readline()
+                    if not payload:
+                        break
+                if kernel is not None:
+                    kernel._receive(op.decode(), payload)
+        finally:
+            for kernel in self._sessions.values():
+                kernel._receive('EOF', b'None')
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        if self._dispatcher is not None:
+            await self._dispatcher
+
+
+class RemoteKernel():
+    """ implements interface readline, readlines, writeline to a kernel run by a KernelServer
+
+    kernel_cfg is the config of the kernel on the server side;
+    if connection is None the kernel opens (and closes) its own connection to cfg
+    """
+
+    def __init__(self, cfg: RemoteKernelConfig, kernel_cfg: LocalKernelConfig,
+                 connection: Optional[RemoteConnection] = None):
+        self.cfg = cfg
+        self.kernel_cfg = kernel_cfg
+        self._connection = connection
+        self._own_connection = connection is None
+        self._session = None
+        self._out = asyncio.Queue()
+        self._err = asyncio.Queue()
+        self._opened = None
+        self._eof = asyncio.Event()
+        self.returncode = None
+        # OUT lines longer than spill_threshold bytes are spilled by the connection while they are
+        # received, set by readline_sexp() (None: the lines are received whole)
+        self.spill_threshold: Optional[int] = None
+
+    def _receive(self, op: str, payload: Union[bytes, LazySexp]):
+        if op == 'OUT':
+            self._out.put_nowait(payload)
+        elif op == 'ERR':
+            self._err.put_nowait(payload)
+        elif op == 'OPENED':
+            self._opened.set_result(None)
+        elif op == 'ERROR':
+            message = json.loads(payload)
+            if not self._opened.done():
+                self._opened.set_exception(RuntimeError(message))
+            logging.error(f"RemoteKernel session {self._session}: {message}")
+        elif op == 'EOF':
+            if self.returncode is None and payload.strip() != b'None':
+                self.returncode = int(payload)
+            if not self._opened.done():
+                self._opened.set_exception(EOFError("kernel server closed the session"))
+            self._out.put_nowait(b'')
+            self._err.put_nowait(b'')
+            self._eof.set()
+
+    async def start(self):
+        """ starts the kernel on the server """
+        if self._connection is None:
+            self._connection = RemoteConnection(self.cfg)
+            await self._connection.connect()
+        self._opened = asyncio.get_running_loop().create_future()
+        self._session = self._connection.register(self)
+        cfg = {'command': self.kernel_cfg.command, 'env': self.kernel_cfg.env, 'pwd': self.kernel_cfg.pwd}
+        await self._connection.send('OPEN', self._session, json.dumps(cfg))
+        try:
+            await self._opened
+        except (RuntimeError, EOFError):
+            if self._own_connection:
+                await self._connection.close()
+            raise
+        logging.info(f"remote kernel session {self._session} started at {self.cfg}")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.terminate(timeout=TIMEOUT_TERMINATE)
+
+    async def _read(self, queue: asyncio.Queue, timeout=None) -> Union[bytes, LazySexp]:
+        line = await asyncio.wait_for(queue.get(), timeout=timeout)
+        if line == b'':
+            queue.put_nowait(b'')  # EOF stays readable
+        return line
+
+    async def readline_bytes(self, timeout=None) -> bytes:
+        """ reads line from kernel stdout without decoding """
+        line = await self._read(self._out, timeout)
+        return line.data[:] if isinstance(line, LazySexp) else line
+
+    async def readline(self, timeout=None) -> str:
+        """ reads line from kernel stdout """
+        return (await self._read(self._out, timeout)).decode()
+
+    async def readline_sexp(self, timeout=None, spill_threshold=SPILL_THRESHOLD) -> Optional[LazySexp]:
+        """ reads line from kernel stdout as a pycoq.stream.LazySexp (see LocalKernel.readline_sexp);
+        the following lines are spilled by the connection while they are received if they are longer
+        than spill_threshold bytes, a line received whole before is spilled after it
+        """
+        self.spill_threshold = spill_threshold
+        line = await self._read(self._out, timeout)
+        if isinstance(line, LazySexp):
+            return line
+        return LazySexp.of_bytes(line, spill_threshold) if line else None
+
+    async def readline_err(self, timeout=None) -> str:
+        """ reads line from kernel stderr """
+        return (await self._read(self._err, timeout)).decode()
+
+    async def _readlines(self, queue, count=None, timeout=None, quiet=True):
+        i = 0
+        while (count is None) or i < count:
+            try:
+                line = (await self._read(queue, timeout)).decode()
+                if not line:
+                    break
+            except asyncio.TimeoutError:
+                if not quiet:
+                    raise asyncio.TimeoutError
+                break
+            i += 1
+            yield line
+
+    async def readlines(self, count=None, timeout=None, quiet=True) -> str:
+        """ reads lines from kernel stdout
+        the options are as in kernel.readlines()
+        """
+        async for line in self._readlines(self._out, count, timeout, quiet):
+            yield line
+
+    async def readlines_err(self, count=None, timeout=None, quiet=True) -> str:
+        """ reads lines from kernel stderr
+        the options are as in kernel.readlines()
+        """
+        async for line in self._readlines(self._err, count, timeout, quiet):
+            yield line
+
+    async def writeline(self, line):
+        """ writes line to kernel input """
+        await self._connection.send('IN', self._session, json.dumps(line))
+
+    async def interrupt(self):
+        """ interrupts the kernel (SIGINT) """
+        await self._connection.send('INT', self._session)
+
+    async def wait(self):
+        """ waits for the kernel session to end, returns the returncode of the kernel """
+        await self._eof.wait()
+        return self.returncode
+
+    async def respawn(self) -> 'RemoteKernel':
+        """ returns a new started kernel with the config of this one on the same server """
+        kernel = RemoteKernel(self.cfg, self.kernel_cfg, None if self._own_connection else self._connection)
+        await kernel.start()
+        return kernel
+
+    async def terminate(self, timeout=None):
+        """ closes the remote kernel session,
+        the lines received before the kernel exited remain readable
+        """
+        try:
+            await self._connection.send('CLOSE', self._session)
+            await asyncio.wait_for(self._eof.wait(), timeout=timeout)
+        except (asyncio.TimeoutError, BrokenPipeError, ConnectionResetError):
+            logging.error(f"RemoteKernel.terminate() of session {self._session} did not succeed "
+                          f"with timeout={timeout}")
+        if self._own_connection:
+            await self._connection.close()
+
+
+class KernelServer():
+    """ serves local kernels to RemoteKernel clients over TCP (host, port) or a Unix socket (unix_path)
+
+    only the commands accepted by check_kernel_command(command, allowed_executables, opam_root) are started,
+    in a working directory inside allowed_dirs (default: the working directory of the server)
+    with the environment of the server updated with the variables of the client listed in allowed_env
+    """
+
+    def __init__(self, host: str = 'localhost', port: int = DEFAULT_PORT, unix_path: Optional[str] = None,
+                 allowed_executables: Optional[List[str]] = None, opam_root: Optional[str] = None,
+                 allowed_dirs: Optional[List[str]] = None, allowed_env: Optional[List[str]] = None):
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.allowed_executables = (DEFAULT_ALLOWED_EXECUTABLES if allowed_executables is None
+                                    else allowed_executables)
+        self.opam_root = opam_root
+        self.allowed_dirs = [os.getcwd()] if allowed_dirs is None else allowed_dirs
+        self.allowed_env = [] if allowed_env is None else allowed_env
+        self._server = None
+        self._handlers: Set[asyncio.Task] = set()
+
+    async def start(self):
+        if self.unix_path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=self.unix_path,
+                                                           limit=PIPE_BUFFER_LIMIT)
+        else:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                      limit=PIPE_BUFFER_LIMIT)
+            self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"kernel server listening on {self.unix_path or (self.host, self.port)}")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.close()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        """ stops listening, waits for the connections of clients to close
+        and cancels those still open after TIMEOUT_TERMINATE
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        if self._handlers:
+            _, pending = await asyncio.wait(self._handlers, timeout=TIMEOUT_TERMINATE)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def kernel_cfg(self, payload: bytes) -> Tuple[Optional[LocalKernelConfig], Optional[str]]:
+        """ returns the config of the kernel to start for the payload of OPEN,
+        or None and the reason to refuse it
+        """
+        try:
+            client_cfg = LocalKernelConfig(**json.loads(payload))
+        except (ValueError, TypeError) as exc:
+            return None, f"invalid kernel config: {exc}"
+        if not isinstance(client_cfg.command, list) or not isinstance(client_cfg.pwd, str):
+            return None, f"invalid kernel config: {client_cfg}"
+        refused = check_kernel_command(client_cfg.command, self.allowed_executables, self.opam_root)
+        if refused is not None:
+            return None, refused
+        if not is_inside(client_cfg.pwd, self.allowed_dirs):
+            return None, f"working directory {client_cfg.pwd} is not inside {self.allowed_dirs}"
+        client_env = client_cfg.env or {}
+        dropped = sorted(set(client_env) - set(self.allowed_env))
+        if dropped:
+            logging.warning(f"KernelServer: ignoring environment variables {dropped} of the client")
+        env = {key: value for key, value in client_env.items() if key in self.allowed_env}
+        # no env: run in the environment of the server
+        return LocalKernelConfig(command=list(client_cfg.command), env={**os.environ, **env} if env else None,
+                                 pwd=client_cfg.pwd), None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ serves one client connection with any number of kernel sessions """
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+        kernels: Dict[int, LocalKernel] = {}
+        pumps = []
+        closing = []
+
+        async def send(op, session, payload=''):
+            writer.write(frame(op, session, payload))
+            await writer.drain()
+
+        async def pump(session, kernel):
+            async def pump_lines(op, stream):
+                while True:
+                    bline = await stream.readline()
+                    if not bline:
+                        break
+                    writer.write(frame_line(op, session, bline))
+                    await writer.drain()
+            err = asyncio.create_task(pump_lines('ERR', kernel._reader_err))
+            await pump_lines('OUT', kernel._reader)
+            returncode = await kernel.wait()
+            await err
+            await send('EOF', session, str(returncode))
+
+        try:
+            while True:
+                bline = await reader.readline()
+                if not bline:
+                    break
+                try:
+                    op, session, payload = parse_frame(bline)
+                except ValueError:
+                    await send('ERROR', -1, json.dumps(f"malformed frame {bline[:80]!r}"))
+                    continue
+                if op == 'OPEN':
+                    if session in kernels:
+                        await send('ERROR', session, json.dumps(f"session {session} is already open"))
+                        continue
+                    cfg, refused = self.kernel_cfg(payload)
+                    if cfg is None:
+                        await send('ERROR', session, json.dumps(f"kernel refused: {refused}"))
+                        continue
+                    kernel = LocalKernel(cfg)
+                    try:
+                        await kernel.start()
+                    except OSError as exc:
+                        await send('ERROR', session, json.dumps(f"kernel {cfg.command} failed to start: {exc}"))
+                        continue
+                    kernels[session] = kernel
+                    await send('OPENED', session)
+                    pumps.append(asyncio.create_task(pump(session, kernel)))
+                elif op in ('IN', 'INT'):
+                    # errors of one session are reported to it, the other sessions keep being served
+                    kernel = kernels.get(session)
+                    if kernel is None:
+                        await send('ERROR', session, json.dumps(f"session {session} is not open"))
+                        continue
+                    try:
+                        if op == 'IN':
+                            line = json.loads(payload)
+                            if not isinstance(line, str):
+                                raise TypeError(f"IN payload must be a json string, got {type(line).__name__}")
+                            await kernel.writeline(line)
+                        else:
+                            await kernel.interrupt()
+                    except (BrokenPipeError, ConnectionResetError) as exc:
+                        await send('ERROR', session, json.dumps(f"kernel of session {session} exited: {exc!r}"))
+                    except (ValueError, TypeError) as exc:
+                        await send('ERROR', session, json.dumps(f"malformed {op} frame: {exc}"))
+                elif op == 'CLOSE':
+                    # terminated in the background, the other sessions are served meanwhile
+                    kernel = kernels.pop(session, None)
+                    if kernel is not None:
+                        closing.append(asyncio.create_task(kernel.terminate(timeout=TIMEOUT_TERMINATE)))
+                else:
+                    await send('ERROR', session, json.dumps(f"unknown op {op}"))
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            closing.extend(asyncio.create_task(kernel.terminate(timeout=TIMEOUT_TERMINATE))
+                           for kernel in kernels.values())
+            await asyncio.gather(*closing, return_exceptions=True)
+            await asyncio.gather(*pumps, return_exceptions=True)
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='serves coq-serapi kernels to pycoq.remote.RemoteKernel clients',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--host', type=str, default='localhost', help='TCP host to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='TCP port to listen on')
+    parser.add_argument('--unix-path', type=str, default=None, help='listen on Unix socket instead of TCP')
+    parser.add_argument('--allow', type=str, action='append', default=None,
+                        help=f'allowed kernel executable (repeatable), default {DEFAULT_ALLOWED_EXECUTABLES}')
+    parser.add_argument('--opam-root', type=str, default=None, help='opam root accepted in --root of opam exec')
+    parser.add_argument('--allow-dir', type=str, action='append', default=None,
+                        help='allowed working directory tree of the kernels (repeatable), default the current one')
+    parser.add_argument('--allow-env', type=str, action='append', default=None,
+                        help='environment variable of the client passed to the kernels (repeatable), default none')
+    args = parser.parse_args()
+    server = KernelServer(args.host, args.port, args.unix_path, args.allow, args.opam_root,
+                          args.allow_dir, args.allow_env)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
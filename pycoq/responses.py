@@ -0,0 +1,436 @@
+'''
+index of coq-serapi responses by cmd_tag
+
+every response line of coq-serapi is decoded once, when it is read, by a byte level
+scanner into a typed record (Ack, Completed, Added, CoqExn, ObjList, Canceled, Answer, Feedback)
+and stored in the bucket of the command (cmd_tag) it answers; Feedback lines are stored
+in the bucket of the command being processed when they arrive
+
+a line read as a pycoq.stream.LazySexp (a long line spilled to a temporary file) is decoded from
+its head, its records refer to the data of the view instead of a copy of the line
+
+the regex helpers on str lines are kept for callers of the previous interface
+'''
+import re
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Iterable, Union
+
+from pycoq.stream import LazySexp
+
+
+COMPLETED_PATTERN = re.compile(r"\(Answer\s\d+\sCompleted\)")
+ANSWER_PATTERN = re.compile(r"\(Answer\s(\d+)(.*)\)")
+ANSWER_PATTERN_OBJLIST = re.compile(r"\(Answer\s(\d+)(\(ObjList.*\))\)")
+ADDED_PATTERN = re.compile(r"\(Added\s(\d+)(.*)\)")
+COQEXN_PATTERN = re.compile(r"\((CoqExn\(.*\))\)")
+LOC_PATTERN = re.compile(r"\(bp\s(\d+)\)\s*\(ep\s(\d+)\)")
+CANCELED_PATTERN = re.compile(r"\(Canceled\s*\(([\d\s]*)\)\)")
+STM_IDS_PATTERN = re.compile(r"\(stm_ids\s*\(\(\s*(\d+)\s+(\d+)\s*\)\)\)")
+FEEDBACK_MESSAGE_BPATTERN = re.compile(rb"\(contents\s*\(Message")
+LOC_BPATTERN = re.compile(LOC_PATTERN.pattern.encode())
+STM_IDS_BPATTERN = re.compile(STM_IDS_PATTERN.pattern.encode())
+
+
+def matches_answer_completed(line: str, ind: int):
+    """
+    checks if coq-serapi responses matches "Answer Completed"
+    """
+    return line.strip() == f'(Answer {ind} Completed)'
+
+
+def answer_tag(line: str) -> Optional[Tuple[int, str]]:
+    """
+    if line is an Answer of coq-serapi
+    return (cmd_tag, answer) otherwise None
+    """
+    match = ANSWER_PATTERN.match(line.strip())
+    if match:
+        return int(match.group(1)), match.group(2).strip()
+    else:
+        return None
+
+
+def matches_answer(line: str, sent_index):
+    """
+    if line matches Answer
+    return (index, answer)
+    """
+
+    match = ANSWER_PATTERN.match(line)
+    if match and int(match.group(1)) == sent_index:
+        return match.group(2).strip()
+
+
+def parse_added_sid(line: str):
+    """
+    find sentence id (sid) in coq-serapi response
+    """
+
+    match = ADDED_PATTERN.match(line)
+    if match:
+        return int(match.group(1))
+    else:
+        return None
+
+
+def parse_loc(line: str) -> Optional[Tuple[int, int]]:
+    """
+    find the first location (bp, ep) in coq-serapi response
+    bp, ep are byte offsets in the string of the Add command
+    """
+    match = LOC_PATTERN.search(line)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    else:
+        return None
+
+
+def parse_canceled_sids(line: str) -> Optional[List[int]]:
+    """
+    find the list of canceled sids in coq-serapi response (Canceled (sid ...))
+    """
+    match = CANCELED_PATTERN.match(line)
+    if match:
+        return [int(sid) for sid in match.group(1).split()]
+    else:
+        return None
+
+
+@dataclass
+class Ack():
+    cmd_tag: int
+
+
+@dataclass
+class Completed():
+    cmd_tag: int
+
+
+@dataclass
+class Added():
+    cmd_tag: int
+    sid: int
+    loc: Optional[Tuple[int, int]] = None  # (bp, ep) of the sentence in the string of the Add command
+
+
+@dataclass
+class CoqExn():
+    message: str
+    loc: Optional[Tuple[int, int]] = None  # (bp, ep) of the error if coq-serapi reports it
+    sid: Optional[int] = None  # failed sid from stm_ids (last valid sid, failed sid) if reported
+    cmd_tag: Optional[int] = None
+
+
+@dataclass
+class CoqTimeout(CoqExn):
+    """ the command cmd_tag exceeded its deadline of timeout seconds and was interrupted,
+    restarted is True if the kernel did not recover from the interrupt and was restarted
+    """
+    timeout: Optional[float] = None
+    restarted: bool = False
+
+
+@dataclass
+class Canceled():
+    cmd_tag: int
+    sids: List[int]
+
+
+@dataclass
+class ObjList():
+    """ (ObjList ...) answer of a query, payload is line[start:end] decoded on access """
+    cmd_tag: int
+    line: bytes
+    start: int
+    end: int
+
+    @property
+    def payload(self) -> str:
+        return self.line[self.start:self.end].decode()
+
+    @property
+    def raw(self) -> memoryview:
+        """ the payload as a view on line (the mmap of a spilled line), neither copied nor decoded """
+        return memoryview(self.line)[self.start:self.end]
+
+
+@dataclass
+class Answer():
+    """ any other (Answer cmd_tag payload), payload is line[start:end] decoded on access """
+    cmd_tag: int
+    line: bytes
+    start: int
+    end: int
+
+    @property
+    def payload(self) -> str:
+        return self.line[self.start:self.end].decode()
+
+
+@dataclass
+class Feedback():
+    """ (Feedback ((doc_id ..)(span_id span_id)(route ..)(contents (kind ...)))), or an untagged line
+    with span_id None and kind '' """
+    span_id: Optional[int]
+    kind: str
+    line: bytes
+
+
+Record = Union[Ack, Completed, Added, CoqExn, Canceled, ObjList, Answer, Feedback]
+
+# 'all' keeps every Feedback line, 'messages' keeps only (contents (Message ...)) feedback, 'none' drops feedback
+FEEDBACK_POLICIES = ('all', 'messages', 'none')
+
+
+def keep_feedback(line: bytes, policy: str = 'all') -> bool:
+    """ returns False if line is Feedback dropped by the feedback policy,
+    decides on the raw bytes of the line prefix
+    """
+    if policy == 'all' or not line.startswith(b'(Feedback'):
+        return True
+    return policy == 'messages' and FEEDBACK_MESSAGE_BPATTERN.search(line, 0, 256) is not None
+
+_DIGITS = b'0123456789'
+_SPACE = b' \t\r\n'
+_WORD_END = b' \t\r\n()'
+
+
+def _skip(line: bytes, i: int, chars: bytes) -> int:
+    n = len(line)
+    while i < n and line[i] in chars:
+        i += 1
+    return i
+
+
+def _skip_to(line: bytes, i: int, chars: bytes) -> int:
+    n = len(line)
+    while i < n and line[i] not in chars:
+        i += 1
+    return i
+
+
+def _int_at(line: bytes, i: int) -> Tuple[Optional[int], int]:
+    """ reads the unsigned int at line[i:] skipping blanks; returns (int or None, end) """
+    i = _skip(line, i, _SPACE)
+    j = _skip(line, i, _DIGITS)
+    return (int(line[i:j]) if j > i else None), j
+
+
+def decode_loc(line: bytes, start: int = 0, end: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    """ returns the first location (bp, ep) in line[start:end] """
+    match = LOC_BPATTERN.search(line, start, len(line) if end is None else end)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    return None
+
+
+def decode_feedback(line: bytes) -> Feedback:
+    """ decodes span_id and the kind of contents of a (Feedback ...) line without decoding its text """
+    span_id = None
+    i = line.find(b'(span_id')
+    if i >= 0:
+        span_id, i = _int_at(line, i + len(b'(span_id'))
+    kind = ''
+    i = line.find(b'(contents', max(i, 0))
+    if i >= 0:
+        i = _skip(line, i + len(b'(contents'), _SPACE + b'(')
+        kind = line[i:_skip_to(line, i, _WORD_END)].decode()
+    return Feedback(span_id, kind, line)
+
+
+def decode_response(line: bytes) -> Record:
+    """
+    decodes a response line of coq-serapi into a typed record:
+    (Answer tag Ack), (Answer tag Completed), (Answer tag (Added sid loc ..)), (Answer tag (CoqExn ..)),
+    (Answer tag (ObjList ..)), (Answer tag (Canceled (sid ..))), other answers and Feedback;
+    only the short prefix of the line is scanned except for CoqExn
+    """
+    if not line.startswith(b'(Answer'):
+        return decode_feedback(line)
+    cmd_tag, i = _int_at(line, len(b'(Answer'))
+    if cmd_tag is None:
+        return Feedback(None, '', line)
+    i = _skip(line, i, _SPACE)
+    end = line.rstrip().rfind(b')')  # closing paren of (Answer ...)
+    if line.startswith(b'Ack', i):
+        return Ack(cmd_tag)
+    if line.startswith(b'Completed', i):
+        return Completed(cmd_tag)
+    if line.startswith(b'(Added', i):
+        sid, j = _int_at(line, i + len(b'(Added'))
+        return Added(cmd_tag, sid, decode_loc(line, j, end))
+    if line.startswith(b'(ObjList', i):
+        return ObjList(cmd_tag, line, i, end)
+    if line.startswith(b'(CoqExn', i):
+        loc = None if line.startswith(b'(CoqExn((loc())', i) else decode_loc(line, i, end)
+        stm_ids = STM_IDS_BPATTERN.search(line, i, end)
+        sid = int(stm_ids.group(2)) if stm_ids else None
+        return CoqExn(message=line[i:end].decode(), loc=loc, sid=sid, cmd_tag=cmd_tag)
+    if line.startswith(b'(Canceled', i):
+        j = _skip(line, i + len(b'(Canceled'), _SPACE + b'(')
+        return Canceled(cmd_tag, [int(sid) for sid in line[j:line.find(b')', j)].split()])
+    return Answer(cmd_tag, line, i, end)
+
+
+def decode_lazy(line: LazySexp) -> Record:
+    """ decodes a response line read as a LazySexp from its head; the line of Feedback and the
+    payload of ObjList and other answers refer to the data of the view (the mmap of a spilled line)
+    """
+    if not line.spilled:
+        return decode_response(line.data)
+    record = decode_response(line.head())
+    if isinstance(record, Feedback):
+        record.line = line.data
+    elif isinstance(record, (ObjList, Answer)):
+        record.line = line.data
+        record.start, record.end = line.span([2])
+    elif isinstance(record, CoqExn):
+        record = decode_response(line.raw())
+    return record
+
+
+def parse_coqexn(line: str):
+    """
+    parse CoqExn in coq-serapi response
+    """
+    match = COQEXN_PATTERN.match(line)
+    if match:
+        message = match.group(0)
+        loc = None if message.startswith('(CoqExn((loc())') else parse_loc(message)
+        stm_ids = STM_IDS_PATTERN.search(message)
+        sid = int(stm_ids.group(2)) if stm_ids else None
+        return CoqExn(message=message, loc=loc, sid=sid)
+    else:
+        return None
+
+
+@dataclass
+class CmdResponses():
+    """ responses of coq-serapi to the command cmd_tag """
+    cmd_tag: int
+    blines: List[Union[bytes, LazySexp]] = field(default_factory=list)  # raw response lines
+    records: List[Record] = field(default_factory=list)  # decoded blines
+    sids: List[int] = field(default_factory=list)  # Added sids
+    locs: List[Optional[Tuple[int, int]]] = field(default_factory=list)  # (bp, ep) of Added sids
+    coqexns: List[CoqExn] = field(default_factory=list)
+    objlists: List[ObjList] = field(default_factory=list)  # (ObjList ...) answers of queries
+    canceled: List[int] = field(default_factory=list)  # sids of (Canceled (sid ...))
+    completed: bool = False
+
+    @property
+    def lines(self) -> List[str]:
+        return [bline.decode() for bline in self.blines]
+
+    @property
+    def answers(self) -> List[str]:
+        """ payloads of ObjList and other answers (not Ack, Completed, Added, CoqExn, Canceled) """
+        return [record.payload for record in self.records if isinstance(record, (ObjList, Answer))]
+
+    @property
+    def raw_answers(self) -> List[memoryview]:
+        """ payloads of the ObjList answers as views on the response lines, see ObjList.raw """
+        return [objlist.raw for objlist in self.objlists]
+
+    def feedback(self, kind: Optional[str] = None) -> List[Feedback]:
+        """ Feedback records of the command, of contents kind if given """
+        return [record for record in self.records
+                if isinstance(record, Feedback) and (kind is None or record.kind == kind)]
+
+
+class ResponseIndex():
+    """
+    responses of coq-serapi bucketed by cmd_tag
+
+    keep_last is the retention policy: None keeps the responses of all commands,
+    keep_last=N keeps the responses of the last N completed commands in addition
+    to the commands still in flight; buckets are evicted when a new command is opened,
+    so keep_last=0 keeps only the responses of the commands sent since the last completed one
+
+    tag_offset is added to the cmd_tags of the kernel, it is set when a restarted kernel
+    numbers the commands from 0 again
+    """
+
+    def __init__(self, keep_last: Optional[int] = None):
+        self.keep_last = keep_last
+        self.tag_offset = 0
+        self._buckets: 'OrderedDict[int, CmdResponses]' = OrderedDict()
+        self._processing_tag: Optional[int] = None
+
+    def restart(self, tag_offset: int):
+        """ continues the index with a new kernel whose command 0 is the command tag_offset """
+        self.tag_offset = tag_offset
+        self._processing_tag = None
+
+    def open(self, cmd_tag: int) -> CmdResponses:
+        """ creates the bucket for a newly sent command cmd_tag
+        and evicts completed buckets beyond the retention policy
+        """
+        if self.keep_last is not None:
+            completed = [tag for tag, bucket in self._buckets.items() if bucket.completed]
+            for tag in completed[:max(0, len(completed) - self.keep_last)]:
+                del self._buckets[tag]
+        bucket = CmdResponses(cmd_tag)
+        self._buckets[cmd_tag] = bucket
+        return bucket
+
+    def route(self, line: Union[bytes, LazySexp]) -> Optional[int]:
+        """ decodes response line and stores it in the bucket of its cmd_tag
+        returns cmd_tag if line is (Answer cmd_tag Completed) otherwise None
+        """
+        record = decode_lazy(line) if isinstance(line, LazySexp) else decode_response(line)
+        if isinstance(record, Feedback):
+            # Feedback or an untagged line belongs to the command being processed
+            if self._processing_tag is not None:
+                bucket = self._bucket(self._processing_tag)
+                bucket.blines.append(line)
+                bucket.records.append(record)
+            return None
+
+        if self.tag_offset:
+            record.cmd_tag += self.tag_offset
+        cmd_tag = record.cmd_tag
+        self._processing_tag = cmd_tag
+        bucket = self._bucket(cmd_tag)
+        bucket.blines.append(line)
+        bucket.records.append(record)
+        if isinstance(record, Completed):
+            bucket.completed = True
+            self._processing_tag = None
+            return cmd_tag
+        if isinstance(record, Added):
+            bucket.sids.append(record.sid)
+            bucket.locs.append(record.loc)
+        elif isinstance(record, ObjList):
+            bucket.objlists.append(record)
+        elif isinstance(record, Canceled):
+            bucket.canceled.extend(record.sids)
+        elif isinstance(record, CoqExn):
+            bucket.coqexns.append(record)
+        return None
+
+    def _bucket(self, cmd_tag: int) -> CmdResponses:
+        bucket = self._buckets.get(cmd_tag)
+        if bucket is None:
+            bucket = self.open(cmd_tag)
+        return bucket
+
+    def __getitem__(self, cmd_tag: int) -> CmdResponses:
+        try:
+            return self._buckets[cmd_tag]
+        except KeyError:
+            raise KeyError(f"responses of cmd_tag {cmd_tag} are not retained "
+                           f"(retention policy keep_last={self.keep_last})") from None
+
+    def __contains__(self, cmd_tag: int) -> bool:
+        return cmd_tag in self._buckets
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def lines(self) -> Iterable[str]:
+        """ yields retained response lines in the order of cmd_tags """
+        for bucket in self._buckets.values():
+            for bline in bucket.blines:
+                yield bline.decode()
@@ -0,0 +1,196 @@
+'''
+index of the sentences of the source files of coq projects
+
+build_sentence_index() splits the train and test files of every project of a
+pycoq.project_splits.CoqProjs in a process pool (pycoq.split.coq_stmt_offsets) and writes one
+index file <index_dir>/<project_name>.json per project:
+
+    {"version": 1, "project_name": ..., "switch": ..., "coq_proj_path": ...,
+     "files": {"<fname relative to the project>": {
+         "split": "train" | "test",
+         "size": ..., "mtime_ns": ..., "sha256": "<hash of the file>",
+         "offsets": [[start, end], ...],       # byte offsets of the sentences in the file
+         "kinds": ["vernac" | "proof_start" | "tactic" | "proof_end", ...],   # see pycoq.classify
+         "hashes": ["<hash of the bytes of the sentence>", ...]}}}
+
+an existing index is rebuilt incrementally: the entry of a file is kept if its size and mtime are
+unchanged or, when they changed, if its content hash is; only the other files are split again
+
+usage:
+    pycoq-sentence-index lf_projs_splits.json ~/coq-projects ~/data/sentence_index --workers 8
+'''
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+
+from typing import Dict, List, Optional, Tuple
+
+import pycoq.classify
+import pycoq.split
+
+
+INDEX_VERSION = 1
+
+
+def sentence_kinds(stmts: List[str]) -> List[str]:
+    ''' coarse kinds of the consecutive sentences stmts of a file (see pycoq.classify) '''
+    return [tag.coarse for tag in pycoq.classify.classify(stmts)]
+
+
+def sentence_hash(stmt: bytes) -> str:
+    return hashlib.blake2b(stmt, digest_size=8).hexdigest()
+
+
+def index_source(fname: str) -> Dict:
+    '''
+    the index entry of the file fname (without its split)
+    '''
+    stat = os.stat(fname)
+    stmts = pycoq.split.coq_stmts_of_source(fname)
+    try:
+        source = stmts.source
+        offsets = stmts.offsets.tolist()
+        return {'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': hashlib.sha256(source).hexdigest(),
+                'offsets': offsets,
+                'kinds': sentence_kinds(list(stmts)),
+                'hashes': [sentence_hash(source[start:end]) for start, end in offsets]}
+    finally:
+        stmts.close()
+
+
+def file_sha256(fname: str) -> str:
+    with open(fname, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def sentence_index_fname(index_dir: str, project_name: str) -> str:
+    return os.path.join(index_dir, f'{project_name}.json')
+
+
+def load_sentence_index(fname: str) -> Optional[Dict]:
+    '''
+    returns the index in fname, None if there is none or it is of another version
+    '''
+    try:
+        with open(fname) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (json.JSONDecodeError, ValueError):
+        logging.warning(f"pycoq.sentence_index: ignoring corrupted index file {fname}")
+        return None
+    if index.get('version') != INDEX_VERSION:
+        return None
+    return index
+
+
+def save_sentence_index(fname: str, index: Dict):
+    ''' writes index to fname, the file is replaced atomically '''
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+    tmp_fname = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp_fname, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_fname, fname)
+
+
+def project_files(coq_proj: 'pycoq.project_splits.CoqProj') -> Dict[str, str]:
+    ''' the split (train or test) of each file of coq_proj '''
+    files = {fname: 'train' for fname in coq_proj.train_files}
+    files.update({fname: 'test' for fname in coq_proj.test_files})
+    return files
+
+
+def reusable_entry(entry: Optional[Dict], fname: str) -> Optional[Dict]:
+    '''
+    entry of the previous index if the file fname did not change since, updated to its current stat
+    '''
+    if entry is None:
+        return None
+    stat = os.stat(fname)
+    if (stat.st_size, stat.st_mtime_ns) == (entry['size'], entry['mtime_ns']):
+        return entry
+    if stat.st_size == entry['size'] and file_sha256(fname) == entry['sha256']:
+        return dict(entry, mtime_ns=stat.st_mtime_ns)
+    return None
+
+
+def build_sentence_index(coq_projs: 'pycoq.project_splits.CoqProjs', index_dir: str,
+                         max_workers: Optional[int] = None) -> Dict[str, str]:
+    '''
+    writes the sentence index of every project of coq_projs to index_dir (see the module docstring),
+    the changed files of all the projects are split together in a pool of max_workers processes;
+    returns the index file of each project
+    '''
+    plans: List[Tuple['pycoq.project_splits.CoqProj', Dict, Dict[str, Dict]]] = []
+    todo: List[Tuple[int, str, str]] = []
+    for coq_proj in coq_projs.coq_projs:
+        root = coq_proj.get_coq_proj_path()
+        previous = load_sentence_index(sentence_index_fname(index_dir, coq_proj.project_name))
+        previous_files = previous['files'] if previous is not None else {}
+        entries = {}
+        for fname, split in project_files(coq_proj).items():
+            path = os.path.join(root, fname)
+            if not os.path.isfile(path):
+                logging.warning(f"pycoq.sentence_index: {coq_proj.project_name}: no file {path}")
+                continue
+            entry = reusable_entry(previous_files.get(fname), path)
+            if entry is None:
+                todo.append((len(plans), fname, path))
+            else:
+                entries[fname] = dict(entry, split=split)
+        plans.append((coq_proj, project_files(coq_proj), entries))
+
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for (i, fname, _), entry in zip(todo, executor.map(index_source, [path for _, _, path in todo])):
+                coq_proj, files, entries = plans[i]
+                entries[fname] = dict(entry, split=files[fname])
+    logging.info(f"pycoq.sentence_index: split {len(todo)} changed files")
+
+    index_fnames = {}
+    for coq_proj, files, entries in plans:
+        index = {'version': INDEX_VERSION,
+                 'project_name': coq_proj.project_name,
+                 'switch': coq_proj.switch,
+                 'coq_proj_path': coq_proj.get_coq_proj_path(),
+                 'files': {fname: entries[fname] for fname in files if fname in entries}}
+        index_fname = sentence_index_fname(index_dir, coq_proj.project_name)
+        save_sentence_index(index_fname, index)
+        index_fnames[coq_proj.project_name] = index_fname
+    return index_fnames
+
+
+def sentence_counts(index: Dict) -> Dict[str, int]:
+    ''' the number of sentences of each file of index, to shard work on the files '''
+    return {fname: len(entry['offsets']) for fname, entry in index['files'].items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='writes the sentence index of the coq projects of a splits json file',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('splits', type=str, help='json file of the train/test splits of the coq projects')
+    parser.add_argument('path_2_coq_projs', type=str, help='directory of the coq projects')
+    parser.add_argument('index_dir', type=str, help='directory of the index files')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default: cpu count)')
+    args = parser.parse_args()
+
+    from pathlib import Path
+    import pycoq.project_splits
+
+    with open(args.splits) as f:
+        coq_projs = pycoq.project_splits.list_dict_splits_2_list_splits(json.load(f), Path(args.path_2_coq_projs))
+    coq_projs = pycoq.project_splits.CoqProjs(coq_projs=coq_projs,
+                                              path_2_coq_projs=Path(args.path_2_coq_projs),
+                                              path_2_coq_projs_json_splits=Path(args.splits))
+    for project_name, index_fname in build_sentence_index(coq_projs, args.index_dir, args.workers).items():
+        print(f'{project_name}: {index_fname}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,98 +1,129 @@
 '''
 functions to work with coq-serapi
 '''
+import asyncio
+import bisect
 import logging
 import re
 import json
 import time
 
-from typing import List, Union, Tuple, Optional
+from typing import List, Union, Tuple, Optional, Dict, Set
 
 import pycoq.kernel
+import pycoq.remote
+import pycoq.sexp_parser
+from pycoq.goal_store import GoalStore, ProofState
+from pycoq.stream import LazySexp
 from pycoq.kernel import LocalKernel
 from pycoq.common import LocalKernelConfig
+from pycoq.common import TIMEOUT_TERMINATE
+from pycoq.responses import (COMPLETED_PATTERN, ANSWER_PATTERN, ANSWER_PATTERN_OBJLIST, ADDED_PATTERN,
+                             COQEXN_PATTERN, matches_answer_completed, answer_tag, matches_answer,
+                             parse_added_sid, CoqExn, parse_coqexn, ResponseIndex,
+                             FEEDBACK_POLICIES, keep_feedback, decode_feedback, CoqTimeout)
 
 from dataclasses import dataclass
 from collections.abc import Iterable
 
-from pdb import set_trace as st
+# exceptions raised by the commands of CoqSerapi when the kernel has exited
+KERNEL_EXITED = (EOFError, BrokenPipeError, ConnectionResetError)
 
-COMPLETED_PATTERN = re.compile(r"\(Answer\s\d+\sCompleted\)")
-ANSWER_PATTERN = re.compile(r"\(Answer\s(\d+)(.*)\)")
-ANSWER_PATTERN_OBJLIST = re.compile(r"\(Answer\s(\d+)(\(ObjList.*\))\)")
-ADDED_PATTERN = re.compile(r"\(Added\s(\d+)(.*)\)")
-COQEXN_PATTERN = re.compile(r"\((CoqExn\(.*\))\)")
+# serapi commands that change the document state (and invalidate the goals cache)
+STATE_COMMANDS = ('(Add ', '(Exec ', '(Cancel ')
 
+# query options of the goals as the pretty printed string of the local context and goals
+PPSTR = '(pp ((pp_format PpStr)))'
 
-# from pycoq.query_goals import SerapiGoals
+SHOW_PROOF = 'Show Proof.'
 
 
-def ocaml_string_quote(s: str):
-    """
-    OCaml-quote string 
+@dataclass
+class Observation:
+    """ result of CoqSerapi.execute_and_observe()
+    sids as returned by CoqSerapi.execute() ([] if Add failed, None if Exec failed), the CoqExns,
+    the goals answer (Query (opts) Goals) after the statement (None on CoqExn)
+    and the Show Proof term if requested and in proof mode
     """
-    return s.replace('\\', '\\\\').replace('\"', '\\\"')
+    sids: Optional[List[int]]
+    coqexns: List[CoqExn]
+    goals: Optional[str] = None
+    proof_term: Optional[str] = None
 
 
-def sexp(x) -> str:
-    """
-    make s-expression of python object
+def local_ctx_and_goals_of_answer(answer: str) -> Union[str, list]:
+    """ returns the string of (ObjList((CoqString "..."))) answered to (Query (PPSTR) Goals),
+    [] for (ObjList()) out of proof mode
     """
-    if isinstance(x, int):
-        return str(x)
-    elif isinstance(x, str):
-        return '"' + ocaml_string_quote(x) + '"'
-    elif isinstance(x, Iterable):
-        return '(' + " ".join(sexp(e) for e in x) + ')'
+    _local_ctx_and_goals: list = pycoq.sexp_parser.loads(answer)
+    assert str(_local_ctx_and_goals[0]) == 'ObjList'
+    if _local_ctx_and_goals[1] == []:
+        return []  # if not in proof mode there is no coq-str obj so return empty list
     else:
-        return str(x)
-        # raise TypeError(f'pycoq.serapi.sexp for type {type(x)} is not yet implemented')
+        # example smallest valid goals: (ObjList ((CoqString "")))
+        obj_list: list = _local_ctx_and_goals[1]
+        coq_str_sexp: list = obj_list[0]  # e.g. (CoqString "")
+        assert len(coq_str_sexp) == 2
+        assert str(coq_str_sexp[0]) == 'CoqString'
+        local_ctx_and_goals: str = coq_str_sexp[1]
+        return local_ctx_and_goals
+
+
+def message_text(line: bytes) -> str:
+    """ returns the text of the Message feedback line
+    (Feedback((doc_id 0)(span_id S)(route 0)(contents(Message(level Notice)(loc())(str"...")))))
+    only the (str "...") subtree is parsed, the rest of the line is skipped
+    """
+    string: list = pycoq.sexp_parser.loads_at(line, [1, 3, 1, -1])
+    assert string[0] == 'str'
+    return string[-1]
 
 
-def matches_answer_completed(line: str, ind: int):
-    """
-    checks if coq-serapi responses matches "Answer Completed"
+def message_pp(line: bytes) -> bytes:
+    """ returns the s-expression of the Pp.t document of the Message feedback line
+    (Feedback(.. (contents(Message(level Notice)(loc())(pp <Pp.t>)(str"...")))))
+    found by skipping over the other fields, without parsing them
     """
-    return line.strip() == f'(Answer {ind} Completed)'
+    start, _ = pycoq.sexp_parser.span(line, [1, 3, 1])
+    for field_start, field_end in pycoq.sexp_parser.children(line, start):
+        if line[field_start:field_start + 4] in (b'(pp ', b'(pp('):
+            pp_start, pp_end = pycoq.sexp_parser.children(line, field_start, 2)[1]
+            return line[pp_start:pp_end]
+    raise ValueError(f"no pp field in the Message feedback {line[:256]}")
 
 
-def matches_answer(line: str, sent_index):
-    """ 
-    if line matches Answer
-    return (index, answer)
-    """
+PROOF_TERM_FORMS = ('str', 'pp', 'postfix')
 
-    match = ANSWER_PATTERN.match(line)
-    if match and int(match.group(1)) == sent_index:
-        return match.group(2).strip()
+from pdb import set_trace as st
 
+# from pycoq.query_goals import SerapiGoals
 
-def parse_added_sid(line: str):
-    """
-    find sentence id (sid) in coq-serapi response
-    """
 
-    match = ADDED_PATTERN.match(line)
-    if match:
-        return int(match.group(1))
-    else:
-        return None
+def spilled_head(line: LazySexp) -> str:
+    """ stands for a spilled response line in the flat history: its head and its length """
+    return f"{line.head().decode(errors='replace')}... ({len(line)} bytes spilled)"
 
 
-@dataclass
-class CoqExn():
-    message: str
+def ocaml_string_quote(s: str):
+    """
+    OCaml-quote string 
+    """
+    return s.replace('\\', '\\\\').replace('\"', '\\\"')
 
 
-def parse_coqexn(line: str):
+def sexp(x) -> str:
     """
-    parse CoqExn in coq-serapi response
+    make s-expression of python object
     """
-    match = COQEXN_PATTERN.match(line)
-    if match:
-        return CoqExn(message=match.group(0))
+    if isinstance(x, int):
+        return str(x)
+    elif isinstance(x, str):
+        return '"' + ocaml_string_quote(x) + '"'
+    elif isinstance(x, Iterable):
+        return '(' + " ".join(sexp(e) for e in x) + ')'
     else:
-        return None
+        return str(x)
+        # raise TypeError(f'pycoq.serapi.sexp for type {type(x)} is not yet implemented')
 
 
 class CoqSerapi():
@@ -107,16 +138,68 @@ class CoqSerapi():
         
     of config defined by the protocol: pycoq.kernel.LocalKernel
 
+    with pipelined=True a background task owns the kernel stdout and routes every
+    response line to the cmd_tag it belongs to; commands can then be sent back to back
+    with CoqSerapi.add(), CoqSerapi.exec(), ... and awaited independently with
+    CoqSerapi.wait_for_answer_completed(cmd_tag)
+
+    responses are indexed by cmd_tag as they are read (see pycoq.responses.ResponseIndex);
+    keep_responses=None keeps all responses and the full _serapi_response_history (of a spilled line
+    only its head, see spill_threshold),
+    keep_responses=N keeps only the responses of the last N completed commands and no flat history;
+    resp_ind returned by the commands is the length of _serapi_response_history after their completion,
+    None with keep_responses=N in both modes: their responses are looked up by cmd_tag in self._responses
+
+    feedback is the policy for (Feedback ...) lines (see pycoq.responses.FEEDBACK_POLICIES):
+    'all' keeps them, 'messages' keeps only Message feedback (e.g. the output of Show Proof),
+    'none' drops them as they are read; dropped lines are never decoded nor saved to the history;
+    the Message feedback of a Show Proof in flight (proof_term(), execute_and_observe(proof_term=True))
+    is routed whatever the policy, execute_many() locates a timed out sentence without the Processed
+    feedback by executing the chunk again one sentence at a time
+
+    with resilient=True a kernel that exits (crash, OOM) during CoqSerapi.execute(), execute_many(),
+    reset() or a query is respawned, the statements executed so far are replayed with execute_many()
+    and the call is retried, up to max_restarts times per call; only statements executed through
+    execute() and execute_many() are replayed. The kernel numbers the replayed sentences anew:
+    the sids held by CoqSerapi are translated, sids obtained before the restart are translated
+    with CoqSerapi.translate_sid()
+
+    timeout is the default deadline in seconds of add_completed(), exec_completed(), execute(),
+    execute_many() and the queries, each of them also takes a timeout argument; session_timeout
+    bounds the total time of the session from start(). A command past its deadline is interrupted
+    (SIGINT); if the kernel does not answer within interrupt_timeout it is restarted
+    (see CoqSerapi.restart()). The timed out command is reported as a CoqTimeout in the list of
+    CoqExns and its sids are canceled, a timed out query raises TimeoutError
+
+    with cache_goals=True the answers of (Query (opts) Goals) are memoized per opts until the
+    document state changes: any Add, Exec or Cancel sent through CoqSerapi invalidates them, so
+    repeated goal queries and the predicates built on them (in_proof_mode(), started_proving(), ...)
+    cost no round trip on an unchanged tip; commands written to the kernel directly bypass this
+
+    goal_store is the pycoq.goal_store.GoalStore (new by default, can be shared between sessions)
+    in which the proof states observed by the module function execute() are interned
+
+    with spill_threshold set the response lines are read by chunks (kernel.readline_sexp(), see
+    pycoq.stream): a line longer than spill_threshold bytes (a large proof term or goal) is spilled
+    to a temporary file as it arrives and kept as a mapped pycoq.stream.LazySexp, the records of the
+    response index refer to the map and decode their payload on access
+
     """
 
-    def __init__(self, kernel: LocalKernel, logfname=None):
+    def __init__(self, kernel: Union[LocalKernel, 'pycoq.remote.RemoteKernel', LocalKernelConfig],
+                 logfname=None, pipelined: bool = False,
+                 keep_responses: Optional[int] = None, feedback: str = 'all',
+                 resilient: bool = False, max_restarts: int = 1,
+                 timeout: Optional[float] = None, session_timeout: Optional[float] = None,
+                 interrupt_timeout: float = TIMEOUT_TERMINATE, cache_goals: bool = True,
+                 goal_store: Optional[GoalStore] = None, spill_threshold: Optional[int] = None):
         """ 
         wraps coq-serapi interface on the running kernel object
         """
         self._logfname = logfname  # seems to log to responses from coq serapi to ._serapi_log logfile (not sure why)
         self._kernel: pycoq.kernel.LocalKernel = kernel  # object that can start the background coq-serapi process
         # self._cfg: LocalKernelConfig = self._kernel.cfg  # config of the (coq serapi) kernel (which runs the serapi)
-        if isinstance(kernel, pycoq.kernel.LocalKernel):
+        if isinstance(kernel, (pycoq.kernel.LocalKernel, pycoq.remote.RemoteKernel)):
             self._kernel = kernel
             self._cfg = None
         elif isinstance(kernel, pycoq.common.LocalKernelConfig):
@@ -124,7 +207,7 @@ class CoqSerapi():
             self._cfg = kernel
         else:
             raise TypeError("CoqSerapi class must be initialized either with an existing kernel "
-                            "object of type pycoq.kernel.LocalKernel or config object of type "
+                            "object of type pycoq.kernel.LocalKernel, pycoq.remote.RemoteKernel or config object of type "
                             " pycoq.common.LocalKernelConfig "
                             f"but the supplied argument has type {type(kernel)}")
         # serapi command history for this CoqSerapi object/instance
@@ -132,17 +215,90 @@ class CoqSerapi():
         self._serapi_response_history = []
         self._added_sids = []
         self._executed_sids = []
-        # import serlib.parser
-        # self.parser = serlib.parser.SExpParser()
-        self._queried_local_ctx_and_goals = []
+        # sids added and not canceled, in the order of addition; the last one is the tip
+        self._live_sids: List[int] = []
+        self._checkpoint: Optional[int] = None
+        # executed statements and their sids, in the order of execution, replayed after a restart
+        self._executed_stmts: List[Tuple[str, List[int]]] = []
+        # resilient mode: restarts of the kernel, translation of sids of the last restart
+        self._resilient = resilient
+        self._max_restarts = max_restarts
+        self._restarts = 0
+        self._sid_map: Dict[int, int] = {}
+        # deadlines: per command default, total of the session (absolute loop time set on start)
+        self._timeout = timeout
+        self._session_timeout = session_timeout
+        self._session_deadline: Optional[float] = None
+        self._interrupt_timeout = interrupt_timeout
+        # s-expression parser of serlib with the dictionary of words of the session, see self.parser
+        self._parser = None
+        # proof states observed by execute(stmt, coq): ProofState interned in goal_store, [] out of proof mode
+        self.goal_store = GoalStore() if goal_store is None else goal_store
+        self._queried_local_ctx_and_goals: List[Union[ProofState, list]] = []
+        # goals answers by query opts, valid while _state_version (bumped by Add, Exec, Cancel) is unchanged,
+        # kept as views on the response lines (ObjList.raw) so that a spilled goal stays in its mmap
+        self._cache_goals = cache_goals
+        self._goals_cache: Dict[str, List[memoryview]] = {}
+        self._state_version = 0
+        # response lines classified and bucketed by cmd_tag
+        self._responses = ResponseIndex(keep_last=keep_responses)
+        self._keep_response_history = keep_responses is None
+        if feedback not in FEEDBACK_POLICIES:
+            raise ValueError(f"feedback policy must be one of {FEEDBACK_POLICIES}, got {feedback}")
+        self._feedback = feedback
+        # sids of the Show Proof in flight, their Message feedback is routed whatever the policy
+        self._message_sids: Set[int] = set()
+        # pipelined mode: futures resolved by the dispatcher task on (Answer cmd_tag Completed)
+        self._pipelined = pipelined
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._dispatcher_exc: Optional[BaseException] = None
+        self._completed_futures: Dict[int, asyncio.Future] = {}
+        # response lines longer than spill_threshold bytes are read by chunks into temporary files
+        self._spill_threshold = spill_threshold
         # note: self.__aenter__() calls self.start() which starts the kernel proc (serapi)
         
+    @property
+    def kernel_cfg(self) -> Optional[LocalKernelConfig]:
+        """ config of the coq-serapi kernel of the session (of a RemoteKernel: its config on the server) """
+        if isinstance(self._kernel, pycoq.remote.RemoteKernel):
+            return self._kernel.kernel_cfg
+        if isinstance(self._kernel, pycoq.kernel.LocalKernel):
+            return self._kernel.cfg
+        return self._cfg
+
+    @property
+    def parser(self):
+        """ serlib.parser.SExpParser of the session, created on first use (imports numpy and numba)
+        and replaced by a new one when its dictionary is full (see CoqSerapi._with_parser)
+        """
+        if self._parser is None:
+            import serlib.parser
+            self._parser = serlib.parser.SExpParser()
+        return self._parser
+
+    def _with_parser(self, fn, *args):
+        """ returns fn(self.parser, *args); once the dictionary of the parser is full (BufferOverflow)
+        the session continues with a new parser, the encodings and views made before keep the old one
+        """
+        import serlib.cparser
+        try:
+            return fn(self.parser, *args)
+        except serlib.cparser.BufferOverflow as exc:
+            logging.info(f"CoqSerapi: new s-expression parser after {exc}")
+            self._parser = None
+            return fn(self.parser, *args)
+
     async def start(self):
         """ starts new kernel if not already connected
+        in pipelined mode starts the response dispatcher
         """
         if (self._kernel is None):
             self._kernel = pycoq.kernel.LocalKernel(self._cfg)
             await self._kernel.start()
+        if self._session_timeout is not None and self._session_deadline is None:
+            self._session_deadline = asyncio.get_running_loop().time() + self._session_timeout
+        if self._pipelined and self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch_responses())
 
     async def __aenter__(self):
         await self.start()
@@ -150,172 +306,361 @@ class CoqSerapi():
 
     async def __aexit__(self, exception_type, exception_value, traceback):
         await self._kernel.__aexit__(exception_type, exception_value, traceback)
+        if self._dispatcher is not None:
+            # the dispatcher finishes on EOF of the terminated kernel
+            try:
+                await asyncio.wait_for(self._dispatcher, timeout=TIMEOUT_TERMINATE)
+            except asyncio.TimeoutError:
+                pass
+            self._dispatcher = None
         async for line in self._kernel.readlines():
-            self._serapi_response_history.append(line)
+            self._route_response(line.encode())
 
         if not self._logfname is None:
             await self.save_serapi_log()
 
-    async def add(self, coq_stmt: str):
-        """ sends serapi command
-        (Add () "coq_stmt")
-        """
+    async def _send(self, cmd: str) -> int:
+        """ sends serapi command cmd, returns its cmd_tag
 
+        the cmd_tag is assigned and the command is written to the kernel
+        without yielding to the event loop in between, so that concurrent
+        senders in pipelined mode get the tags in the order serapi sees the commands
+        """
+        if self._dispatcher_exc is not None:
+            raise self._dispatcher_exc
         cmd_tag = len(self._sent_history)
-
-        quoted = ocaml_string_quote(coq_stmt)
-        cmd = f'(Add () "{quoted}")'
-        await self._kernel.writeline(cmd)
         self._sent_history.append(cmd)
-
+        if cmd.startswith(STATE_COMMANDS):
+            self._state_version += 1
+            self._goals_cache.clear()
+        self._responses.open(cmd_tag)
+        if self._pipelined:
+            self._completed_futures[cmd_tag] = asyncio.get_running_loop().create_future()
+        await self._kernel.writeline(cmd)
         return cmd_tag
 
+    async def add(self, coq_stmt: str, opts: str = ''):
+        """ sends serapi command
+        (Add (opts) "coq_stmt")
+        """
+        quoted = ocaml_string_quote(coq_stmt)
+        return await self._send(f'(Add ({opts}) "{quoted}")')
+
     async def query_goals(self, opts: str = '') -> str:
         """ sends serapi command 
         (Query () Goals)
         """
-        cmd_tag = len(self._sent_history)
-        cmd = f'(Query ({opts}) Goals)'
-        await self._kernel.writeline(cmd)
-        self._sent_history.append(cmd)
-        return cmd_tag
+        return await self._send(f'(Query ({opts}) Goals)')
 
     async def query_definition(self, name) -> str:
         """ 
         sends serapi command
         (Query () Definition name)
         """
-        cmd_tag = len(self._sent_history)
-        cmd = f'(Query () (Definition {name}))'
-        await self._kernel.writeline(cmd)
-        self._sent_history.append(cmd)
-        return cmd_tag
+        return await self._send(f'(Query () (Definition {name}))')
 
     async def exec(self, sid: int):
         """ sends serapi command to execute coq statement sid
         (Exec sid)
         """
-        cmd_tag = len(self._sent_history)
-
-        cmd = f'(Exec {sid})'
-        await self._kernel.writeline(cmd)
-        self._sent_history.append(cmd)
-
-        return cmd_tag
+        return await self._send(f'(Exec {sid})')
 
     async def cancel(self, sids: List[int]) -> bool:
         """ cancels given list of sids
         """
-        cmd_tag = len(self._sent_history)
-        cmd = f'(Cancel {sexp(sids)})'
-
-        await self._kernel.writeline(cmd)
-        self._sent_history.append(cmd)
-        return cmd_tag
+        return await self._send(f'(Cancel {sexp(sids)})')
 
-    async def wait_for_answer_completed(self, cmd_tag: int):
+    def _route_response(self, line: Union[bytes, LazySexp]) -> Optional[int]:
+        """ decodes serapi response line into the response index (and saves it to _serapi_response_history
+        if it is kept); returns cmd_tag if line is (Answer cmd_tag Completed) otherwise None
+        a spilled line (LazySexp) is decoded from its head and only its head is kept in the history,
+        the map of the line is referred to by the response index alone
+        """
+        spilled = isinstance(line, LazySexp)
+        head = line.head() if spilled else line
+        if not keep_feedback(head, self._feedback) and not self._needs_message(head):
+            return None
+        if self._keep_response_history:
+            self._serapi_response_history.append(spilled_head(line) if spilled else line.decode())
+        return self._responses.route(line)
+
+    async def _readline(self) -> Union[bytes, LazySexp]:
+        """ reads a response line from the kernel, b'' at EOF; with spill_threshold set the line is read
+        by chunks and returned as a pycoq.stream.LazySexp if it is longer than spill_threshold
+        """
+        if self._spill_threshold is None:
+            return await self._kernel.readline_bytes()
+        line = await self._kernel.readline_sexp(spill_threshold=self._spill_threshold)
+        if line is None:
+            return b''
+        return line if line.spilled else line.data
+
+    async def _dispatch_responses(self):
+        """ pipelined mode reader task
+        owns the kernel stdout, routes every response line and resolves
+        the future of cmd_tag when (Answer cmd_tag Completed) is received
+        """
+        try:
+            while True:
+                line = await self._readline()
+                if line == b'':
+                    raise EOFError(f"coq-serapi kernel stdout closed, process returncode "
+                                   f"{self._kernel.returncode}")
+                cmd_tag = self._route_response(line)
+                if cmd_tag is not None:
+                    fut = self._completed_futures.get(cmd_tag)
+                    if fut is not None and not fut.done():
+                        fut.set_result(self._resp_ind())
+        except (Exception, asyncio.CancelledError) as exc:
+            self._dispatcher_exc = exc
+            for fut in self._completed_futures.values():
+                if not fut.done():
+                    fut.set_exception(exc)
+
+    async def wait_for_answer_completed(self, cmd_tag: int, timeout: Optional[float] = None):
         """ read and save responses from serapi to _serapi_response_history
         stop when (Answer cmd_tag Completed) is received
+        in pipelined mode awaits the dispatcher to receive (Answer cmd_tag Completed)
+        raises asyncio.TimeoutError if timeout is exceeded, the command can be awaited again
         """
+        if self._pipelined:
+            if cmd_tag not in self._completed_futures:
+                raise KeyError(f"cmd_tag {cmd_tag} was not sent or was already awaited")
+            fut = self._completed_futures[cmd_tag]
+            result = await asyncio.wait_for(asyncio.shield(fut), timeout=timeout)
+            del self._completed_futures[cmd_tag]
+            return result
+
+        return await asyncio.wait_for(self._read_until_completed(cmd_tag), timeout=timeout)
+
+    def _needs_message(self, head: bytes) -> bool:
+        """ True if head is the Message feedback of a Show Proof in flight """
+        if not self._message_sids:
+            return False
+        feedback = decode_feedback(head[:256])
+        return feedback.kind == 'Message' and feedback.span_id in self._message_sids
+
+    def _keeps_feedback(self, kind: str) -> bool:
+        """ True if the feedback of contents kind is routed to the response index by the feedback policy """
+        return self._feedback == 'all' or (self._feedback == 'messages' and kind == 'Message')
+
+    def _resp_ind(self) -> Optional[int]:
+        """ length of _serapi_response_history, None if it is not kept (keep_responses=N) """
+        return len(self._serapi_response_history) if self._keep_response_history else None
+
+    async def _read_until_completed(self, cmd_tag: int):
         while True:
-            line = await self._kernel.readline()
-            if line == '':
-                print("empty readline: ", end='')
-                time.sleep(0.1)
-                print("process terminated with proc code", self._kernel._proc.returncode)
-                raise EOFError
-
-            self._serapi_response_history.append(line)
-            if matches_answer_completed(line, cmd_tag):
-                return len(self._serapi_response_history)
-
-    async def add_completed(self, coq_stmt: str) -> Tuple[int, int, Union[int, str]]:
+            line = await self._readline()
+            if line == b'':
+                try:
+                    returncode = await asyncio.wait_for(self._kernel.wait(), timeout=TIMEOUT_TERMINATE)
+                except asyncio.TimeoutError:
+                    returncode = None
+                raise EOFError(f"coq-serapi kernel stdout closed, process returncode {returncode}")
+
+            if self._route_response(line) == cmd_tag:
+                return self._resp_ind()
+
+    def _call_timeout(self, timeout: Optional[float]) -> Optional[float]:
+        """ deadline of a command: timeout or the session default, bounded by the session deadline """
+        timeout = self._timeout if timeout is None else timeout
+        if self._session_deadline is not None:
+            remaining = max(0.0, self._session_deadline - asyncio.get_running_loop().time())
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        return timeout
+
+    async def _wait_completed(self, cmd_tag: int, timeout: Optional[float] = None):
+        """ waits for (Answer cmd_tag Completed) until the deadline of the command;
+        past the deadline interrupts the kernel and waits interrupt_timeout for the command
+        to complete, otherwise restarts the kernel
+        returns (resp_ind, None) or (resp_ind, CoqTimeout) if the deadline was exceeded
+        """
+        timeout = self._call_timeout(timeout)
+        try:
+            return await self.wait_for_answer_completed(cmd_tag, timeout=timeout), None
+        except asyncio.TimeoutError:
+            pass
+        logging.warning(f"CoqSerapi: {self._sent_history[cmd_tag]} exceeded the deadline of {timeout}s, "
+                        f"interrupting the kernel")
+        restarted = False
+        try:
+            await self._kernel.interrupt()
+            await self.wait_for_answer_completed(cmd_tag, timeout=self._interrupt_timeout)
+        except (asyncio.TimeoutError,) + KERNEL_EXITED:
+            logging.warning(f"CoqSerapi: kernel did not recover from the interrupt, restarting")
+            await self.restart()
+            restarted = True
+        return (self._resp_ind(),
+                CoqTimeout(message=f"(Timeout {timeout})", cmd_tag=cmd_tag, timeout=timeout, restarted=restarted))
+
+    async def add_completed(self, coq_stmt: str, timeout: Optional[float] = None) -> Tuple[int, int, Union[int, str]]:
         """ sends serapi command Add CoqSerapi.add()
         awaits completed response; returns list of sids / CoqExns
         """
 
         cmd_tag = await self.add(coq_stmt)
-        resp_ind = await self.wait_for_answer_completed(cmd_tag)
+        resp_ind, timed_out = await self._wait_completed(cmd_tag, timeout)
 
         sids = await self.added_sids(cmd_tag)  # separate added sids vs CoqExns
+        if timed_out is not None and timed_out.restarted:
+            sids = []
         self._added_sids.append(sids)
-        coqexns = await self.coqexns(cmd_tag)
+        self._live_sids.extend(sids)
+        coqexns = [timed_out] if timed_out is not None else await self.coqexns(cmd_tag)
 
         return (cmd_tag, resp_ind, sids, coqexns)
 
-    async def exec_completed(self, sid: int) -> List[str]:  # returns list of coqexn
+    async def exec_completed(self, sid: int, timeout: Optional[float] = None) -> List[str]:  # returns list of coqexn
         """ sends serapi command Exec
         awaits completed response
         returns ind of completed message
-        and CoqExns
+        and CoqExns (CoqTimeout if the deadline was exceeded)
         """
         cmd_tag = await self.exec(sid)
-        resp_ind = await self.wait_for_answer_completed(cmd_tag)
-        coqexns = await self.coqexns(cmd_tag)
+        resp_ind, timed_out = await self._wait_completed(cmd_tag, timeout)
+        coqexns = [timed_out] if timed_out is not None else await self.coqexns(cmd_tag)
 
         return (cmd_tag, resp_ind, coqexns)
 
     async def cancel_completed(self, sids: List[int]) -> List[str]:  # List[CoqExn]
+        # sids of a kernel that was restarted are gone
+        sids = [sid for sid in sids if sid in self._live_sids]
         cmd_tag = await self.cancel(sids)
         resp_ind = await self.wait_for_answer_completed(cmd_tag)
+        await self._forget_canceled(cmd_tag)
+        return (cmd_tag, resp_ind)
+
+    async def _forget_canceled(self, cmd_tag: int):
+        """ removes the sids canceled by the completed Cancel cmd_tag from the session state """
         coqexns = await self.coqexns(cmd_tag)
         if coqexns != []:
             raise RuntimeError(f'Unexpected error during coq-serapi command Cancel'
                                f'with CoqExns {coqexns}')
-        return (cmd_tag, resp_ind)
+        canceled = set(self._responses[cmd_tag].canceled)
+        if canceled:
+            self._live_sids = [sid for sid in self._live_sids if sid not in canceled]
+            self._executed_sids = [sid for sid in self._executed_sids if sid not in canceled]
+            self._executed_stmts = [(stmt, sids) for stmt, sids in self._executed_stmts
+                                    if canceled.isdisjoint(sids)]
+
+    def tip(self) -> Optional[int]:
+        """ returns the last added and not canceled sid, None if there is none
+        """
+        return self._live_sids[-1] if self._live_sids else None
 
-    async def _query_goals_completed(self, opts: str = '') -> List[str]:
-        """ returns literal serapi response (Query () Goals)
+    def checkpoint(self) -> Optional[int]:
+        """ marks the current tip sid as the baseline restored by CoqSerapi.reset()
+        returns the baseline sid (None for the initial state of the session)
         """
-        cmd_tag = await self.query_goals(opts)
-        resp_ind = await self.wait_for_answer_completed(cmd_tag)
+        self._checkpoint = self.tip()
+        return self._checkpoint
+
+    async def reset(self, baseline: Optional[int] = None):
+        """ restores the session to the baseline sid (by default the last CoqSerapi.checkpoint(),
+        or the initial state if there is none) with a single Cancel of all sids added after it;
+        raises RuntimeError if serapi does not cancel exactly the sids known locally
+        returns the list of canceled sids
+        """
+        return await self.reset_to(self._checkpoint if baseline is None else baseline)
+
+    async def reset_to(self, sid: Optional[int]):
+        """ restores the session to sid as returned by CoqSerapi.tip(), None is the initial state
+        of the session regardless of the checkpoint; see CoqSerapi.reset()
+        """
+        try:
+            return await self._reset(sid)
+        except KERNEL_EXITED:
+            if not self._resilient:
+                raise
+            await self.restart()
+            return await self._reset(self.translate_sid(sid))
+
+    async def _reset(self, baseline: Optional[int]):
+        if baseline is None:
+            after = list(self._live_sids)
+        elif baseline in self._live_sids:
+            after = self._live_sids[self._live_sids.index(baseline) + 1:]
+        else:
+            raise ValueError(f"baseline sid {baseline} is not a live sid of the session")
+        if not after:
+            return []
+        cmd_tag, _ = await self.cancel_completed(after)
+        canceled = self._responses[cmd_tag].canceled
+        if sorted(canceled) != sorted(after):
+            raise RuntimeError(f"CoqSerapi.reset to baseline {baseline}: serapi canceled {canceled} "
+                               f"but the sids added after the baseline are {after}")
+        return after
+
+    async def _query_completed(self, query, *args, timeout: Optional[float] = None,
+                               raw: bool = False) -> Union[List[str], List[memoryview]]:
+        """ sends query(*args) and returns the literal serapi answers,
+        with raw the ObjList payloads as views on the response lines (see ObjList.raw)
+        """
+        cmd_tag = await query(*args)
+        resp_ind, timed_out = await self._wait_completed(cmd_tag, timeout)
+        if timed_out is not None:
+            raise TimeoutError(f'coq-serapi command {self._sent_history[cmd_tag]} exceeded the deadline '
+                               f'of {timed_out.timeout}s')
         coqexns = await self.coqexns(cmd_tag)
         if coqexns != []:
-            raise RuntimeError(f'Unexpected error during coq-serapi command Query () Goals '
+            raise RuntimeError(f'Unexpected error during coq-serapi command {self._sent_history[cmd_tag]} '
                                f'with CoqExns {coqexns}')
-        goals = await self._answer(cmd_tag)
-        return goals
+        if raw:
+            return self._responses[cmd_tag].raw_answers
+        return await self._answer(cmd_tag)
+
+    async def _query_goals_raw(self, opts: str = '', timeout: Optional[float] = None) -> List[memoryview]:
+        """ returns the ObjList payloads of (Query () Goals) as views on the response lines,
+        neither copied nor decoded (a spilled goal stays in its mmap);
+        memoized in the goals cache if cache_goals is set
+        """
+        if opts in self._goals_cache:
+            return list(self._goals_cache[opts])
+        state_version = self._state_version
+        answers = await self._with_restart(self._query_completed, self.query_goals, opts, timeout=timeout, raw=True)
+        if self._cache_goals and state_version == self._state_version:
+            self._goals_cache[opts] = list(answers)
+        return answers
+
+    async def _query_goals_completed(self, opts: str = '', timeout: Optional[float] = None) -> List[str]:
+        """ returns literal serapi response (Query () Goals)
+        memoized in the goals cache if cache_goals is set
+        """
+        return [str(answer, 'utf-8') for answer in await self._query_goals_raw(opts, timeout)]
 
     async def _query_definition_completed(self, name) -> List[str]:
         """
         returns literal serapi response (Query () Definition name)
         """
-        cmd_tag = await self.query_definition(name)
-        resp_ind = await self.wait_for_answer_completed(cmd_tag)
-        coqexns = await self.coqexns(cmd_tag)
-        if coqexns != []:
-            raise RuntimeError(f'Unexpected error during coq-serapi command Query () Definition {name}'
-                               f'with CoqExns {coqexns}')
-        definition = await self._answer(cmd_tag)
-        return definition
+        return await self._with_restart(self._query_completed, self.query_definition, name)
 
-    async def query_goals_completed(self, opts: str = '') -> str:
+    async def query_goals_completed(self, opts: str = '', timeout: Optional[float] = None) -> str:
         """
         returns a single serapi response on (Query () Goals)
         """
 
-        serapi_goals: List[str] = await self._query_goals_completed(opts)
+        return str(await self._query_goal_raw(opts, timeout), 'utf-8')
+
+    async def _query_goal_raw(self, opts: str = '', timeout: Optional[float] = None) -> memoryview:
+        """ returns the single ObjList payload of (Query () Goals) as a view, see _query_goals_raw """
+        serapi_goals: List[memoryview] = await self._query_goals_raw(opts, timeout)
 
         if len(serapi_goals) != 1:
-            print("pycoq received list of goals", serapi_goals)
+            print("pycoq received list of goals", [str(goals, 'utf-8') for goals in serapi_goals])
             raise RuntimeError("unexpected behaviour of pycoq - serapi - coq API: "
                                "query goals returned a list of len != 1 in serapi response")
         else:
             return serapi_goals[0]
 
-    # async def serapi_goals(self) -> SerapiGoals:
-    # async def serapi_goals(self):
-    #     """
-    #     returns parsed SerapiGoals object
-    #     """
-    #     from pycoq.query_goals import SerapiGoals
-    #     _serapi_goals: str = await self.query_goals_completed()
-    #     post_fix = self.parser.postfix_of_sexp(_serapi_goals)
-    #     import serlib.parser
-    #     ann = serlib.cparser.annotate(post_fix)
-    #     ret_serapi_goals: SerapiGoals = pycoq.query_goals.parse_serapi_goals(self.parser, post_fix, ann, pycoq.query_goals.SExpr)
-    #     return ret_serapi_goals
-    # return pycoq.query_goals.parse_serapi_goals(self.parser, post_fix, ann, pycoq.query_goals.SExpr)
+    async def serapi_goals(self, timeout: Optional[float] = None) -> 'pycoq.query_goals.SerapiGoalsView':
+        """
+        returns the goals of (Query () Goals) as lazy views over the postfix encoding
+        of the response by self.parser, see pycoq.query_goals.SerapiGoalsView;
+        the parser reads the payload in place, a spilled response is not decoded whole
+        """
+        import pycoq.query_goals
+        _serapi_goals: memoryview = await self._query_goal_raw(timeout=timeout)
+        return self._with_parser(pycoq.query_goals.SerapiGoalsView.of_sexp, _serapi_goals)
 
     async def query_local_ctx_and_goals(self) -> Union[str, list]:
         """
@@ -342,22 +687,8 @@ class CoqSerapi():
                           \nn + 0 = n"))))
             (Answer 3 Completed)
         """
-        from sexpdata import loads
-
-        _local_ctx_and_goals: str = await self.query_goals_completed(opts='(pp ((pp_format PpStr)))')
-        _local_ctx_and_goals: list = loads(_local_ctx_and_goals)
-        assert str(_local_ctx_and_goals[0]) == 'ObjList'
-        if _local_ctx_and_goals[1] == []:
-            return []  # if not in proof mode there is no coq-str obj so return empty list
-        else:
-            # example smallest valid goals: (ObjList ((CoqString "")))
-            obj_list: list = _local_ctx_and_goals[1]
-            coq_str_sexp: list = obj_list[0]  # e.g. (CoqString "")
-            assert len(coq_str_sexp) == 2
-            assert str(coq_str_sexp[0]) == 'CoqString'
-            # local_ctx_and_goals: str = _local_ctx_and_goals[1][0][1]
-            local_ctx_and_goals: str = coq_str_sexp[1]
-            return local_ctx_and_goals
+        _local_ctx_and_goals: str = await self.query_goals_completed(opts=PPSTR)
+        return local_ctx_and_goals_of_answer(_local_ctx_and_goals)
 
     async def in_proof_mode(self) -> bool:
         """
@@ -524,42 +855,71 @@ class CoqSerapi():
         _local_ctx_and_goals: str = await self.query_goals_completed(opts='(pp ((pp_format PpStr)))')
         raise NotImplemented
 
-    async def get_current_proof_term_via_add(self) -> Union[str, list[CoqExn]]:
+    async def get_current_proof_term_via_add(self) -> str:
         """
         Returns the proof term (proof object, lambda term etc.) representation of the proof.
 
-        (Add () "Show Proof.")
+        (Add () "Show Proof.") see CoqSerapi.proof_term()
         """
-        coq_stmt: str = 'Show Proof.'
-        cmd_tag, resp_ind, coq_exns, sids = await self.execute(coq_stmt)
-        if coq_exns:
-            logging.info(f'{await self.query_local_ctx_and_goals()=}')
-            logging.info(f'{await self.in_proof_mode()=}')
-            st()
-            raise ValueError(f'Got an error, are you sure you can get the proof term right now? err: {coq_exns=}'
-                             f', {self._sent_history=}')
-            # return coq_exns
-        # todo: another place where perhaps we should move to VP's serlib? unsure if worth it.
-        # - extract_proof_term, following the Feedback constructor from type answer serapir response: http://ejgallego.github.io/coq-serapi/coq-serapi/Serapi/Serapi_protocol/#type-answer.Feedback
-        from sexpdata import loads
-        serapi_response: str = self._serapi_response_history[-3]
-        res: str = serapi_response
-        _res: list = loads(res)
-        feedback: list = _res[-1]
-        assert len(feedback) == 4
-        contents: list = feedback[-1]
-        assert len(contents) == 2
-        message: list = contents[-1]
-        assert len(message) == 5
-        string: list = message[-1]
-        assert str(string[0]) == 'str'
-        # - edge case if the sexpdata sees an atom that is a string it didn't wrap it in a Symbol for some reason
-        if isinstance(string[-1], str):
-            ppt: str = string[-1]
-        else:
-            ppt: str = str(string[-1])
+        ppt: Optional[str] = await self.proof_term()
+        if ppt is None:
+            raise ValueError(f'Got an error, are you sure you can get the proof term right now? '
+                             f'{self._sent_history[-3:]=}')
         return ppt
 
+    async def proof_term(self, form: str = 'str', timeout: Optional[float] = None):
+        """ returns the proof term of the proof in progress at the tip, None out of proof mode
+        or on CoqExn; Show Proof. is added on the tip and its Exec and Cancel are sent back to back,
+        the term is read from the Message feedback of the Show Proof sid (other feedback is ignored)
+        form 'str' returns the printed term (only the (str "...") field of the message is parsed),
+        'pp' the s-expression of its Pp.t document as bytes, 'postfix' the Pp.t document encoded
+        by CoqSerapi.parser (serlib.parser.SExpParser.postfix_of_bytestring)
+        timeout is the deadline of each serapi command (see CoqSerapi)
+        """
+        if form not in PROOF_TERM_FORMS:
+            raise ValueError(f"form must be one of {PROOF_TERM_FORMS}, got {form}")
+        return await self._with_restart(self._proof_term, form, timeout=timeout)
+
+    async def _proof_term(self, form: str = 'str', timeout: Optional[float] = None):
+        goals_cache, restarts = dict(self._goals_cache), self._restarts
+        _, _, sids, coqexns = await self.add_completed(SHOW_PROOF, timeout)
+        if coqexns or not sids:
+            await self.cancel_completed(sids)
+            return None
+        show_sid = sids[-1]
+        self._message_sids.add(show_sid)
+        show_tag = await self.exec(show_sid)
+        cancel_tag = await self.cancel([show_sid])
+        timeouts: Dict[int, CoqTimeout] = {}
+        for cmd_tag in [show_tag, cancel_tag]:
+            _, timed_out = await self._wait_completed(cmd_tag, timeout)
+            if timed_out is not None:
+                if timed_out.restarted:
+                    return None
+                timeouts[cmd_tag] = timed_out
+        self._message_sids.discard(show_sid)
+        await self._forget_canceled(cancel_tag)
+        # the document is back at the tip of the call, its goals are those before Show Proof
+        if self._restarts == restarts:
+            self._goals_cache = goals_cache
+        if timeouts:
+            return None
+        return self._proof_term_of(show_tag, show_sid, form)
+
+    def _proof_term_of(self, show_tag: int, show_sid: int, form: str = 'str'):
+        """ the proof term in form (see proof_term()) of the Message feedback of show_sid
+        to the completed Exec show_tag, None if there is none
+        """
+        responses = self._responses[show_tag]
+        messages = [feedback for feedback in responses.feedback('Message') if feedback.span_id == show_sid]
+        if not messages or responses.coqexns:
+            return None
+        line = messages[-1].line
+        if form == 'str':
+            return message_text(line)
+        pp = message_pp(line)
+        return pp if form == 'pp' else self._with_parser(lambda parser: parser.postfix_of_bytestring(pp))
+
     async def query_definition_completed(self, name) -> str:
         """
         returns a single serapi response on (Query () Definition name))
@@ -667,6 +1027,7 @@ Displays all open goals / existential variables in the current proof along with
 
         Details:
             - after stmt exec, goals changes as follows: [] -> ""
+        To tag the sentences of a file without kernel round trips see pycoq.classify.classify().
         """
         goals_before_cmd: Union[str, list] = await self.query_local_ctx_and_goals()
         cmd_tag, resp_ind, coq_exns, sids = await self.execute(stmt)
@@ -738,13 +1099,16 @@ Displays all open goals / existential variables in the current proof along with
             await self.cancel_completed(sids)
         return in_proof_mode
 
-    async def execute(self, coq_stmt: str) -> List[CoqExn]:
+    async def execute(self, coq_stmt: str, timeout: Optional[float] = None) -> List[CoqExn]:
         """ tries to execute coq_stmt
         if CoqExn then cancel coq_stmt
         returns (cmd_tag, resp_ind, List[CoqExn], List[executed sids])
+        timeout is the deadline of each serapi command (see CoqSerapi)
         """
+        return await self._with_restart(self._execute, coq_stmt, timeout=timeout)
 
-        cmd_tag, resp_ind, sids, coqexns = await self.add_completed(coq_stmt)
+    async def _execute(self, coq_stmt: str, timeout: Optional[float] = None):
+        cmd_tag, resp_ind, sids, coqexns = await self.add_completed(coq_stmt, timeout)
 
         assert all(isinstance(sid, int) for sid in sids)
         if len(sids) == 0:
@@ -755,14 +1119,337 @@ Displays all open goals / existential variables in the current proof along with
             return (cmd_tag, resp_ind, coqexns, [])
 
         for sid in sids:
-            cmd_tag, resp_ind, coqexns = await self.exec_completed(sid)
+            cmd_tag, resp_ind, coqexns = await self.exec_completed(sid, timeout)
             if coqexns:
                 (cmd_tag, resp_ind) = await self.cancel_completed(sids)
                 return (cmd_tag, resp_ind, coqexns, None)
             self._executed_sids.append(sid)
 
+        if sids:
+            self._executed_stmts.append((coq_stmt, sids))
         return (cmd_tag, resp_ind, [], sids)
 
+    async def execute_and_observe(self, coq_stmt: str, opts: str = '', proof_term: bool = False,
+                                  timeout: Optional[float] = None) -> Observation:
+        """ executes coq_stmt and observes the goals (Query (opts) Goals) after it, and with
+        proof_term=True the Show Proof term, in one pipeline: after the Add of coq_stmt
+        (followed by Show Proof.) the Exec of its last sid, the Goals query at that sid,
+        the Exec of Show Proof and its Cancel are sent back to back and awaited together
+        on CoqExn the added sids are canceled as in execute(); the goals observed are memoized
+        as the goals of the new tip (see cache_goals)
+        timeout is the deadline of each serapi command (see CoqSerapi)
+        """
+        return await self._with_restart(self._execute_and_observe, coq_stmt, opts, proof_term, timeout=timeout)
+
+    async def _execute_and_observe(self, coq_stmt: str, opts: str = '', proof_term: bool = False,
+                                   timeout: Optional[float] = None) -> Observation:
+        tip = self.tip()
+        text = coq_stmt
+        if proof_term:
+            text = (coq_stmt if coq_stmt[-1:].isspace() else coq_stmt + '\n') + SHOW_PROOF
+        _, _, sids, coqexns = await self.add_completed(text, timeout)
+        if coqexns:
+            await self.cancel_completed(sids)
+            return Observation(sids=[], coqexns=coqexns)
+        show_sid = sids.pop() if proof_term else None
+        if show_sid is not None:
+            self._message_sids.add(show_sid)
+
+        state_sid = sids[-1] if sids else tip
+        exec_tag = await self.exec(sids[-1]) if sids else None
+        goals_tag = await self.query_goals(opts if state_sid is None else f'(sid {state_sid}) {opts}')
+        show_tag = await self.exec(show_sid) if show_sid is not None else None
+        cancel_tag = await self.cancel([show_sid]) if show_sid is not None else None
+        state_version = self._state_version
+
+        timeouts: Dict[int, CoqTimeout] = {}
+        for cmd_tag in [exec_tag, goals_tag, show_tag, cancel_tag]:
+            if cmd_tag is None:
+                continue
+            _, timed_out = await self._wait_completed(cmd_tag, timeout)
+            if timed_out is not None:
+                timeouts[cmd_tag] = timed_out
+                if timed_out.restarted:
+                    # the sids are gone with the kernel, the commands after cmd_tag were never answered
+                    return Observation(sids=None, coqexns=[timed_out])
+        self._message_sids.discard(show_sid)
+        if cancel_tag is not None:
+            await self._forget_canceled(cancel_tag)
+
+        if exec_tag is not None:
+            coqexns = [timeouts[exec_tag]] if exec_tag in timeouts else await self.coqexns(exec_tag)
+            if coqexns:
+                await self.cancel_completed(sids)
+                return Observation(sids=None, coqexns=coqexns)
+            self._executed_sids.extend(sids)
+            self._executed_stmts.append((coq_stmt, sids))
+
+        observation = Observation(sids=sids, coqexns=[])
+        answers = self._responses[goals_tag].raw_answers
+        goals_coqexns = await self.coqexns(goals_tag)
+        if goals_tag not in timeouts and not goals_coqexns and len(answers) == 1:
+            observation.goals = str(answers[0], 'utf-8')
+            if self._cache_goals and state_version == self._state_version:
+                self._goals_cache[opts] = answers
+        else:
+            logging.warning(f"CoqSerapi.execute_and_observe: no goals after {coq_stmt!r}: "
+                            f"{goals_coqexns or timeouts.get(goals_tag)}")
+        if show_tag is not None and show_tag not in timeouts:
+            observation.proof_term = self._proof_term_of(show_tag, show_sid)
+        return observation
+
+    async def probe(self, candidates: List[str], opts: str = '',
+                    timeout: Optional[float] = None) -> List[Observation]:
+        """ evaluates each candidate statement from the current tip and discards it;
+        returns an Observation (sids, CoqExns, goals (Query (opts) Goals) after the candidate)
+        for each candidate, the session is left at the current tip
+
+        the STM of coq only adds on top of the tip of the document, so the branches are evaluated
+        one after the other: (Add ((ontop tip)) candidate) and, once its sids are known, the Exec of
+        its last sid, the Goals query at that sid and the Cancel of its sids are sent back to back
+        with the Add of the next candidate, which costs one round trip per candidate
+        timeout is the deadline of each serapi command (see CoqSerapi)
+        """
+        return await self._with_restart(self._probe, candidates, opts, timeout=timeout)
+
+    async def _probe(self, candidates: List[str], opts: str = '',
+                     timeout: Optional[float] = None) -> List[Observation]:
+        goals_cache, restarts = dict(self._goals_cache), self._restarts
+        observations = []
+        # every candidate is added on top of the tip of the call: the Add of the next candidate
+        # is sent before the Cancel of the previous one is processed, so self.tip() is stale
+        tip = self.tip()
+
+        async def add(stmt):
+            return await self.add(stmt, '' if tip is None else f'(ontop {tip})')
+
+        add_tag = await add(candidates[0]) if candidates else None
+        for i, stmt in enumerate(candidates):
+            _, timed_out = await self._wait_completed(add_tag, timeout)
+            sids = [] if timed_out is not None and timed_out.restarted else await self.added_sids(add_tag)
+            self._added_sids.append(sids)
+            self._live_sids.extend(sids)
+            coqexns = [timed_out] if timed_out is not None else await self.coqexns(add_tag)
+
+            exec_tag = goals_tag = cancel_tag = None
+            if sids and not coqexns:
+                exec_tag = await self.exec(sids[-1])
+                goals_tag = await self.query_goals(f'(sid {sids[-1]}) {opts}')
+            if sids:
+                cancel_tag = await self.cancel(sids)
+            next_stmt = candidates[i + 1] if i + 1 < len(candidates) else None
+            add_tag = await add(next_stmt) if next_stmt is not None else None
+
+            timeouts: Dict[int, CoqTimeout] = {}
+            for cmd_tag in [exec_tag, goals_tag, cancel_tag]:
+                if cmd_tag is None:
+                    continue
+                _, cmd_timed_out = await self._wait_completed(cmd_tag, timeout)
+                if cmd_timed_out is not None:
+                    timeouts[cmd_tag] = cmd_timed_out
+                    if cmd_timed_out.restarted:
+                        break
+            restarted = any(cmd_timed_out.restarted for cmd_timed_out in timeouts.values())
+            if restarted:
+                # the restarted kernel is at the tip again, the Add of the next candidate is lost
+                observations.append(Observation(sids=None, coqexns=list(timeouts.values())))
+                tip = self.translate_sid(tip)
+                add_tag = await add(next_stmt) if next_stmt is not None else None
+                continue
+            if cancel_tag is not None:
+                await self._forget_canceled(cancel_tag)
+
+            if coqexns:
+                observations.append(Observation(sids=[], coqexns=coqexns))
+                continue
+            if exec_tag is not None:
+                exec_coqexns = [timeouts[exec_tag]] if exec_tag in timeouts else await self.coqexns(exec_tag)
+                if exec_coqexns:
+                    observations.append(Observation(sids=None, coqexns=exec_coqexns))
+                    continue
+            observation = Observation(sids=sids, coqexns=[])
+            if goals_tag is not None and goals_tag not in timeouts and not await self.coqexns(goals_tag):
+                answers = await self._answer(goals_tag)
+                observation.goals = answers[0] if len(answers) == 1 else None
+            observations.append(observation)
+
+        # the document is back at the tip of the call, its goals are those before the probes
+        if self._restarts == restarts:
+            self._goals_cache = goals_cache
+        return observations
+
+    async def execute_many(self, coq_stmts: List[str], chunk_size: Optional[int] = None,
+                           timeout: Optional[float] = None):
+        """ tries to execute a sequence of coq statements with a single Add and a single Exec
+        of the last sid for each chunk of chunk_size statements (default: all in one chunk)
+        on CoqExn the failed statement and everything after it is cancelled,
+        the session stays at the sid of the last good statement
+        returns (cmd_tag, resp_ind, List[CoqExn], List[List[executed sids]]) where the last entry
+        has one list of sids for each executed statement, so on CoqExn the failed statement
+        is coq_stmts[len(sids)]
+        timeout is the deadline of each serapi command (see CoqSerapi)
+        """
+        return await self._with_restart(self._execute_many, coq_stmts, chunk_size, timeout=timeout)
+
+    async def _execute_many(self, coq_stmts: List[str], chunk_size: Optional[int] = None,
+                            timeout: Optional[float] = None):
+        chunk_size = chunk_size or max(1, len(coq_stmts))
+        cmd_tag, resp_ind, executed = None, None, []
+        for start in range(0, len(coq_stmts), chunk_size):
+            cmd_tag, resp_ind, coqexns, sids = await self._execute_chunk(coq_stmts[start:start + chunk_size],
+                                                                         timeout)
+            executed.extend(sids)
+            if coqexns:
+                return (cmd_tag, resp_ind, coqexns, executed)
+        return (cmd_tag, resp_ind, [], executed)
+
+    async def _execute_chunk(self, coq_stmts: List[str], timeout: Optional[float] = None):
+        """ Add of all coq_stmts in one command and Exec of the last added sid
+        the statement of each sid is found from the (bp, ep) location of Added
+        """
+        starts, text = [], ''
+        offset = 0
+        for stmt in coq_stmts:
+            starts.append(offset)
+            stmt = stmt if stmt[-1:].isspace() else stmt + '\n'
+            text += stmt
+            offset += len(stmt.encode('utf8'))
+
+        def stmt_index(loc):
+            return bisect.bisect_right(starts, loc[0]) - 1
+
+        cmd_tag, resp_ind, sids, coqexns = await self.add_completed(text, timeout)
+        if coqexns and isinstance(coqexns[0], CoqTimeout):
+            return (cmd_tag, resp_ind, coqexns, [])
+        locs = self._responses[cmd_tag].locs
+        stmt_of_sid = {sid: stmt_index(loc) for sid, loc in zip(sids, locs) if loc is not None}
+        assert len(stmt_of_sid) == len(sids), "coq-serapi Added response without location"
+
+        failed = len(coq_stmts)
+        if coqexns:
+            # parsing error: the statement of the error location and everything after fails
+            loc = coqexns[0].loc
+            failed = stmt_index(loc) if loc is not None else (stmt_of_sid[sids[-1]] + 1 if sids else 0)
+
+        good_sids = [sid for sid in sids if stmt_of_sid[sid] < failed]
+        if len(good_sids) < len(sids):
+            await self.cancel_completed(sids[len(good_sids):])
+
+        if good_sids:
+            cmd_tag, resp_ind, exec_coqexns = await self.exec_completed(good_sids[-1], timeout)
+            if (exec_coqexns and isinstance(exec_coqexns[0], CoqTimeout) and len(coq_stmts) > 1
+                    and not self._keeps_feedback('Processed')):
+                # the feedback policy dropped the Processed feedback that locates the sentence in process
+                # at the deadline: the chunk is executed again one sentence at a time
+                if not exec_coqexns[0].restarted:
+                    await self.cancel_completed(good_sids)
+                return await self._execute_many(coq_stmts, chunk_size=1, timeout=timeout)
+            if exec_coqexns and isinstance(exec_coqexns[0], CoqTimeout):
+                # the sentence in process at the deadline fails, the ones before it were Processed
+                processed = {feedback.span_id for feedback in self._responses[cmd_tag].feedback('Processed')}
+                failed = stmt_of_sid[next((sid for sid in good_sids if sid not in processed), good_sids[-1])]
+                if exec_coqexns[0].restarted:
+                    # the restarted kernel has lost the sentences of the chunk, execute the processed ones again
+                    _, _, _, executed = await self._execute_many(coq_stmts[:failed], timeout=timeout)
+                    return (cmd_tag, resp_ind, exec_coqexns, executed)
+                coqexns = exec_coqexns
+                bad_sids = [sid for sid in good_sids if stmt_of_sid[sid] >= failed]
+                good_sids = good_sids[:len(good_sids) - len(bad_sids)]
+                (cmd_tag, resp_ind) = await self.cancel_completed(bad_sids)
+            elif exec_coqexns:
+                coqexns = exec_coqexns
+                failed_sid = exec_coqexns[0].sid
+                if failed_sid not in stmt_of_sid:
+                    failed_sid = await self._bisect_failed_sid(good_sids)
+                failed = stmt_of_sid[failed_sid]
+                bad_sids = [sid for sid in good_sids if stmt_of_sid[sid] >= failed]
+                good_sids = good_sids[:len(good_sids) - len(bad_sids)]
+                (cmd_tag, resp_ind) = await self.cancel_completed(bad_sids)
+
+        executed = [[] for _ in range(min(failed, len(coq_stmts)))]
+        for sid in good_sids:
+            executed[stmt_of_sid[sid]].append(sid)
+        self._executed_sids.extend(good_sids)
+        self._executed_stmts.extend((stmt, sids) for stmt, sids in zip(coq_stmts, executed) if sids)
+        return (cmd_tag, resp_ind, coqexns, executed)
+
+    async def _with_restart(self, fn, *args, **kwargs):
+        """ awaits fn(*args, **kwargs); in resilient mode restarts the kernel and retries
+        when the kernel exits, up to max_restarts times
+        """
+        for attempt in range(self._max_restarts + 1):
+            try:
+                return await fn(*args, **kwargs)
+            except KERNEL_EXITED as exc:
+                if not self._resilient or attempt == self._max_restarts:
+                    raise
+                logging.warning(f"CoqSerapi: kernel exited ({exc!r}), restarting and replaying "
+                                f"{len(self._executed_stmts)} statements")
+                await self.restart()
+
+    async def restart(self):
+        """ respawns the kernel and replays the statements executed by execute() and execute_many()
+        in one batch; returns the translation of sids old -> new
+        """
+        try:
+            await self._kernel.terminate(timeout=TIMEOUT_TERMINATE)
+        except Exception as exc:
+            logging.info(f"CoqSerapi.restart: terminate of the exited kernel raised {exc!r}")
+        self._kernel = await self._kernel.respawn()
+        self._restarts += 1
+        if self._dispatcher is not None:
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for fut in self._completed_futures.values():
+            if not fut.done():
+                fut.set_exception(EOFError("coq-serapi kernel restarted"))
+            fut.exception()  # commands awaited by nobody (e.g. timed out) do not log the exception
+        self._completed_futures = {}
+        self._dispatcher_exc = None
+        # the new kernel numbers the commands from 0 again
+        self._responses.restart(tag_offset=len(self._sent_history))
+        self._state_version += 1
+        self._goals_cache.clear()
+        self._message_sids.clear()
+        await self.start()
+
+        replayed, checkpoint = self._executed_stmts, self._checkpoint
+        self._executed_stmts, self._live_sids, self._executed_sids = [], [], []
+        _, _, coqexns, sids = await self._execute_many([stmt for stmt, _ in replayed])
+        if coqexns:
+            raise RuntimeError(f"CoqSerapi.restart: replay of the executed statements failed with {coqexns}")
+        self._sid_map = {old: new for (_, old_sids), new_sids in zip(replayed, sids)
+                         for old, new in zip(old_sids, new_sids)}
+        if len(self._sid_map) != sum(len(old_sids) for _, old_sids in replayed):
+            logging.warning("CoqSerapi.restart: replayed statements were split into different sentences")
+        self._checkpoint = self._sid_map.get(checkpoint)
+        return self._sid_map
+
+    def translate_sid(self, sid: Optional[int]) -> Optional[int]:
+        """ translates a sid obtained before the last restart of the kernel
+        """
+        if sid is None:
+            return None
+        if sid not in self._sid_map:
+            raise ValueError(f"sid {sid} was not replayed by the last restart of the kernel")
+        return self._sid_map[sid]
+
+    async def _bisect_failed_sid(self, sids: List[int]) -> int:
+        """ finds the first sid of sids that fails to execute, given that Exec of sids[-1] failed
+        """
+        good, bad = -1, len(sids) - 1
+        while bad - good > 1:
+            mid = (good + bad) // 2
+            _, _, coqexns = await self.exec_completed(sids[mid])
+            if coqexns and isinstance(coqexns[0], CoqTimeout):
+                raise TimeoutError(f"CoqSerapi: Exec {sids[mid]} exceeded the deadline while locating "
+                                   f"the failed sentence")
+            if coqexns:
+                bad = mid
+            else:
+                good = mid
+        return sids[bad]
+
     async def get_first_n_global_ctx_ids_and_terms(self):
         raise NotImplemented
 
@@ -771,65 +1458,28 @@ Displays all open goals / existential variables in the current proof along with
 
     async def added_sids(self, cmd_tag) -> List[Union[int, str]]:
         """ 
-        returns the list of sid (sentence id) from history of serapi responses
+        returns the list of sid (sentence id) added by serapi command with cmd_tag
 
         """
-        cur = len(self._serapi_response_history) - 1
-        res = []
-        while cur >= 0:
-            line = self._serapi_response_history[cur].strip()
-            line_answer = matches_answer(line, cmd_tag)
-            if line_answer is None or line_answer == 'Completed':
-                cur -= 1
-                continue
-            if line_answer == 'Ack':
-                break
-            sid = parse_added_sid(line_answer)
-            if not sid is None:
-                res.append(sid)
-            cur -= 1
+        return list(self._responses[cmd_tag].sids)
 
-        return list(reversed(res))
+    async def added_locs(self, cmd_tag) -> List[Optional[Tuple[int, int]]]:
+        """
+        returns the (bp, ep) locations of the sids added by serapi command with cmd_tag,
+        byte offsets in the string of the Add command
+        """
+        return list(self._responses[cmd_tag].locs)
 
     async def coqexns(self, cmd_tag):
         '''
         retrieves List of coqexns that serapi transmited on a given serapi command with cmd_tag
         '''
-        cur = len(self._serapi_response_history) - 1
-        res = []
-        while cur >= 0:
-            line = self._serapi_response_history[cur].strip()
-            line_answer = matches_answer(line, cmd_tag)
-            if line_answer is None or line_answer == 'Completed':
-                cur -= 1
-                continue
-            if line_answer == 'Ack':
-                break
-
-            coqexn = parse_coqexn(line_answer)
-            if not coqexn is None:
-                res.append(coqexn)
-            cur -= 1
-
-        return res
+        return list(self._responses[cmd_tag].coqexns)
 
     async def _answer(self, cmd_tag) -> List[str]:
         """ return the list of str matching answer cmd_tag
         """
-        cur = len(self._serapi_response_history) - 1
-        res = []
-        while cur >= 0:
-            line = self._serapi_response_history[cur].strip()
-            line_answer = matches_answer(line, cmd_tag)
-            if line_answer is None or line_answer == 'Completed':
-                cur -= 1
-                continue
-            if line_answer == 'Ack':
-                break
-            res.append(line_answer)
-            cur -= 1
-
-        return res
+        return list(self._responses[cmd_tag].answers)
 
     async def save_serapi_log(self):
         """
@@ -840,7 +1490,10 @@ Displays all open goals / existential variables in the current proof along with
             async for line in self._kernel.readlines_err(quiet=False):
                 stderr.append(line)
 
-            json.dump({'response': self._serapi_response_history,
+            response = (self._serapi_response_history if self._keep_response_history
+                        else list(self._responses.lines()))
+            response = [line if isinstance(line, str) else line.decode() for line in response]
+            json.dump({'response': response,
                        'sent': self._sent_history,
                        'stderr': stderr}, fp=f)
 
@@ -853,7 +1506,7 @@ Displays all open goals / existential variables in the current proof along with
             print(line, end='')
 
     def finished(self):
-        return not self._kernel._proc.returncode is None
+        return not self._kernel.returncode is None
 
     def top_thm_close(self, stmt: Optional[str] = None) -> bool:
         """
@@ -862,6 +1515,7 @@ Displays all open goals / existential variables in the current proof along with
 
         Details: only returns the top thm is closed if the goals & local context transition as follows:
             "" -> []
+        To tag the sentences of a file without kernel round trips see pycoq.classify.classify().
         """
         if self._queried_local_ctx_and_goals == []:
             raise Exception(
@@ -874,26 +1528,29 @@ Displays all open goals / existential variables in the current proof along with
         if len(self._queried_local_ctx_and_goals) <= 2:
             return False
         else:
-            prev_goals: Union[str, list] = self._queried_local_ctx_and_goals[-2]
-            current_goals: Union[str, list] = self._queried_local_ctx_and_goals[-1]
-        return prev_goals == "" and current_goals == []
+            prev_goals: Union[ProofState, list] = self._queried_local_ctx_and_goals[-2]
+            current_goals: Union[ProofState, list] = self._queried_local_ctx_and_goals[-1]
+        return isinstance(prev_goals, ProofState) and prev_goals.text() == "" and current_goals == []
 
 
 async def execute(stmt: str, coq: CoqSerapi) -> Union[str, list]:
     """
     Execute a Coq statement.
     """
-    _, _, coq_exc, _ = await coq.execute(stmt)
-    goals: Union[str, list] = await coq.query_local_ctx_and_goals()
-    # - store the goals (and local context) so that you can later check what your previous coq stmt & do nice things like know if you've proved the top level thm.
-    coq._queried_local_ctx_and_goals.append(goals)
-
+    observation: Observation = await coq.execute_and_observe(stmt, opts=PPSTR)
+    coq_exc = observation.coqexns
     if coq_exc:
         logging.critical('\n-----Error: coq_exc')
         logging.critical(f'Error, tried executing this statement: {stmt=}')
         logging.critical(f'{coq_exc[0]=}')
         raise Exception(coq_exc[0])
         # raise coq_exc[0]
+    if observation.goals is None:
+        goals: Union[str, list] = await coq.query_local_ctx_and_goals()
+    else:
+        goals: Union[str, list] = local_ctx_and_goals_of_answer(observation.goals)
+    # - store the goals (and local context) so that you can later check what your previous coq stmt & do nice things like know if you've proved the top level thm.
+    coq._queried_local_ctx_and_goals.append(coq.goal_store.intern(goals) if isinstance(goals, str) else goals)
     return goals
 
 
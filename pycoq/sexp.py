@@ -1,129 +1,380 @@
-from enum import Enum
-from dataclasses import dataclass 
-import sys
-import numba
-from numba import jit, jitclass
+'''
+reference parser of sexp on token arrays
+
+parses string to sexp defined by grammar:
+sexp := ( term* )
+term := word | sexp
+word := sequence_of_non_special_characters | double_quoted_string_with_special_characters_backslash_escaped
+
+NOTICE: whitespace is necessary only to separate not quoted words from each other
+
+Examples of valid sexp and their python representation
+()            []
+(())          [[]]
+(()  ()  )    [[],[]]
+(abb()bcc)    ['abb',[],'bcc']
+(abb"bcc"())  ['abb','"bcc"',[]]
+
+the input is tokenized in a single numba call (plain python without numba) to the arrays of
+SexpTokens: the kind, start and end offsets (in the utf8 bytes of the input), the index of the
+matching parenthesis and the index of the parent list of every token; the python lists are
+built from the arrays without recursion, and the structural queries (depth, arity, spans and
+children of subtrees) are answered on the arrays without building lists
 
-# reference parser of sexp
+IncrementalSexpParser scans an input fed by chunks (pycoq.stream reads long response lines so)
+and indexes the spans of its nodes up to a given depth without keeping the chunks
 
-# parses string to sexp defined by grammar:
-# sexp := ( term* )
-# term := word | sexp
-# word := sequence_of_non_special_characters | double_quoted_string_with_special_characters_backslash_escaped
+example:
+    tokens = tokenize('(abb(c d)"e")')
+    tokens.arity()[0] == 3
+    tokens.at([1]) == 2 and tokens.text(2) == '(c d)'
+    tokens.to_sexp(2) == ['c', 'd']
+'''
+import sys
+
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple, Union
 
-# NOTICE: whitespace is necessary only to separate not quoted words from each other 
+import numpy as np
 
-# Examples of valid sexp and their python representation
-# ()            []
-# (())          [[]]
-# (()  ()  )    [[],[],[]]
-# (abb()bcc)    ['abb',[],'bcc']
-# (abb"bcc"())  ['abb','"bcc"',[]]
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        ''' without numba the tokenizer runs as a python function '''
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
 
 
 TOKEN_WORD = 0
 TOKEN_OPEN_PAR = 1
 TOKEN_CLOSE_PAR = 2
 
-@numba.experimental.jitclass([('code',numba.types.int8),('value',numba.types.string)])
-class Token():
-    def __init__(self, code, value):
-        self.code = code
-        self.value = value
-        
+OPEN_PAR = ord('(')
+CLOSE_PAR = ord(')')
+QUOTE = ord('"')
+BACKSLASH = ord('\\')
 
-@jit(nopython=True) 
-def skip_whitespace(s, pos):
-    """ eats white space
-    """
-    while s[pos] == " ":
-        pos += 1
-    return pos
-        
-@jit(nopython=True)
-def get_word(s, pos):
-    """ eats next word or quoted string
-    """
-    if s[pos] == '"':
-        pos += 1
-        while pos < len(s) and s[pos] != '"':
-            if s[pos] == '\\':
-                if not (pos < len(s) - 1):
-                    raise ValueError("Unfinished escape sequence")
-                else:
-                    pos += 2
-            else:
-                pos += 1
-        if pos < len(s) and s[pos] == '"':
-            return pos+1
-        else:
-            raise ValueError("Unfinished double quote")
-    else:
-        while pos < len(s) and (not s[pos] in ['"','(',')',' ']):
-            pos += 1
-        return pos
+# error codes of the tokenizer kernel
+UNMATCHED_OPEN = 1
+UNMATCHED_CLOSE = 2
+UNFINISHED_QUOTE = 3
+UNFINISHED_ESCAPE = 4
 
-@jit(nopython=True)
-def token_generator(s):
-    """ generates tokens from string 
-    """
+_ERRORS = {UNMATCHED_OPEN: "Unmatched opening parenthesis",
+           UNMATCHED_CLOSE: "Too many closing parentheses",
+           UNFINISHED_QUOTE: "Unfinished double quote",
+           UNFINISHED_ESCAPE: "Unfinished escape sequence"}
+
+
+@njit(cache=True)
+def _is_whitespace(c):
+    return c == 32 or c == 9 or c == 10 or c == 13
+
+
+@njit(cache=True)
+def _tokenize(buf):
+    ''' returns the arrays kind, start, end, match, parent of the tokens of buf
+    and an error code with its position
+    '''
+    n = buf.shape[0]
+    kind = np.empty(n, dtype=np.int8)
+    start = np.empty(n, dtype=np.intp)
+    end = np.empty(n, dtype=np.intp)
+    match = np.empty(n, dtype=np.intp)
+    parent = np.empty(n, dtype=np.intp)
+    # stack of the indices of the open parentheses not yet closed
+    stack = np.empty(n + 1, dtype=np.intp)
+    top = 0
+    k = 0
+    error = 0
+    error_pos = 0
     pos = 0
-    while pos < len(s):
-        while pos < len(s) and s[pos] == " ":
-            pos += 1
-        if pos == len(s):
-            break
-        if s[pos] == '(':
-            yield Token(TOKEN_OPEN_PAR,'(')
+    while pos < n:
+        c = buf[pos]
+        if _is_whitespace(c):
             pos += 1
             continue
-            
-        elif s[pos] == ')':
-            yield Token(TOKEN_CLOSE_PAR,')')
+        parent[k] = stack[top - 1] if top > 0 else -1
+        start[k] = pos
+        if c == OPEN_PAR:
+            kind[k] = TOKEN_OPEN_PAR
+            stack[top] = k
+            top += 1
+            pos += 1
+        elif c == CLOSE_PAR:
+            if top == 0:
+                error, error_pos = UNMATCHED_CLOSE, pos
+                break
+            top -= 1
+            kind[k] = TOKEN_CLOSE_PAR
+            match[k] = stack[top]
+            match[stack[top]] = k
+            parent[k] = parent[stack[top]]
+            pos += 1
+        elif c == QUOTE:
+            kind[k] = TOKEN_WORD
+            match[k] = -1
+            pos += 1
+            while pos < n and buf[pos] != QUOTE:
+                if buf[pos] == BACKSLASH:
+                    if pos == n - 1:
+                        error, error_pos = UNFINISHED_ESCAPE, pos
+                        break
+                    pos += 2
+                else:
+                    pos += 1
+            if error != 0:
+                break
+            if pos >= n:
+                error, error_pos = UNFINISHED_QUOTE, start[k]
+                break
             pos += 1
-            continue
         else:
-            pos1 = get_word(s, pos)
-            w = s[pos:pos1]
-            if len(w) > 0:
-                yield Token(TOKEN_WORD,w)
-                pos = pos1
-                continue
-            else:
-                raise Exception("Error in the parsing code: parser produced empty word, report bug")
-    
+            kind[k] = TOKEN_WORD
+            match[k] = -1
+            while pos < n and not (_is_whitespace(buf[pos]) or buf[pos] == OPEN_PAR
+                                   or buf[pos] == CLOSE_PAR or buf[pos] == QUOTE):
+                pos += 1
+        end[k] = pos
+        k += 1
+    if error == 0 and top > 0:
+        error, error_pos = UNMATCHED_OPEN, start[stack[top - 1]]
+    return (kind[:k].copy(), start[:k].copy(), end[:k].copy(), match[:k].copy(), parent[:k].copy(),
+            error, error_pos)
 
-        
-def sexp_(t_gen):   
-    """ returns sexpression from generator of tokens 
-    """
-    t = next(t_gen)            # if StopIteration indicates that OPEN_PAR was not closed before string ended 
-    if t.code == TOKEN_WORD:
-        return t.value
-    elif t.code == TOKEN_OPEN_PAR:
+
+@dataclass
+class SexpTokens:
+    ''' tokens of the utf8 bytes data as arrays indexed by token:
+    kind[i] is TOKEN_WORD, TOKEN_OPEN_PAR or TOKEN_CLOSE_PAR, data[start[i]:end[i]] is the token,
+    match[i] the index of the matching parenthesis (-1 for words) and parent[i] the index of the
+    open parenthesis of the enclosing list (-1 at top level)
+
+    a subtree is referred to by the index of its first token (a word or an open parenthesis)
+    '''
+    data: bytes
+    kind: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    match: np.ndarray
+    parent: np.ndarray
+
+    def __len__(self):
+        return self.kind.shape[0]
+
+    def last(self, i: int) -> int:
+        ''' the index of the last token of the subtree i '''
+        return int(self.match[i]) if self.kind[i] == TOKEN_OPEN_PAR else i
+
+    def span(self, i: int) -> Tuple[int, int]:
+        ''' the span (start, end) in data of the subtree i '''
+        return int(self.start[i]), int(self.end[self.last(i)])
+
+    def text(self, i: int) -> str:
+        start, end = self.span(i)
+        return self.data[start:end].decode()
+
+    def roots(self) -> np.ndarray:
+        ''' the indices of the top level subtrees '''
+        return np.flatnonzero((self.parent == -1) & (self.kind != TOKEN_CLOSE_PAR))
+
+    def depth(self) -> np.ndarray:
+        ''' the number of lists enclosing each token (a parenthesis is not enclosed by its own list) '''
+        nesting = np.zeros(len(self) + 1, dtype=np.intp)
+        np.cumsum((self.kind == TOKEN_OPEN_PAR).astype(np.intp) - (self.kind == TOKEN_CLOSE_PAR),
+                  out=nesting[1:])
+        return nesting[:-1] - (self.kind == TOKEN_CLOSE_PAR)
+
+    def arity(self) -> np.ndarray:
+        ''' the number of children of the list opened at each token (0 for the other tokens) '''
+        elements = (self.parent >= 0) & (self.kind != TOKEN_CLOSE_PAR)
+        return np.bincount(self.parent[elements], minlength=len(self))
+
+    def children(self, i: int) -> List[int]:
+        ''' the subtrees of the list i, found by skipping over the subtrees of the children '''
+        if self.kind[i] != TOKEN_OPEN_PAR:
+            raise IndexError(f"token {i} is not a list")
         res = []
-        while True:
-            next_value = sexp_(t_gen)
-            if next_value == None:
-                break
-            res.append(next_value)
+        j = i + 1
+        while j < self.match[i]:
+            res.append(j)
+            j = self.last(j) + 1
         return res
-    elif t.code == TOKEN_CLOSE_PAR:
-        return None
-    else:
-        raise ValueError(f"Unexpected token {t} in sexp__")
-        
-        
-        
-def sexp(s):
-    """ returns sexpression from string
+
+    def at(self, path: Sequence[int], root: int = 0) -> int:
+        ''' the subtree at path (the list of child indices) from the subtree root '''
+        i = root
+        for depth, index in enumerate(path):
+            if self.kind[i] != TOKEN_OPEN_PAR:
+                raise IndexError(f"path {list(path[:depth + 1])} goes below the word {self.text(i)}")
+            children = self.children(i)
+            if not -len(children) <= index < len(children):
+                raise IndexError(f"path {list(path[:depth + 1])}: the list {i} has no child {index}")
+            i = children[index]
+        return i
+
+    def to_sexp(self, i: int = 0) -> Union[str, list]:
+        ''' the python representation of the subtree i '''
+        if len(self) == 0:
+            raise ValueError("Empty input in trying to parse sexp")
+        if self.kind[i] == TOKEN_CLOSE_PAR:
+            raise ValueError(f"token {i} is a closing parenthesis")
+        stack: List[list] = [[]]
+        data = self.data
+        for j, kind in enumerate(self.kind[i:self.last(i) + 1].tolist(), i):
+            if kind == TOKEN_OPEN_PAR:
+                stack.append([])
+            elif kind == TOKEN_CLOSE_PAR:
+                closed = stack.pop()
+                stack[-1].append(closed)
+            else:
+                stack[-1].append(data[self.start[j]:self.end[j]].decode())
+        return stack[0][0]
+
+
+def tokenize(s: Union[str, bytes]) -> SexpTokens:
+    ''' returns the tokens of s, raises ValueError on unbalanced parentheses or unfinished words '''
+    data = s.encode() if isinstance(s, str) else bytes(s)
+    kind, start, end, match, parent, error, error_pos = _tokenize(np.frombuffer(data, dtype=np.uint8))
+    if error:
+        raise ValueError(f"{_ERRORS[error]} at position {error_pos} in trying to parse sexp")
+    return SexpTokens(data, kind, start, end, match, parent)
+
+
+def sexp(s: Union[str, bytes]):
+    """ returns sexpression from string (the first one if there are several)
     """
-    g = token_generator(s)
-    res = sexp_(g)
-    if res == None:
-        raise ValueError(f"Too many closing parentheses in trying to parse sexp")
-    else:
-        return res
+    return tokenize(s).to_sexp(0)
+
+
+# scanner state: depth, in quoted word, after backslash in quoted word, start of the current word or -1
+_DEPTH, _IN_QUOTE, _ESCAPE, _WORD_START = range(4)
+
+
+@njit(cache=True)
+def _scan_chunk(buf, offset, state, stack, index_depth):
+    ''' scans the chunk buf of the input at offset from the state left by the previous chunk;
+    stack[d] is the start of the open list of depth d (up to index_depth);
+    returns the start, end and depth of the nodes of depth <= index_depth completed in buf,
+    and the position of an unmatched ')' (-1 if none)
+    '''
+    n = buf.shape[0]
+    # a node completed in buf ends at a byte of buf, except a word ended by the first byte
+    starts = np.empty(n + 1, dtype=np.int64)
+    ends = np.empty(n + 1, dtype=np.int64)
+    depths = np.empty(n + 1, dtype=np.int32)
+    k = 0
+    depth = state[_DEPTH]
+    in_quote = state[_IN_QUOTE]
+    escape = state[_ESCAPE]
+    word_start = state[_WORD_START]
+    unmatched = -1
+    for i in range(n):
+        c = buf[i]
+        pos = offset + i
+        if in_quote:
+            if escape:
+                escape = 0
+            elif c == BACKSLASH:
+                escape = 1
+            elif c == QUOTE:
+                in_quote = 0
+                if depth <= index_depth:
+                    starts[k], ends[k], depths[k] = word_start, pos + 1, depth
+                    k += 1
+                word_start = -1
+            continue
+        if word_start >= 0:
+            if not (_is_whitespace(c) or c == OPEN_PAR or c == CLOSE_PAR or c == QUOTE):
+                continue
+            if depth <= index_depth:
+                starts[k], ends[k], depths[k] = word_start, pos, depth
+                k += 1
+            word_start = -1
+        if _is_whitespace(c):
+            continue
+        if c == OPEN_PAR:
+            if depth <= index_depth:
+                stack[depth] = pos
+            depth += 1
+        elif c == CLOSE_PAR:
+            if depth == 0:
+                unmatched = pos
+                break
+            depth -= 1
+            if depth <= index_depth:
+                starts[k], ends[k], depths[k] = stack[depth], pos + 1, depth
+                k += 1
+        else:
+            word_start = pos
+            in_quote = 1 if c == QUOTE else 0
+    state[_DEPTH] = depth
+    state[_IN_QUOTE] = in_quote
+    state[_ESCAPE] = escape
+    state[_WORD_START] = word_start
+    return starts[:k].copy(), ends[:k].copy(), depths[:k].copy(), unmatched
+
+
+class SexpIndex():
+    ''' spans of the nodes of an s-expression up to a depth, in the order of their starts:
+    data[start[i]:end[i]] is node i, depth[i] the number of lists enclosing it
+    '''
+
+    def __init__(self, start: np.ndarray, end: np.ndarray, depth: np.ndarray, index_depth: int):
+        order = np.argsort(start, kind='stable')
+        self.start = start[order]
+        self.end = end[order]
+        self.depth = depth[order]
+        self.index_depth = index_depth
+
+    def __len__(self):
+        return self.start.shape[0]
+
+    def children(self, i: int) -> np.ndarray:
+        ''' the indices of the children of node i, which must have depth < index_depth '''
+        upper = np.searchsorted(self.start, self.end[i], side='left')
+        return np.flatnonzero(self.depth[i + 1:upper] == self.depth[i] + 1) + i + 1
+
+
+class IncrementalSexpParser():
+    ''' indexes the nodes of depth <= index_depth of an s-expression fed by chunks
+    raises ValueError on unbalanced parentheses or an unfinished quoted word
+    '''
+
+    def __init__(self, index_depth: int):
+        self.index_depth = index_depth
+        self._state = np.array([0, 0, 0, -1], dtype=np.int64)
+        self._stack = np.zeros(index_depth + 1, dtype=np.int64)
+        self._offset = 0
+        self._nodes: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+
+    def feed(self, chunk: bytes):
+        starts, ends, depths, unmatched = _scan_chunk(np.frombuffer(chunk, dtype=np.uint8), self._offset,
+                                                      self._state, self._stack, self.index_depth)
+        if unmatched >= 0:
+            raise ValueError(f"unbalanced ) at position {unmatched}")
+        if starts.shape[0]:
+            self._nodes.append((starts, ends, depths))
+        self._offset += len(chunk)
+
+    def close(self) -> SexpIndex:
+        ''' completes the input and returns the index of its nodes '''
+        state = self._state
+        if state[_IN_QUOTE]:
+            raise ValueError(f"unclosed quoted word at position {state[_WORD_START]}")
+        if state[_WORD_START] >= 0:
+            if state[_DEPTH] <= self.index_depth:
+                self._nodes.append((np.array([state[_WORD_START]]), np.array([self._offset]),
+                                    np.array([state[_DEPTH]], dtype=np.int32)))
+            state[_WORD_START] = -1
+        if state[_DEPTH] > 0:
+            raise ValueError(f"{state[_DEPTH]} unclosed ( in s-expression")
+        if not self._nodes:
+            return SexpIndex(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                             np.empty(0, dtype=np.int32), self.index_depth)
+        return SexpIndex(*(np.concatenate(arrays) for arrays in zip(*self._nodes)), self.index_depth)
 
 
 if __name__ == '__main__':
@@ -133,5 +384,3 @@ if __name__ == '__main__':
             break
         else:
             print(sexp(s))
- 
-
@@ -0,0 +1,173 @@
+'''
+iterative parser of coq-serapi s-expressions on bytes
+
+the grammar is the one of sexplib as printed by coq-serapi:
+sexp := ( sexp* ) | atom
+atom := sequence_of_non_special_characters | double_quoted_string_with_ocaml_escapes
+
+lists are parsed to python lists and atoms to str (quoted atoms are unquoted and unescaped);
+there is no recursion so the depth of terms is not limited by the python stack
+
+subtrees are addressed by path, the list of child indices from the root (negative indices count
+from the end); span() and loads_at() find the subtree at path by skipping the siblings on the way
+without parsing them
+
+examples:
+    loads(b'(ObjList((CoqString"a b")))')            == ['ObjList', [['CoqString', 'a b']]]
+    loads_at(b'(ObjList((CoqString"a b")))', [1, 0, 1]) == 'a b'
+'''
+import codecs
+import re
+
+from typing import List, Tuple, Union, Sequence, Optional
+
+
+Sexp = Union[str, list]
+
+_QUOTED = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+TOKEN_PATTERN = re.compile(rb'\s*(?:(\()|(\))|"([^"\\]*(?:\\.[^"\\]*)*)"|([^\s()"]+))', re.S)
+PAREN_OR_QUOTED_PATTERN = re.compile(_QUOTED + rb'|[()]', re.S)
+ATOM_PATTERN = re.compile(_QUOTED + rb'|[^\s()"]+', re.S)
+BLANK_PATTERN = re.compile(rb'\s*')
+ESCAPE_PATTERN = re.compile(rb'\\(?:([\\"\'ntbr ])|(\d{3})|x([0-9a-fA-F]{2})|\r?\n[ \t]*)')
+# escapes other than \\ \" \n \t, which codecs.escape_decode decodes as OCaml does
+OTHER_ESCAPE_PATTERN = re.compile(rb'\\[^\\"nt]')
+
+_ESCAPES = {b'\\': b'\\', b'"': b'"', b"'": b"'", b'n': b'\n', b't': b'\t', b'b': b'\b', b'r': b'\r', b' ': b' '}
+
+OPEN_PAR = ord('(')
+CLOSE_PAR = ord(')')
+
+
+def _unescape_match(match) -> bytes:
+    char, dec, hexa = match.groups()
+    if char is not None:
+        return _ESCAPES[char]
+    if dec is not None:
+        return bytes([int(dec)])
+    if hexa is not None:
+        return bytes([int(hexa, 16)])
+    return b''  # backslash newline blanks: line continuation
+
+
+def unescape(quoted: bytes) -> str:
+    """ decodes the content of an OCaml quoted string """
+    if b'\\' not in quoted:
+        return quoted.decode()
+    if OTHER_ESCAPE_PATTERN.search(quoted) is None:
+        return codecs.escape_decode(quoted)[0].decode()
+    return ESCAPE_PATTERN.sub(_unescape_match, quoted).decode()
+
+
+def _as_bytes(data: Union[bytes, str]) -> bytes:
+    return data.encode() if isinstance(data, str) else data
+
+
+def loads(data: Union[bytes, str], start: int = 0, end: Optional[int] = None) -> Sexp:
+    """ parses the s-expression in data[start:end] """
+    data = _as_bytes(data)
+    end = len(data) if end is None else end
+    stack: List[list] = [[]]
+    pos = start
+    for match in TOKEN_PATTERN.finditer(data, start, end):
+        if match.start() != pos:
+            raise ValueError(f"unexpected {data[pos:pos + 1]} at position {pos}")
+        pos = match.end()
+        kind = match.lastindex
+        if kind == 1:
+            stack.append([])
+        elif kind == 2:
+            if len(stack) == 1:
+                raise ValueError(f"unbalanced ) at position {match.start(2)}")
+            closed = stack.pop()
+            stack[-1].append(closed)
+        elif kind == 3:
+            stack[-1].append(unescape(match.group(3)))
+        else:
+            stack[-1].append(match.group(4).decode())
+    if BLANK_PATTERN.match(data, pos, end).end() != end:
+        raise ValueError(f"unexpected {data[pos:pos + 1]} at position {pos}")
+    if len(stack) != 1:
+        raise ValueError(f"{len(stack) - 1} unclosed ( in s-expression")
+    if len(stack[0]) != 1:
+        raise ValueError(f"expected one s-expression, found {len(stack[0])}")
+    return stack[0][0]
+
+
+def end_of(data: bytes, pos: int) -> int:
+    """ returns the end of the s-expression that starts at data[pos] """
+    if data[pos] == OPEN_PAR:
+        depth = 0
+        for match in PAREN_OR_QUOTED_PATTERN.finditer(data, pos):
+            char = data[match.start()]
+            if char == OPEN_PAR:
+                depth += 1
+            elif char == CLOSE_PAR:
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+        raise ValueError(f"unclosed ( at position {pos}")
+    match = ATOM_PATTERN.match(data, pos)
+    if match is None:
+        raise ValueError(f"unexpected {data[pos:pos + 1]} at position {pos}")
+    return match.end()
+
+
+def children(data: Union[bytes, str], start: int = 0, count: Optional[int] = None) -> List[Tuple[int, int]]:
+    """ returns the spans (start, end) of the first count (default all) children of the list
+    that starts at data[start] (after blanks)
+    """
+    data = _as_bytes(data)
+    pos = BLANK_PATTERN.match(data, start).end()
+    if pos == len(data) or data[pos] != OPEN_PAR:
+        raise ValueError(f"no list at position {pos}")
+    pos += 1
+    spans = []
+    while count is None or len(spans) < count:
+        pos = BLANK_PATTERN.match(data, pos).end()
+        if pos == len(data):
+            raise ValueError(f"unclosed ( at position {start}")
+        if data[pos] == CLOSE_PAR:
+            break
+        child_end = end_of(data, pos)
+        spans.append((pos, child_end))
+        pos = child_end
+    return spans
+
+
+def _child_start(data: bytes, start: int, index: int) -> int:
+    """ returns the start of child index >= 0 of the list at data[start], skipping the children before it """
+    pos = start + 1
+    for i in range(index + 1):
+        pos = BLANK_PATTERN.match(data, pos).end()
+        if pos == len(data):
+            raise ValueError(f"unclosed ( at position {start}")
+        if data[pos] == CLOSE_PAR:
+            raise IndexError(index)
+        if i < index:
+            pos = end_of(data, pos)
+    return pos
+
+
+def span(data: Union[bytes, str], path: Sequence[int] = ()) -> Tuple[int, int]:
+    """ returns the span (start, end) in data of the subtree at path
+    raises IndexError if path does not address a subtree
+    """
+    data = _as_bytes(data)
+    start = BLANK_PATTERN.match(data).end()
+    for depth, index in enumerate(path):
+        if start == len(data) or data[start] != OPEN_PAR:
+            raise IndexError(f"path {list(path[:depth + 1])} goes below the atom at position {start}")
+        try:
+            start = _child_start(data, start, index) if index >= 0 else children(data, start)[index][0]
+        except IndexError:
+            raise IndexError(f"path {list(path[:depth + 1])}: the list at position {start} "
+                             f"has no child {index}") from None
+    return start, end_of(data, start)
+
+
+def loads_at(data: Union[bytes, str], path: Sequence[int] = ()) -> Sexp:
+    """ parses only the subtree of data at path """
+    data = _as_bytes(data)
+    start, end = span(data, path)
+    return loads(data, start, end)
@@ -1,5 +1,12 @@
 ''' splits input binary stream in utf8 encoding to coq statements 
     async readline from input binary stream 
+
+coq_stmts_of_lines() splits by a regex heuristic; coq_stmts_of_file() splits as coq does: the whole
+file is sent to coq-serapi in a single Add and the sentences are located by the (bp, ep) byte offsets
+of the Added answers; the offsets are cached on disk (config key split_cachedir) keyed by the content
+of the file, the opam switch and the kernel command (its -I/-Q/-R load path and topfile: the notations
+of the imported libraries decide the sentence boundaries), so that later splits slice the sentences out of the file without
+parsing or a kernel round trip
 '''
 
  
@@ -8,13 +15,21 @@ import re
 import os
 import asyncio
 import argparse
+import hashlib
+import json
+import logging
+import mmap
 
-from typing import Iterable
+from collections.abc import Sequence
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
 
 import aiofile 
 
 
+import numpy as np
+
 import pycoq.common
+import pycoq.config
 import pycoq.kernel
 
 
@@ -105,6 +120,194 @@ def coq_stmts_of_context(coq_ctxt: pycoq.common.CoqContext) -> Iterable[str]:
             yield stmt
 
 
+def _scan_stmt_ends(buf: np.ndarray) -> np.ndarray:
+    '''
+    the ends of the statements of buf: the state machine of string_coq_stmts_pos() over the matches
+    of SEPARATORS, found as separators.finditer() finds them line by line (the first alternative
+    that matches at a position, the scan resumes at the end of the match, the blanks after a dot
+    do not extend beyond the end of its line)
+    '''
+    n = buf.shape[0]
+    ends = np.empty(n // 2 + 1, dtype=np.int64)
+    k = 0
+    comment_level = 0
+    in_string = False
+    i = 0
+    while i < n:
+        c = buf[i]
+        if c == 34:  # "
+            in_string = not in_string
+            i += 1
+        elif c == 46 and i + 1 < n and (buf[i + 1] == 32 or 9 <= buf[i + 1] <= 13):  # dot and blank
+            dot = i
+            i += 1
+            while i < n and buf[i] != 10 and (buf[i] == 32 or 9 <= buf[i] <= 13):
+                i += 1
+            if i < n and buf[i] == 10:
+                i += 1
+            if not in_string and comment_level == 0 and not (dot > 0 and buf[dot - 1] == 46):
+                ends[k] = i
+                k += 1
+        elif c == 40 and i + 1 < n and buf[i + 1] == 42:  # (*
+            if not in_string:
+                comment_level += 1
+            i += 2
+        elif c == 42 and i + 1 < n and buf[i + 1] == 41:  # *)
+            if not in_string and comment_level > 0:
+                comment_level -= 1
+            i += 2
+        else:
+            i += 1
+    return ends[:k].copy()
+
+
+_stmt_ends_kernel = None
+
+
+def _stmt_ends(buf: np.ndarray) -> np.ndarray:
+    ''' _scan_stmt_ends compiled by numba on first use if numba is installed '''
+    global _stmt_ends_kernel
+    if _stmt_ends_kernel is None:
+        try:
+            from numba import njit
+            _stmt_ends_kernel = njit(cache=True)(_scan_stmt_ends)
+        except ImportError:
+            _stmt_ends_kernel = _scan_stmt_ends
+    return _stmt_ends_kernel(buf)
+
+
+def coq_stmt_offsets(source: Union[bytes, mmap.mmap]) -> np.ndarray:
+    '''
+    returns the (n, 2) array of the (start, end) byte offsets of the statements of source
+    split as by coq_stmts_of_lines() (a statement starts at the end of the previous one,
+    the text after the last statement is not a statement), in one pass over the whole buffer;
+    unlike the str regex of coq_stmts_of_lines() only ascii blanks end a statement
+    '''
+    ends = _stmt_ends(np.frombuffer(source, dtype=np.uint8))
+    offsets = np.zeros((ends.shape[0], 2), dtype=np.int64)
+    offsets[:, 1] = ends
+    offsets[1:, 0] = ends[:-1]
+    return offsets
+
+
+class CoqStmts(Sequence):
+    '''
+    statements of source (bytes or mmap) at offsets, decoded from utf8 on access
+    '''
+
+    def __init__(self, source: Union[bytes, mmap.mmap], offsets: np.ndarray):
+        self.source = source
+        self.offsets = offsets
+
+    def __len__(self):
+        return self.offsets.shape[0]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return CoqStmts(self.source, self.offsets[i])
+        start, end = self.offsets[i]
+        return self.source[start:end].decode('utf8')
+
+    def close(self):
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+
+
+def coq_stmts_of_source(fname: str) -> CoqStmts:
+    '''
+    returns the statements of the file fname mapped in memory (see coq_stmt_offsets())
+    '''
+    with open(fname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return CoqStmts(b'', coq_stmt_offsets(b''))
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return CoqStmts(source, coq_stmt_offsets(source))
+
+
+def split_cache_key(source: bytes, switch: str, kernel_command: Sequence[str] = ()) -> str:
+    '''
+    key of the sentence offsets of source split by the coq-serapi of the opam switch
+    started with kernel_command (which carries the load path arguments and the topfile)
+    '''
+    prefix = b'\0'.join(arg.encode() for arg in [switch, *kernel_command])
+    return hashlib.sha256(prefix + b'\0\0' + source).hexdigest()
+
+
+def split_cache_fname(key: str, cachedir: Optional[str] = None) -> str:
+    cachedir = pycoq.config.get_split_cachedir() if cachedir is None else cachedir
+    return os.path.join(cachedir, key[:2], key + '.json')
+
+
+def load_stmt_offsets(key: str, cachedir: Optional[str] = None) -> Optional[List[Tuple[int, int]]]:
+    '''
+    returns the cached sentence offsets of key, None if they are not cached
+    '''
+    fname = split_cache_fname(key, cachedir)
+    try:
+        with open(fname) as f:
+            return [(bp, ep) for bp, ep in json.load(f)]
+    except FileNotFoundError:
+        return None
+    except (json.JSONDecodeError, ValueError, TypeError):
+        logging.warning(f"pycoq.split: ignoring corrupted cache file {fname}")
+        return None
+
+
+def save_stmt_offsets(key: str, offsets: List[Tuple[int, int]], cachedir: Optional[str] = None):
+    '''
+    caches the sentence offsets of key, the file is replaced atomically
+    '''
+    fname = split_cache_fname(key, cachedir)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    tmp_fname = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp_fname, 'w') as f:
+        json.dump(offsets, f)
+    os.replace(tmp_fname, fname)
+
+
+def coq_stmts_of_offsets(source: bytes, offsets: List[Tuple[int, int]]) -> List[str]:
+    '''
+    slices the sentences source[bp:ep] out of source
+    '''
+    return [source[bp:ep].decode('utf8') for bp, ep in offsets]
+
+
+async def serapi_stmt_offsets(coq: 'pycoq.serapi.CoqSerapi', source: bytes,
+                              timeout: Optional[float] = None) -> Tuple[List[Tuple[int, int]], list]:
+    '''
+    sends source to coq in a single Add, returns the (bp, ep) byte offsets in source of the sentences
+    located by the Added answers and the CoqExns of the Add (a parsing error stops the Add);
+    the added sentences are canceled, the document of coq is left as it was
+    '''
+    cmd_tag, _, sids, coqexns = await coq.add_completed(source.decode('utf8'), timeout)
+    offsets = [loc for loc in await coq.added_locs(cmd_tag) if loc is not None]
+    assert len(offsets) == len(sids), "coq-serapi Added response without location"
+    await coq.cancel_completed(sids)
+    return offsets, coqexns
+
+
+async def coq_stmts_of_file(coq: 'pycoq.serapi.CoqSerapi', fname: str, switch: str,
+                            cachedir: Optional[str] = None, timeout: Optional[float] = None) -> List[str]:
+    '''
+    returns the sentences of the file fname as split by coq-serapi (see serapi_stmt_offsets()),
+    the sentences are sliced from the file with the offsets cached for its content, the switch
+    and the kernel command of coq if there are any; on a parsing error the sentences before it
+    are returned and nothing is cached
+    '''
+    with open(fname, 'rb') as f:
+        source = f.read()
+    kernel_cfg = coq.kernel_cfg
+    key = split_cache_key(source, switch, kernel_cfg.command if kernel_cfg is not None else ())
+    offsets = load_stmt_offsets(key, cachedir)
+    if offsets is None:
+        offsets, coqexns = await serapi_stmt_offsets(coq, source, timeout)
+        if coqexns:
+            logging.warning(f"pycoq.split: coq-serapi failed to split {fname}: {coqexns}")
+        else:
+            save_stmt_offsets(key, offsets, cachedir)
+    return coq_stmts_of_offsets(source, offsets)
+
+
 async def coq_stmts(inp: io.BufferedReader, sep='\n'):
     prefix = ""
     while True:
@@ -0,0 +1,277 @@
+'''
+streaming read of oversized coq-serapi response lines
+
+a response of coq-serapi is one line, for a large proof term (Show Proof) or goal it can be
+gigabytes long; reading it with StreamReader.readline() buffers it whole in the stream, then in
+the line, then in its decoding. Here the lines are read in chunks of at most chunk_size bytes:
+
+ChunkedLineReader wraps the stdout StreamReader of a kernel (or the socket of a
+pycoq.remote.RemoteConnection) with the readline() interface,
+without a spill threshold it reads the lines whole with StreamReader.readline(),
+readline_sexp(spill_threshold) collects the chunks of a line in a SpillBuffer that moves them to an unlinked
+temporary file once they exceed spill_threshold bytes and maps the file (mmap) when the line is
+complete; from the moment a line spills the chunks are also fed as they arrive to a
+pycoq.sexp.IncrementalSexpParser that indexes the spans of the nodes up to index_depth
+
+the line is handed to the caller as a LazySexp: a view on the bytes or the mmap of the line that
+decodes only the subtrees it is asked for (pycoq.sexp_parser on the spans of the index)
+
+example:
+    reader = ChunkedLineReader(proc.stdout)
+    line = await reader.readline_sexp(spill_threshold=64 * 1024 * 1024)
+    line.spilled                  # True if the line is mapped from a temporary file
+    line.loads([1, 3, 1, -1])     # the (str "...") text of a Message feedback, decoded alone
+'''
+import mmap
+import tempfile
+
+from typing import List, Optional, Sequence, Tuple, Union
+
+import pycoq.sexp_parser
+
+
+# bytes read from the stream at once
+CHUNK_SIZE = 1024 * 1024
+
+# lines longer than this are spilled to a temporary file by default
+SPILL_THRESHOLD = 64 * 1024 * 1024
+
+# depth of the nodes indexed by pycoq.sexp.IncrementalSexpParser, enough to reach the text
+# (str "...") of (Feedback (.. (contents (Message .. (str "...")))))
+INDEX_DEPTH = 5
+
+# bytes of the head of a line returned by LazySexp.head()
+HEAD_SIZE = 256
+
+OPEN_PAR = ord('(')
+QUOTE = ord('"')
+
+class SpillBuffer():
+    ''' collects the chunks of a line in memory up to spill_threshold bytes (None: no bound),
+    beyond it in an unlinked temporary file in directory dir; once spilled the chunks are
+    also fed to a pycoq.sexp.IncrementalSexpParser
+    '''
+
+    def __init__(self, spill_threshold: Optional[int] = None, index_depth: int = INDEX_DEPTH, dir=None):
+        self.spill_threshold = spill_threshold
+        self.index_depth = index_depth
+        self.dir = dir
+        self.size = 0
+        self.complete = False
+        self._chunks: List[bytes] = []
+        self._file = None
+        self._parser: Optional['pycoq.sexp.IncrementalSexpParser'] = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def write(self, chunk: bytes):
+        if (self._file is None and self.spill_threshold is not None
+                and self.size + len(chunk) > self.spill_threshold):
+            self._file = tempfile.TemporaryFile(dir=self.dir)
+            import pycoq.sexp
+            self._parser = pycoq.sexp.IncrementalSexpParser(self.index_depth)
+            for previous in self._chunks:
+                self._file.write(previous)
+                self._parser.feed(previous)
+            self._chunks = []
+        if self._file is not None:
+            self._file.write(chunk)
+            self._parser.feed(chunk)
+        else:
+            self._chunks.append(chunk)
+        self.size += len(chunk)
+
+    def getvalue(self) -> bytes:
+        ''' the collected bytes (read back from the file if spilled) '''
+        if self._file is None:
+            return b''.join(self._chunks)
+        self._file.flush()
+        self._file.seek(0)
+        return self._file.read()
+
+    def to_sexp(self) -> 'LazySexp':
+        ''' the collected bytes as a LazySexp, on the mmap of the file if spilled (the file is closed) '''
+        if self._file is None:
+            return LazySexp(self.getvalue())
+        index = self._parser.close()
+        self._file.flush()
+        data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._file.close()
+        self._file = None
+        return LazySexp(data, index)
+
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+class LazySexp():
+    ''' view on an s-expression in data (bytes or mmap) that decodes only the subtrees asked for;
+    subtrees are addressed by path, the list of child indices from the root (negative from the end);
+    the spans of the subtrees up to the depth of the index are looked up in the index, computed
+    on first use if not given, deeper ones are found by pycoq.sexp_parser
+
+    has the decode() and len() of bytes so that it can stand for a response line
+    '''
+
+    def __init__(self, data: Buffer, index: Optional['pycoq.sexp.SexpIndex'] = None):
+        self.data = data
+        self._index = index
+
+    @classmethod
+    def of_bytes(cls, data: bytes, spill_threshold: Optional[int] = None, dir=None) -> 'LazySexp':
+        ''' the view on data, spilled to a mapped temporary file if longer than spill_threshold '''
+        buffer = SpillBuffer(spill_threshold, dir=dir)
+        for offset in range(0, len(data), CHUNK_SIZE):
+            buffer.write(data[offset:offset + CHUNK_SIZE])
+        return buffer.to_sexp()
+
+    @property
+    def spilled(self) -> bool:
+        return isinstance(self.data, mmap.mmap)
+
+    @property
+    def index(self) -> 'pycoq.sexp.SexpIndex':
+        if self._index is None:
+            import pycoq.sexp
+            parser = pycoq.sexp.IncrementalSexpParser(INDEX_DEPTH)
+            view = memoryview(self.data)
+            for offset in range(0, len(view), CHUNK_SIZE):
+                parser.feed(view[offset:offset + CHUNK_SIZE])
+            del view
+            self._index = parser.close()
+        return self._index
+
+    def __len__(self):
+        return len(self.data)
+
+    def head(self, size: int = HEAD_SIZE) -> bytes:
+        return self.data[:size]
+
+    def span(self, path: Sequence[int] = ()) -> Tuple[int, int]:
+        ''' the span (start, end) in data of the subtree at path, raises IndexError if there is none '''
+        index = self.index
+        if len(index) == 0:
+            raise IndexError("empty s-expression")
+        node = 0
+        for depth, child in enumerate(path):
+            if index.depth[node] == index.index_depth:
+                start, end = int(index.start[node]), int(index.end[node])
+                inner_start, inner_end = pycoq.sexp_parser.span(memoryview(self.data)[start:end], path[depth:])
+                return start + inner_start, start + inner_end
+            if self.data[index.start[node]] != OPEN_PAR:
+                raise IndexError(f"path {list(path[:depth + 1])} goes below an atom")
+            children = index.children(node)
+            if not -len(children) <= child < len(children):
+                raise IndexError(f"path {list(path[:depth + 1])}: the list at position "
+                                 f"{index.start[node]} has no child {child}")
+            node = children[child]
+        return int(index.start[node]), int(index.end[node])
+
+    def children(self, path: Sequence[int] = ()) -> List[Tuple[int, int]]:
+        ''' the spans of the children of the list at path '''
+        start, end = self.span(path)
+        return [(start + child_start, start + child_end) for child_start, child_end
+                in pycoq.sexp_parser.children(memoryview(self.data)[start:end])]
+
+    def loads(self, path: Sequence[int] = ()) -> pycoq.sexp_parser.Sexp:
+        ''' parses the subtree at path as pycoq.sexp_parser.loads '''
+        start, end = self.span(path)
+        if self.data[start] == QUOTE:
+            return pycoq.sexp_parser.unescape(self.data[start + 1:end - 1])
+        return pycoq.sexp_parser.loads(self.data, start, end)
+
+    def raw(self, path: Sequence[int] = ()) -> bytes:
+        ''' the bytes of the subtree at path '''
+        start, end = self.span(path)
+        return self.data[start:end]
+
+    def decode(self) -> str:
+        ''' the whole text, materialized '''
+        return (self.data[:] if self.spilled else self.data).decode()
+
+    def close(self):
+        if self.spilled:
+            self.data.close()
+
+
+class ChunkedLineReader():
+    ''' reads the lines of an asyncio.StreamReader by chunks of at most chunk_size bytes, so the
+    length of a line is not bounded by the limit of the stream; readline() and readline_sexp()
+    without spill_threshold read whole lines with StreamReader.readline() (bounded by the limit
+    of the stream) unless a line is partly read by chunks;
+    readline() and readline_sexp() can be cancelled (e.g. by a timeout) and called again,
+    the part of the line already read is kept
+    '''
+
+    def __init__(self, stream, chunk_size: int = CHUNK_SIZE, dir=None):
+        self._stream = stream
+        self.chunk_size = chunk_size
+        self.dir = dir
+        self._pending = b''
+        self._pos = 0
+        self._line: Optional[SpillBuffer] = None
+
+    async def _read_line(self, spill_threshold: Optional[int]) -> SpillBuffer:
+        ''' reads the rest of the current line, returns its buffer (empty at EOF) '''
+        if self._line is None:
+            self._line = SpillBuffer(spill_threshold, dir=self.dir)
+        line = self._line
+        if not line.spilled:
+            line.spill_threshold = spill_threshold
+        while not line.complete:
+            if self._pos == len(self._pending):
+                self._pending, self._pos = b'', 0
+                data = await self._stream.read(self.chunk_size)
+                if not data:
+                    break
+                self._pending = data
+            newline = self._pending.find(b'\n', self._pos)
+            end = len(self._pending) if newline == -1 else newline + 1
+            line.write(self._pending[self._pos:end] if self._pos or end < len(self._pending) else self._pending)
+            self._pos = end
+            line.complete = newline != -1
+        self._line = None
+        return line
+
+    async def readword(self) -> bytes:
+        ''' the bytes of the current line up to the next space or newline (included), b'' at EOF;
+        reads the header of a line whose rest is read by readline() or readline_sexp()
+        '''
+        word = b''
+        while True:
+            if self._pos == len(self._pending):
+                self._pending, self._pos = b'', 0
+                data = await self._stream.read(self.chunk_size)
+                if not data:
+                    return word
+                self._pending = data
+            ends = [end for end in (self._pending.find(b' ', self._pos), self._pending.find(b'\n', self._pos))
+                    if end != -1]
+            end = min(ends) + 1 if ends else len(self._pending)
+            word += self._pending[self._pos:end]
+            self._pos = end
+            if ends:
+                return word
+
+    @property
+    def _chunked(self) -> bool:
+        ''' True if a line is partly read by chunks or read chunks are pending '''
+        return self._line is not None or self._pos < len(self._pending)
+
+    async def readline(self) -> bytes:
+        ''' the next line as bytes, b'' at EOF '''
+        if not self._chunked:
+            return await self._stream.readline()
+        return (await self._read_line(None)).getvalue()
+
+    async def readline_sexp(self, spill_threshold: Optional[int] = SPILL_THRESHOLD) -> Optional[LazySexp]:
+        ''' the next line as a LazySexp, spilled if longer than spill_threshold; None at EOF '''
+        if spill_threshold is None and not self._chunked:
+            data = await self._stream.readline()
+            return LazySexp(data) if data else None
+        line = await self._read_line(spill_threshold)
+        if line.size == 0:
+            return None
+        return line.to_sexp()
@@ -0,0 +1,94 @@
+'''
+tests of the lexical sentence classifier
+'''
+import asyncio
+import glob
+import os
+
+import pycoq.classify
+import pycoq.split
+
+
+def with_prefix(fname):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), fname)
+
+
+def test_classify_kinds():
+    stmts = ['Require Import Arith.', '\n(* a. *) Theorem t : True.', '\nProof.', ' - auto.', '\n  } Qed.',
+             '\nDefinition d := 0.', '\nDefinition e : nat.', ' exact 0.', ' Defined.',
+             '\nLemma l : False.', ' Proof using.', ' Abort.', '\nGoal True.', ' Proof I.',
+             '\nNext Obligation.', ' +', ' trivial.', ' Admitted.']
+    tags = pycoq.classify.classify(stmts)
+    assert [tag.kind for tag in tags] == [
+        'vernac', 'statement', 'proof', 'tactic', 'proof_end',
+        'definition', 'statement', 'tactic', 'proof_end',
+        'statement', 'proof', 'proof_end', 'statement', 'proof_end',
+        'statement', 'bullet', 'tactic', 'proof_end']
+    assert [tag.depth for tag in tags[:5]] == [0, 0, 1, 1, 1]
+    assert tags[3].bullets == '-' and tags[4].bullets == '}' and tags[4].keyword == 'Qed'
+    assert not any(tag.ambiguous for tag in tags)
+    assert [tag.coarse for tag in tags[:6]] == ['vernac', 'proof_start', 'tactic', 'tactic', 'proof_end', 'vernac']
+
+
+def test_classify_ambiguous():
+    stmts = ['Instance i : C.', ' constructor.', ' Qed.', '\nEquations f (n : nat) : nat := f n := n.']
+    tags = pycoq.classify.classify(stmts)
+    assert [tag.ambiguous for tag in tags] == [True, False, False, True]
+    # a class without fields: the Instance does not open a proof
+    tags = pycoq.classify.classify(stmts, kinds={0: 'vernac'})
+    assert [(tag.kind, tag.ambiguous) for tag in tags[:3]] == [('vernac', False), ('vernac', True), ('proof_end', True)]
+    # verify_tags decides the tags made ambiguous by the decision on the Instance
+    coq = ProofModeCoq(openers=set())
+    tags = asyncio.run(pycoq.classify.verify_tags(coq, stmts))
+    assert [(tag.kind, tag.ambiguous) for tag in tags] == [('vernac', False)] * 4
+    assert coq.executed == stmts and coq.live == []
+
+
+def test_classify_balanced_lf():
+    for fname in glob.glob(with_prefix('lf/*.v')):
+        tags = pycoq.classify.classify(pycoq.split.coq_stmts_of_source(fname))
+        assert not any(tag.ambiguous for tag in tags)
+        assert sum(tag.opens_proof for tag in tags) == sum(tag.closes_proof for tag in tags) > 0
+
+
+class ProofModeCoq():
+    ''' executes sentences by proof mode only: the sentences in openers open a proof, Qed closes it '''
+
+    def __init__(self, openers):
+        self.openers = openers
+        self.executed = []
+        self.live = []
+        self.in_proof = False
+
+    def tip(self):
+        return len(self.live) or None
+
+    async def reset_to(self, sid):
+        del self.live[sid or 0:]
+
+    async def execute(self, stmt, timeout=None):
+        self.executed.append(stmt)
+        self.live.append(stmt)
+        if stmt.strip() in self.openers:
+            self.in_proof = True
+        elif stmt.strip() == 'Qed.':
+            self.in_proof = False
+        return None, None, [], [len(self.executed)]
+
+    async def execute_many(self, stmts, chunk_size=None, timeout=None):
+        for stmt in stmts:
+            await self.execute(stmt)
+        return None, None, [], [[i] for i in range(len(stmts))]
+
+    async def query_local_ctx_and_goals(self):
+        return '' if self.in_proof else []
+
+
+def test_verify_tags():
+    stmts = ['Instance i : C.', ' constructor.', ' Qed.', '\nInstance j : D.', '\nLemma l : True.', ' auto.', ' Qed.']
+    coq = ProofModeCoq(openers={'Instance i : C.', 'Lemma l : True.'})
+    tags = asyncio.run(pycoq.classify.verify_tags(coq, stmts))
+    assert [tag.kind for tag in tags] == ['statement', 'tactic', 'proof_end', 'vernac',
+                                          'statement', 'tactic', 'proof_end']
+    assert not any(tag.ambiguous for tag in tags)
+    assert coq.executed == stmts[:4] and coq.live == []
@@ -0,0 +1,31 @@
+'''
+tests of the hash consed store of proof states pycoq.goal_store
+'''
+from pycoq.goal_store import GoalStore, Goal
+
+
+STATE = ('\n  n : nat\n  H : forall m : nat,\n      m + 0 = m\n============================\nn + 0 = n\n\n'
+         '  n : nat\n============================\n0 + n = n')
+
+
+def test_intern_round_trip_and_goals():
+    store = GoalStore()
+    state = store.intern(STATE)
+    assert state.text() == STATE
+    assert state.goals() == [Goal(('  n : nat', '  H : forall m : nat,\n      m + 0 = m'), 'n + 0 = n'),
+                             Goal(('  n : nat',), '0 + n = n')]
+    assert store.intern('').text() == '' and store.intern('').goals() == []
+
+
+def test_sharing_and_memory():
+    store = GoalStore()
+    context = ''.join(f'\n  H{j} : {"P " * 100}' for j in range(20))
+    states = [store.intern(context + STATE.replace('n + 0 = n', f'n + {i} = n')) for i in range(100)]
+    assert store.intern(context + STATE.replace('n + 0 = n', 'n + 1 = n')) is states[1]
+    assert states[0].goals()[0].hyps[20] is states[99].goals()[1].hyps[0]
+    stats = store.memory()
+    assert (stats.n_interned, stats.n_states) == (101, 100) and stats.ratio > 5
+    store.clear()
+    store.intern(STATE)
+    stats = store.memory()
+    assert (stats.n_interned, stats.n_states) == (1, 1) and stats.ratio < 5
@@ -0,0 +1,34 @@
+'''
+tests of pycoq.kernel.LocalKernel with python processes as the kernel
+'''
+import asyncio
+import sys
+
+import pycoq.common
+import pycoq.kernel
+
+
+CHILD = '''
+import signal, sys, time
+signal.signal(signal.SIGINT, lambda *args: (print("interrupted", flush=True), sys.exit(0)))
+print("ready", flush=True)
+time.sleep(30)
+'''
+
+# a wrapper (like opam exec) that does not forward SIGINT to its child
+WRAPPER = f'''
+import signal, subprocess, sys
+signal.signal(signal.SIGINT, signal.SIG_IGN)
+sys.exit(subprocess.call([sys.executable, "-c", {CHILD!r}]))
+'''
+
+
+def test_interrupt_reaches_the_child_of_a_wrapper():
+    async def session():
+        cfg = pycoq.common.LocalKernelConfig(command=[sys.executable, '-c', WRAPPER], env=None)
+        async with pycoq.kernel.LocalKernel(cfg) as kernel:
+            ready = await kernel.readline(timeout=10)
+            await kernel.interrupt()
+            return ready, await kernel.readline(timeout=10), await asyncio.wait_for(kernel.wait(), timeout=10)
+
+    assert asyncio.run(session()) == ('ready\n', 'interrupted\n', 0)
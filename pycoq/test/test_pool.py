@@ -0,0 +1,34 @@
+'''
+tests of pycoq.pool.KernelPool with cat as the kernel
+'''
+import asyncio
+
+import pycoq.common
+import pycoq.pool
+
+
+def test_kernel_pool_reuses_prewarmed_kernels():
+    cfg = pycoq.common.LocalKernelConfig(command=['cat'])
+
+    async def session():
+        async with pycoq.pool.KernelPool(size=1) as pool:
+            pool.prewarm(cfg)
+            await asyncio.gather(*pool._tasks)
+            prewarmed = pool._idle[pycoq.pool.pool_key(cfg)][0]
+            async with pool.kernel(cfg) as kernel:
+                assert kernel is prewarmed
+                await kernel.writeline('(Query () Goals)')
+                assert await kernel.readline(timeout=5) == '(Query () Goals)\n'
+            await asyncio.gather(*pool._tasks)
+            assert len(pool._idle[pycoq.pool.pool_key(cfg)]) == 1
+        return kernel.returncode
+
+    assert asyncio.run(session()) is not None
+
+
+def test_pool_key_includes_env():
+    cfg = pycoq.common.LocalKernelConfig(command=['sertop'], env={'OPAMSWITCH': 'coq-8.10'}, pwd='/tmp')
+    other = pycoq.common.LocalKernelConfig(command=['sertop'], env={'OPAMSWITCH': 'coq-8.15'}, pwd='/tmp')
+    assert pycoq.pool.pool_key(cfg) != pycoq.pool.pool_key(other)
+    assert pycoq.pool.pool_key(pycoq.common.LocalKernelConfig(['sertop'], None, '/tmp')) == \
+        pycoq.pool.pool_key(pycoq.common.LocalKernelConfig(['sertop'], {}, '/tmp'))
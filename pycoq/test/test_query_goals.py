@@ -47,3 +47,14 @@ def test_query_goals_int():
     aux_query_goals("input1", int)
     
     
+
+def test_query_goals_view():
+    ''' tests the lazy views of pycoq.query_goals.SerapiGoalsView against parse_serapi_goals '''
+    input_s = open(with_prefix("query_goals/input1.in")).read().strip()
+    p = serlib.parser.SExpParser()
+    view = pycoq.query_goals.SerapiGoalsView.of_sexp(p, input_s)
+    goals = pycoq.query_goals.parse_serapi_goals(p, view.post_fix, view.ann, str)
+    assert len(view.goals) == len(goals.goals) == 3 and not view.empty()
+    assert view.goals[0].target.sexp() == goals.goals[0].target
+    assert [hyp.typ.sexp() for hyp in view.goals[0].hyps] == [hyp.typ for hyp in goals.goals[0].hyp]
+    assert pycoq.query_goals.SerapiGoalsView.of_sexp(p, '(ObjList())').empty()
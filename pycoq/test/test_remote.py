@@ -0,0 +1,149 @@
+'''
+tests of pycoq.remote with cat as the kernel served on localhost
+'''
+import asyncio
+import json
+import os
+import tempfile
+
+import pycoq.common
+import pycoq.remote
+
+
+CAT = pycoq.common.LocalKernelConfig(command=['cat'], env={})
+
+
+def aux_echo_sessions(server_kwargs, remote_cfg_fn):
+    async def session():
+        async with pycoq.remote.KernelServer(allowed_executables=['cat'], **server_kwargs) as server:
+            remote_cfg = remote_cfg_fn(server)
+            async with pycoq.remote.RemoteConnection(remote_cfg) as connection:
+                kernels = [pycoq.remote.RemoteKernel(remote_cfg, CAT, connection) for _ in range(2)]
+                for kernel in kernels:
+                    await kernel.start()
+                for i, kernel in enumerate(kernels):
+                    await kernel.writeline(f'(Add () "Lemma a{i} :\nTrue.")')
+                for kernel in kernels:
+                    await kernel.terminate(timeout=5)
+                return [[line async for line in kernel.readlines()] for kernel in kernels]
+
+    assert asyncio.run(session()) == [[f'(Add () "Lemma a{i} :\n', 'True.")\n'] for i in range(2)]
+
+
+def test_remote_sessions_tcp():
+    aux_echo_sessions({'port': 0}, lambda server: pycoq.common.RemoteKernelConfig('localhost', server.port))
+
+
+def test_remote_sessions_unix_socket():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'kernels.sock')
+        aux_echo_sessions({'unix_path': path}, lambda server: pycoq.common.RemoteKernelConfig(unix_path=path))
+
+
+def test_remote_executable_not_allowed():
+    async def session():
+        async with pycoq.remote.KernelServer(port=0, allowed_executables=['sertop']) as server:
+            remote_cfg = pycoq.common.RemoteKernelConfig('localhost', server.port)
+            try:
+                async with pycoq.remote.RemoteKernel(remote_cfg, CAT):
+                    return False
+            except RuntimeError:
+                return True
+
+    assert asyncio.run(session())
+
+
+def test_remote_command_not_allowed():
+    async def session(command, **kernel_cfg):
+        async with pycoq.remote.KernelServer(port=0) as server:
+            remote_cfg = pycoq.common.RemoteKernelConfig('localhost', server.port)
+            try:
+                async with pycoq.remote.RemoteKernel(remote_cfg, pycoq.common.LocalKernelConfig(command, **kernel_cfg)):
+                    return False
+            except RuntimeError:
+                return True
+
+    for command in [['opam', 'exec', '--', 'sh'], ['opam', 'exec', '--switch', 'coq-8.10', '--', 'sh'],
+                    ['opam', 'exec', '--', 'bash', '-c', 'echo sertop'], ['/tmp/sertop'],
+                    ['opam', 'exec', '--root', '/tmp/root', '--switch', 'coq-8.10', '--', 'sertop'],
+                    ['sertop', '--topfile', 'a.v', '--load-plugin', 'evil.cmxs']]:
+        assert asyncio.run(session(command))
+
+
+def test_remote_kernel_cfg():
+    server = pycoq.remote.KernelServer(allowed_executables=['cat'], allowed_dirs=['/tmp'], allowed_env=['COQPATH'])
+    cfg, refused = server.kernel_cfg(json.dumps({'command': ['cat'], 'pwd': '/tmp/lf',
+                                                 'env': {'COQPATH': '/tmp/lf', 'LD_PRELOAD': 'evil.so'}}))
+    assert refused is None and cfg.env['COQPATH'] == '/tmp/lf' and cfg.env.get('LD_PRELOAD') != 'evil.so'
+    assert server.kernel_cfg(json.dumps({'command': ['cat'], 'pwd': '/tmp/../etc'}))[0] is None
+    assert server.kernel_cfg(json.dumps({'command': ['cat'], 'pwd': '/tmp', 'shell': True}))[0] is None
+
+
+def test_check_kernel_command():
+    command = ['opam', 'exec', '--root', '/opam', '--switch', 'coq-8.10', '--', 'sertop',
+               '-Q', '/lf,LF', '-R', '.,Top', '--topfile', 'a.v', '--debug']
+    assert pycoq.remote.check_kernel_command(command, ['sertop'], opam_root='/opam') is None
+    assert pycoq.remote.check_kernel_command(command, ['sertop']) is not None
+    assert pycoq.remote.check_kernel_command(['sertop', '-Q', '--debug'], ['sertop']) is not None
+
+
+def test_remote_exited_session_next_to_live_one():
+    async def session():
+        async with pycoq.remote.KernelServer(port=0, allowed_executables=['cat', 'true']) as server:
+            remote_cfg = pycoq.common.RemoteKernelConfig('localhost', server.port)
+            async with pycoq.remote.RemoteConnection(remote_cfg) as connection:
+                exited = pycoq.remote.RemoteKernel(remote_cfg, pycoq.common.LocalKernelConfig(['true']), connection)
+                live = pycoq.remote.RemoteKernel(remote_cfg, CAT, connection)
+                await exited.start()
+                await live.start()
+                assert await asyncio.wait_for(exited.wait(), timeout=5) == 0
+                for _ in range(3):
+                    await exited.writeline('(Add () "Lemma a : True.")')
+                    await exited.interrupt()
+                await connection.send('IN', 99, json.dumps('(Query () Goals)'))
+                await live.writeline('(Query () Goals)')
+                line = await live.readline(timeout=5)
+                respawned = await live.respawn()
+                await respawned.writeline('(Exec 2)')
+                respawned_line = await respawned.readline(timeout=5)
+                for kernel in [exited, live, respawned]:
+                    await kernel.terminate(timeout=5)
+                return line, respawned_line
+
+    assert asyncio.run(session()) == ('(Query () Goals)\n', '(Exec 2)\n')
+
+
+def test_remote_malformed_frames_next_to_live_session():
+    async def session():
+        async with pycoq.remote.KernelServer(port=0, allowed_executables=['cat']) as server:
+            remote_cfg = pycoq.common.RemoteKernelConfig('localhost', server.port)
+            async with pycoq.remote.RemoteConnection(remote_cfg) as connection:
+                live = pycoq.remote.RemoteKernel(remote_cfg, CAT, connection)
+                await live.start()
+                connection._writer.write(b'garbage\n')
+                await connection.send('IN', live._session, '{not json')
+                await connection.send('IN', live._session, '["not", "a", "string"]')
+                await connection.send('NOP', live._session)
+                await live.writeline('(Query () Goals)')
+                line = await live.readline(timeout=5)
+                await live.terminate(timeout=5)
+                return line
+
+    assert asyncio.run(session()) == '(Query () Goals)\n'
+
+
+def test_remote_line_spilled_while_received():
+    text = 'x' * 1000
+
+    async def session():
+        async with pycoq.remote.KernelServer(port=0, allowed_executables=['cat']) as server:
+            remote_cfg = pycoq.common.RemoteKernelConfig('localhost', server.port)
+            async with pycoq.remote.RemoteKernel(remote_cfg, CAT) as kernel:
+                kernel.spill_threshold = 64
+                await kernel.writeline('(Answer 0 Ack)')
+                await kernel.writeline(f'(Answer 0(ObjList((CoqString"{text}"))))')
+                ack = await kernel.readline_sexp(timeout=5, spill_threshold=64)
+                received = await asyncio.wait_for(kernel._out.get(), timeout=5)
+                return ack.spilled, received.spilled, received.loads([2, 1, 0, 1])
+
+    assert asyncio.run(session()) == (False, True, text)
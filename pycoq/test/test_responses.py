@@ -0,0 +1,40 @@
+'''
+tests of the decoding of coq-serapi response lines into typed records
+'''
+from pycoq.responses import (decode_response, Ack, Completed, Added, CoqExn, Canceled, ObjList, Feedback,
+                             ResponseIndex, keep_feedback)
+
+
+LOC = b'((fname ToplevelInput)(line_nb 1)(bol_pos 0)(line_nb_last 1)(bol_pos_last 0)(bp 16)(ep 22))'
+
+
+def test_decode_answers():
+    assert decode_response(b'(Answer 12 Ack)\n') == Ack(12)
+    assert decode_response(b'(Answer 12 Completed)\n') == Completed(12)
+    assert decode_response(b'(Answer 3(Added 7' + LOC + b'NewTip))\n') == Added(3, 7, (16, 22))
+    assert decode_response(b'(Answer 6(Canceled(3 4 5)))\n') == Canceled(6, [3, 4, 5])
+    assert decode_response(b'(Answer 4(CoqExn((loc())(stm_ids((3 4)))(str"Error"))))\n') == \
+        CoqExn('(CoqExn((loc())(stm_ids((3 4)))(str"Error")))', None, 4, 4)
+    objlist = decode_response(b'(Answer 5 (ObjList((CoqString"goal"))))\n')
+    assert isinstance(objlist, ObjList) and objlist.payload == '(ObjList((CoqString"goal")))'
+
+
+def test_decode_feedback():
+    processed = b'(Feedback((doc_id 0)(span_id 7)(route 0)(contents Processed)))\n'
+    message = b'(Feedback((doc_id 0)(span_id 9)(route 0)(contents(Message(level Notice)(loc())(str"fun")))))\n'
+    assert decode_response(processed) == Feedback(7, 'Processed', processed)
+    assert decode_response(message) == Feedback(9, 'Message', message)
+    assert [keep_feedback(line, 'messages') for line in [processed, message]] == [False, True]
+    assert not keep_feedback(message, 'none') and keep_feedback(b'(Answer 1 Ack)\n', 'none')
+
+
+def test_response_index_routes_records():
+    index = ResponseIndex()
+    index.open(0)
+    lines = [b'(Answer 0 Ack)\n',
+             b'(Feedback((doc_id 0)(span_id 7)(route 0)(contents(ProcessingIn master))))\n',
+             b'(Answer 0(Added 7' + LOC + b'NewTip))\n',
+             b'(Answer 0 Completed)\n']
+    assert [index.route(line) for line in lines] == [None, None, None, 0]
+    assert index[0].sids == [7] and index[0].locs == [(16, 22)] and index[0].completed
+    assert [feedback.kind for feedback in index[0].feedback()] == ['ProcessingIn']
@@ -0,0 +1,62 @@
+'''
+tests of the sentence index of coq projects
+'''
+import os
+import shutil
+
+import pytest
+
+import pycoq.sentence_index
+import pycoq.split
+
+
+def with_prefix(fname):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), fname)
+
+
+def test_sentence_kinds():
+    stmts = ['Require Import Arith.', ' (* a. *) Theorem t : True.', '\nProof.', ' - auto.', ' Qed.',
+             '\nDefinition d := 0.', '\n#[local] Instance i : Inhabited nat.', ' exact 0.', ' Defined.',
+             '\nLemma l : False.', ' Abort.']
+    assert pycoq.sentence_index.sentence_kinds(stmts) == [
+        'vernac', 'proof_start', 'tactic', 'tactic', 'proof_end',
+        'vernac', 'proof_start', 'tactic', 'proof_end',
+        'proof_start', 'proof_end']
+
+
+def test_index_source():
+    fname = with_prefix('lf/Basics.v')
+    entry = pycoq.sentence_index.index_source(fname)
+    with open(fname) as f:
+        stmts = list(pycoq.split.coq_stmts_of_lines(f.readlines()))
+    assert len(entry['offsets']) == len(entry['kinds']) == len(entry['hashes']) == len(stmts)
+    assert entry['kinds'].count('proof_start') == entry['kinds'].count('proof_end') > 0
+    with open(fname, 'rb') as f:
+        source = f.read()
+    assert [source[start:end].decode() for start, end in entry['offsets']] == stmts
+
+
+def test_build_sentence_index(tmp_path):
+    project_splits = pytest.importorskip('pycoq.project_splits')
+    shutil.copytree(with_prefix('lf'), tmp_path / 'projs' / 'lf')
+    coq_proj = project_splits.CoqProj(project_name='lf', train_files=['Basics.v', 'Induction.v'],
+                                      test_files=['TwoGoals.v'], switch='coq-8.10',
+                                      path_2_coq_projs=str(tmp_path / 'projs'))
+    coq_projs = project_splits.CoqProjs(coq_projs=[coq_proj], path_2_coq_projs=tmp_path / 'projs',
+                                        path_2_coq_projs_json_splits=tmp_path / 'splits.json')
+    index_dir = str(tmp_path / 'index')
+    index_fname = pycoq.sentence_index.build_sentence_index(coq_projs, index_dir, max_workers=2)['lf']
+    index = pycoq.sentence_index.load_sentence_index(index_fname)
+    assert list(index['files']) == ['Basics.v', 'Induction.v', 'TwoGoals.v']
+    assert index['files']['TwoGoals.v']['split'] == 'test'
+
+    # only the changed file is split again
+    with open(tmp_path / 'projs' / 'lf' / 'TwoGoals.v', 'a') as f:
+        f.write('\nLemma extra : True.\nProof. auto. Qed.\n')
+    os.utime(tmp_path / 'projs' / 'lf' / 'Basics.v')
+    pycoq.sentence_index.build_sentence_index(coq_projs, index_dir, max_workers=2)
+    rebuilt = pycoq.sentence_index.load_sentence_index(index_fname)
+    assert rebuilt['files']['Basics.v']['offsets'] == index['files']['Basics.v']['offsets']
+    counts = pycoq.sentence_index.sentence_counts(rebuilt)
+    assert counts['TwoGoals.v'] == pycoq.sentence_index.sentence_counts(index)['TwoGoals.v'] + 4
+    assert rebuilt['files']['TwoGoals.v']['kinds'][-4:] == ['proof_start', 'tactic', 'tactic', 'proof_end']
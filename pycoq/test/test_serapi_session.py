@@ -0,0 +1,447 @@
+'''
+tests of pycoq.serapi.CoqSerapi session logic against a scripted kernel
+that speaks the coq-serapi protocol (no opam / sertop needed)
+'''
+import asyncio
+import mmap
+import re
+
+import pycoq.serapi
+import pycoq.split
+import pycoq.stream
+
+
+LOC = '((fname ToplevelInput)(line_nb 1)(bol_pos 0)(line_nb_last 1)(bol_pos_last 0)(bp {bp})(ep {ep}))'
+STMT = re.compile(r'[^.]*\.(\s+|$)')
+BLANK = re.compile(r'(\s|\(\*.*?\*\))*')
+ONTOP = re.compile(r'\(ontop (\d+)\)')
+
+
+class ScriptedKernel():
+    ''' in-process kernel with the readline, readlines, writeline interface of pycoq.kernel.LocalKernel
+
+    Add splits on dots and fails on top of a sid that is not in the document (e.g. canceled),
+    a sentence containing "syntax_error" fails in Add,
+    a sentence containing "exec_error" fails in Exec (reported without stm_ids if stm_ids=False),
+    Query Goals returns the list of executed sentences as CoqString,
+    Exec of Show Proof. sends them in a Message feedback,
+    the first generation of the kernel exits in Exec of a sentence containing "crash",
+    Exec of a sentence containing "loop" runs until interrupted, of "hang" never completes
+    '''
+
+    def __init__(self, stm_ids=True, generation=0):
+        self._stm_ids = stm_ids
+        self._generation = generation
+        self.returncode = None
+        self._out = asyncio.Queue()
+        self._tag = 0
+        self._next_sid = 2
+        self._stmts = {}
+        self._executed = []
+        self._running = None
+
+    async def writeline(self, line):
+        if self.returncode is not None:
+            raise BrokenPipeError
+        tag, self._tag = self._tag, self._tag + 1
+        lines = [f'(Answer {tag} Ack)']
+        ontop = ONTOP.search(line)
+        if line.startswith('(Add ') and ontop and int(ontop.group(1)) not in self._stmts.keys() | {1}:
+            lines.append(f'(Answer {tag}(CoqExn((loc())(stm_ids())(str"Stm.add: unknown state {ontop.group(1)}"))))')
+        elif line.startswith('(Add '):
+            text = line[line.index('"') + 1:line.rindex('"')]
+            for m in STMT.finditer(text):
+                if not m.group(0):
+                    break
+                if 'syntax_error' in m.group(0):
+                    lines.append(f'(Answer {tag}(CoqExn((loc({LOC.format(bp=m.start(), ep=m.end())}))'
+                                 f'(stm_ids())(str"Syntax error"))))')
+                    break
+                sid, self._next_sid = self._next_sid, self._next_sid + 1
+                self._stmts[sid] = m.group(0).strip()
+                bp = m.start() + BLANK.match(m.group(0)).end()
+                ep = m.start() + len(m.group(0).rstrip())
+                lines.append(f'(Answer {tag}(Added {sid}{LOC.format(bp=bp, ep=ep)}NewTip))')
+        elif line.startswith('(Exec '):
+            sid = int(line[len('(Exec '):-1])
+            for s in sorted(self._stmts):
+                if s > sid or s in self._executed:
+                    continue
+                lines.append(f'(Feedback((doc_id 0)(span_id {s})(route 0)(contents(ProcessingIn master))))')
+                if 'crash' in self._stmts[s] and self._generation == 0:
+                    self.returncode = -11
+                    lines.append('')
+                    break
+                if 'loop' in self._stmts[s] or 'hang' in self._stmts[s]:
+                    self._running = (tag, s)
+                    break
+                if 'exec_error' in self._stmts[s]:
+                    stm_ids = f'(({s - 1} {s}))' if self._stm_ids else '()'
+                    lines.append(f'(Answer {tag}(CoqExn((loc())(stm_ids{stm_ids})(str"Error in {s}"))))')
+                    break
+                if self._stmts[s] == 'Show Proof.':
+                    proof = ' '.join(self._stmts[e] for e in self._executed)
+                    lines.append(f'(Feedback((doc_id 0)(span_id {s})(route 0)(contents(Message(level Notice)'
+                                 f'(loc())(pp(Pp_string"{proof}"))(str"{proof}")))))')
+                self._executed.append(s)
+                lines.append(f'(Feedback((doc_id 0)(span_id {s})(route 0)(contents Processed)))')
+        elif line.startswith('(Cancel '):
+            sids = [int(x) for x in line[len('(Cancel ('):-2].split()]
+            canceled = [s for s in sorted(self._stmts) if s >= min(sids)] if sids else []
+            for s in canceled:
+                del self._stmts[s]
+                if s in self._executed:
+                    self._executed.remove(s)
+            lines.append(f'(Answer {tag}(Canceled({" ".join(map(str, canceled))})))')
+        elif 'Goals' in line:
+            goals = ' '.join(self._stmts[s] for s in self._executed).replace('\n', '\\n')
+            lines.append(f'(Answer {tag}(ObjList((CoqString"{goals}"))))')
+        if self.returncode is None and self._running is None:
+            lines.append(f'(Answer {tag} Completed)')
+        for out in lines:
+            await self._out.put(out and out + '\n')
+
+    async def readline(self, timeout=None):
+        line = await asyncio.wait_for(self._out.get(), timeout=timeout)
+        if line == '':
+            self._out.put_nowait('')
+        return line
+
+    async def readline_bytes(self, timeout=None):
+        return (await self.readline(timeout)).encode()
+
+    async def readline_sexp(self, timeout=None, spill_threshold=None):
+        line = await self.readline_bytes(timeout)
+        return pycoq.stream.LazySexp.of_bytes(line, spill_threshold) if line else None
+
+    async def readlines(self, count=None, timeout=None, quiet=True):
+        while not self._out.empty():
+            line = self._out.get_nowait()
+            if line == '':
+                break
+            yield line
+
+    async def interrupt(self):
+        if self._running is not None and 'loop' in self._stmts[self._running[1]]:
+            (tag, s), self._running = self._running, None
+            await self._out.put(f'(Answer {tag}(CoqExn((loc())(stm_ids(({s - 1} {s})))(str"User interrupt."))))\n')
+            await self._out.put(f'(Answer {tag} Completed)\n')
+
+    async def wait(self):
+        return self.returncode
+
+    async def respawn(self):
+        return ScriptedKernel(self._stm_ids, self._generation + 1)
+
+    async def terminate(self, timeout=None):
+        self.returncode = self.returncode or 0
+        await self._out.put('')
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        await self.terminate()
+
+
+def run_session(coro_fn, stm_ids=True, **kwargs):
+    async def run():
+        coq = pycoq.serapi.CoqSerapi(pycoq.common.LocalKernelConfig(), **kwargs)
+        coq._kernel = ScriptedKernel(stm_ids)
+        async with coq:
+            return await coro_fn(coq)
+    return asyncio.run(run())
+
+
+def test_execute_sequential():
+    async def session(coq):
+        _, _, coqexns, sids = await coq.execute('Lemma a : True. Proof.')
+        assert coqexns == [] and sids == [2, 3]
+        _, _, coqexns, sids = await coq.execute('exec_error.')
+        assert len(coqexns) == 1 and sids is None
+        return await coq.query_goals_completed()
+    assert run_session(session) == '(ObjList((CoqString"Lemma a : True. Proof.")))'
+
+
+def test_pipelined_commands_awaited_out_of_order():
+    async def session(coq):
+        tags = [await coq.add('Lemma a : True.'), await coq.add('Proof.'), await coq.query_goals()]
+        await coq.wait_for_answer_completed(tags[2])
+        await coq.wait_for_answer_completed(tags[0])
+        await coq.wait_for_answer_completed(tags[1])
+        return [await coq.added_sids(tag) for tag in tags[:2]]
+    assert run_session(session, pipelined=True) == [[2], [3]]
+
+
+def test_response_retention():
+    async def session(coq):
+        for i in range(5):
+            await coq.execute(f'Lemma a{i} : True.')
+        cmd_tag, resp_ind, coqexns, _ = await coq.execute('syntax_error.')
+        assert len(coqexns) == 1 and resp_ind is None and coq._responses[cmd_tag].completed
+        return len(coq._responses), coq._serapi_response_history
+    for pipelined in [False, True]:
+        n_buckets, history = run_session(session, keep_responses=2, pipelined=pipelined)
+        assert n_buckets <= 3 and history == []
+
+
+def test_feedback_policy():
+    async def session(coq):
+        await coq.execute('Lemma a : True. Proof.')
+        return [line for line in coq._serapi_response_history if line.startswith('(Feedback')]
+    assert len(run_session(session)) == 4
+    assert run_session(session, feedback='none') == []
+
+
+def test_feedback_policy_keeps_proof_term_messages():
+    async def session(coq):
+        await coq.execute('Lemma a : True.')
+        observation = await coq.execute_and_observe('Proof. idtac.', proof_term=True)
+        return observation.proof_term, await coq.proof_term(), coq._message_sids
+
+    for feedback in ['messages', 'none']:
+        assert run_session(session, feedback=feedback) == ('Lemma a : True. Proof. idtac.',) * 2 + (set(),)
+
+
+def test_execute_many():
+    stmts = ['Lemma a : True.\n', 'Proof. ', '(* no sentence *)', 'exact I.', 'Qed.']
+
+    async def session(coq):
+        _, _, coqexns, sids = await coq.execute_many(stmts)
+        return coqexns, sids, await coq.query_goals_completed()
+    assert run_session(session) == ([], [[2], [3], [], [4], [5]],
+                                    '(ObjList((CoqString"Lemma a : True. Proof. (* no sentence *)\\nexact I. Qed.")))')
+
+
+def aux_execute_many_error(stmts, stm_ids=True):
+    async def session(coq):
+        _, _, coqexns, sids = await coq.execute_many(stmts, chunk_size=3)
+        return len(coqexns), sids, await coq.query_goals_completed()
+    return run_session(session, stm_ids=stm_ids)
+
+
+def test_execute_many_exec_error():
+    stmts = ['Lemma a : True.', 'Proof.', 'idtac.', 'exec_error.', 'exact I.', 'Qed.']
+    ans = (1, [[2], [3], [4]], '(ObjList((CoqString"Lemma a : True. Proof. idtac.")))')
+    assert aux_execute_many_error(stmts) == ans
+    assert aux_execute_many_error(stmts, stm_ids=False) == ans
+
+
+def test_execute_many_syntax_error():
+    stmts = ['Lemma a : True.', 'Proof. syntax_error.', 'exact I.']
+    assert aux_execute_many_error(stmts) == (1, [[2]], '(ObjList((CoqString"Lemma a : True.")))')
+
+
+def test_checkpoint_reset():
+    async def session(coq):
+        await coq.execute('Require Import Arith.')
+        baseline = coq.checkpoint()
+        for prop, sids in [('Lemma a : True.', [3, 4, 5]), ('Lemma b : False.', [6, 7, 8])]:
+            await coq.execute(prop)
+            await coq.execute('Proof. idtac.')
+            assert await coq.reset() == sids
+            assert coq.tip() == baseline
+        return await coq.query_goals_completed()
+    assert run_session(session) == '(ObjList((CoqString"Require Import Arith.")))'
+
+
+def test_reset_to_initial_state_after_checkpoint():
+    async def session(coq):
+        baseline = coq.tip()
+        await coq.execute('Require Import Arith.')
+        coq.checkpoint()
+        await coq.execute('Lemma a : True.')
+        assert baseline is None
+        assert await coq.reset_to(baseline) == [2, 3]
+        assert coq.tip() is None
+        return await coq.query_goals_completed()
+    assert run_session(session) == '(ObjList((CoqString"")))'
+
+
+def test_resilient_restart_replays_executed_statements():
+    async def session(coq):
+        await coq.execute_many(['Lemma a : True.', 'Proof.'])
+        baseline = coq.checkpoint()
+        _, _, coqexns, sids = await coq.execute('crash. idtac.')
+        assert coqexns == [] and coq._restarts == 1
+        assert coq.translate_sid(baseline) == coq._checkpoint == 3
+        assert sids == [4, 5] and coq._live_sids == [2, 3, 4, 5]
+        await coq.reset(coq.translate_sid(baseline))
+        return await coq.query_goals_completed()
+    assert run_session(session, resilient=True) == '(ObjList((CoqString"Lemma a : True. Proof.")))'
+
+
+def test_kernel_exit_without_resilient_mode():
+    async def session(coq):
+        try:
+            await coq.execute('crash.')
+        except EOFError:
+            return True
+    assert run_session(session)
+
+
+def test_timeout_interrupts_command():
+    async def session(coq):
+        await coq.execute('Lemma a : True. Proof.')
+        _, _, coqexns, sids = await coq.execute('idtac. loop.', timeout=0.05)
+        assert isinstance(coqexns[0], pycoq.serapi.CoqTimeout) and not coqexns[0].restarted
+        return await coq.query_goals_completed()
+    assert run_session(session) == '(ObjList((CoqString"Lemma a : True. Proof.")))'
+
+
+def test_timeout_restarts_unresponsive_kernel():
+    stmts = ['Lemma a : True.', 'Proof.', 'idtac.', 'hang.', 'exact I.']
+
+    async def session(coq):
+        _, _, coqexns, sids = await coq.execute_many(stmts, timeout=0.05)
+        assert isinstance(coqexns[0], pycoq.serapi.CoqTimeout) and coqexns[0].restarted
+        return sids, await coq.query_goals_completed()
+    assert run_session(session, interrupt_timeout=0.05) == (
+        [[2], [3], [4]], '(ObjList((CoqString"Lemma a : True. Proof. idtac.")))')
+
+
+def test_timeout_located_without_processed_feedback():
+    stmts = ['Lemma a : True.', 'Proof.', 'idtac.', '{}.', 'exact I.']
+
+    async def session(coq):
+        _, _, coqexns, sids = await coq.execute_many(stmts_timing_out, timeout=0.05)
+        assert isinstance(coqexns[0], pycoq.serapi.CoqTimeout)
+        return len(sids), await coq.query_goals_completed()
+
+    for stmts_timing_out in [[stmt.format('loop') for stmt in stmts], [stmt.format('hang') for stmt in stmts]]:
+        assert run_session(session, feedback='none', interrupt_timeout=0.05) == (
+            3, '(ObjList((CoqString"Lemma a : True. Proof. idtac.")))')
+
+
+def test_goals_cache_invalidated_by_state_commands():
+    def n_goals_queries(coq):
+        return sum('Goals' in cmd for cmd in coq._sent_history)
+
+    async def session(coq):
+        await coq.execute('Lemma a : True.')
+        assert await coq.in_proof_mode() and await coq.in_proof_mode()
+        await coq.query_local_ctx_and_goals()
+        n_queries = n_goals_queries(coq)
+        await coq.execute('Proof.')
+        goals = await coq.query_local_ctx_and_goals()
+        return n_queries, n_goals_queries(coq), goals
+    assert run_session(session) == (1, 2, 'Lemma a : True. Proof.')
+    assert run_session(session, cache_goals=False) == (3, 4, 'Lemma a : True. Proof.')
+
+
+def test_execute_and_observe():
+    def n_goals_queries(coq):
+        return sum('Goals' in cmd for cmd in coq._sent_history)
+
+    async def session(coq):
+        await coq.execute('Lemma a : True.')
+        observation = await coq.execute_and_observe('Proof. idtac.', proof_term=True)
+        n_queries = n_goals_queries(coq)
+        assert await coq.query_goals_completed() == observation.goals
+        assert n_goals_queries(coq) == n_queries
+        failed = await coq.execute_and_observe('exec_error.')
+        return observation, failed.sids, len(failed.coqexns), coq._live_sids
+
+    for pipelined in [False, True]:
+        observation, failed_sids, n_coqexns, live_sids = run_session(session, pipelined=pipelined)
+        assert observation == pycoq.serapi.Observation(
+            [3, 4], [], '(ObjList((CoqString"Lemma a : True. Proof. idtac.")))', 'Lemma a : True. Proof. idtac.')
+        assert failed_sids is None and n_coqexns == 1 and live_sids == [2, 3, 4]
+
+
+def test_proof_term():
+    async def session(coq):
+        await coq.execute('Lemma a : True.')
+        await coq.execute('Proof. idtac.')
+        goals = await coq.query_goals_completed()
+        n_sent = len(coq._sent_history)
+        terms = [await coq.proof_term(form) for form in ['str', 'pp', 'postfix']]
+        assert len(coq._sent_history) == n_sent + 9
+        assert await coq.query_goals_completed() == goals and len(coq._sent_history) == n_sent + 9
+        return terms, coq.parser.to_sexp(terms[2]), list(coq._live_sids), await coq.get_current_proof_term_via_add()
+
+    for pipelined in [False, True]:
+        (text, pp, _), decoded, live_sids, via_add = run_session(session, pipelined=pipelined)
+        assert text == via_add == 'Lemma a : True. Proof. idtac.'
+        assert pp == decoded.encode() == b'(Pp_string"Lemma a : True. Proof. idtac.")'
+        assert live_sids == [2, 3, 4]
+
+
+def test_probe_candidates():
+    async def session(coq):
+        await coq.execute('Lemma a : True. Proof.')
+        goals = await coq.query_goals_completed()
+        observations = await coq.probe(['idtac.', 'exec_error.', 'syntax_error.', 'idtac. idtac.'])
+        assert await coq.query_goals_completed() == goals
+        return [(o.sids, len(o.coqexns), o.goals) for o in observations], coq._live_sids
+
+    goals = '(ObjList((CoqString"Lemma a : True. Proof.{}")))'
+    for pipelined in [False, True]:
+        assert run_session(session, pipelined=pipelined) == (
+            [([4], 0, goals.format(' idtac.')), (None, 1, None), ([], 1, None),
+             ([6, 7], 0, goals.format(' idtac. idtac.'))], [2, 3])
+
+
+def test_proof_term_renews_full_parser():
+    async def session(coq):
+        import serlib.parser
+        coq._parser = serlib.parser.SExpParser(max_words=2)
+        await coq.execute('Lemma a : True.')
+        first = await coq.proof_term('postfix')
+        first_parser = coq.parser
+        await coq.execute('Proof. idtac.')
+        second = await coq.proof_term('postfix')
+        assert coq.parser is not first_parser
+        return first_parser.to_sexp(first), coq.parser.to_sexp(second)
+
+    assert run_session(session) == ('(Pp_string"Lemma a : True.")', '(Pp_string"Lemma a : True. Proof. idtac.")')
+
+
+def test_spilled_responses():
+    async def session(coq):
+        await coq.execute('Lemma a : True.')
+        observation = await coq.execute_and_observe('Proof. idtac.', proof_term=True)
+        assert all(isinstance(line, str) for line in coq._serapi_response_history)
+        spilled = [line for line in coq._serapi_response_history if line.endswith('bytes spilled)')]
+        return observation, len(spilled), len(coq._serapi_response_history)
+
+    for pipelined in [False, True]:
+        observation, n_spilled, n_lines = run_session(session, pipelined=pipelined, spill_threshold=40)
+        assert observation == pycoq.serapi.Observation(
+            [3, 4], [], '(ObjList((CoqString"Lemma a : True. Proof. idtac.")))', 'Lemma a : True. Proof. idtac.')
+        assert 0 < n_spilled < n_lines
+
+
+def test_spilled_goals_parsed_in_place():
+    async def session(coq):
+        await coq.execute('Lemma a : True.')
+        await coq.execute('Proof. idtac.')
+        goals = await coq._query_goal_raw()
+        cached = coq._goals_cache[''][0]
+        return coq.parser.to_sexp(coq.parser.postfix_of_bytestring(goals)), type(cached.obj), \
+            await coq.query_goals_completed()
+
+    for pipelined in [False, True]:
+        for spill_threshold, buffer in [(None, bytes), (40, mmap.mmap)]:
+            assert run_session(session, pipelined=pipelined, cache_goals=True, spill_threshold=spill_threshold) == (
+                '(ObjList((CoqString"Lemma a : True. Proof. idtac.")))', buffer,
+                '(ObjList((CoqString"Lemma a : True. Proof. idtac.")))')
+
+
+def test_split_file_with_offsets_cache(tmp_path):
+    source = tmp_path / 'a.v'
+    source.write_text('Lemma a : True.\n  Proof. idtac.\nQed.\n')
+    cachedir = str(tmp_path / 'cache')
+
+    async def session(coq):
+        await coq.execute('Lemma b : True.')
+        stmts = await pycoq.split.coq_stmts_of_file(coq, str(source), 'coq-8.15', cachedir=cachedir)
+        n_sent = len(coq._sent_history)
+        cached = await pycoq.split.coq_stmts_of_file(coq, str(source), 'coq-8.15', cachedir=cachedir)
+        assert len(coq._sent_history) == n_sent
+        coq._cfg.command = ['sertop', '-Q', 'lf,LF', '--topfile', 'a.v']
+        other_load_path = await pycoq.split.coq_stmts_of_file(coq, str(source), 'coq-8.15', cachedir=cachedir)
+        assert len(coq._sent_history) > n_sent
+        return stmts, cached, other_load_path, coq._live_sids
+
+    stmts, cached, other_load_path, live_sids = run_session(session)
+    assert stmts == cached == other_load_path == ['Lemma a : True.', 'Proof.', 'idtac.', 'Qed.']
+    assert live_sids == [2]
+    assert len(list((tmp_path / 'cache').glob('*/*.json'))) == 2
@@ -169,3 +169,21 @@ def test_hash_bytestring_5gb():
     test = b'\0'*n
     ans = 5371*pow(257, n, 2**64) % 2**64
     assert serlib.parser.hash_bytestring(test) == ans
+
+
+def test_sexpparser_bounded_dictionary():
+    ''' parsing beyond the bound of the dictionary raises and leaves the dictionary unchanged '''
+    parser = serlib.parser.SExpParser(max_words=3)
+    res = parser.postfix_of_sexp('(a (b a))')
+    with pytest.raises(serlib.cparser.BufferOverflow):
+        parser.postfix_of_sexp('(c d)')
+    assert parser.to_sexp(res) == '(a(b a))' and len(parser.dict) == 2
+    parser.clear()
+    assert all(parser.postfix_of_sexp('(c d)') == numpy.array([1, 2, -2], dtype=numpy.intc))
+
+
+def test_sexpparser_parsing_error():
+    parser = serlib.parser.SExpParser()
+    for s in ['(a b', '(a))', '(a "b)']:
+        with pytest.raises(serlib.cparser.ParsingError):
+            parser.postfix_of_sexp(s)
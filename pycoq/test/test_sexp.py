@@ -0,0 +1,45 @@
+'''
+tests of the token array parser pycoq.sexp
+'''
+import pytest
+
+from pycoq.sexp import sexp, tokenize, TOKEN_WORD, TOKEN_OPEN_PAR, TOKEN_CLOSE_PAR
+
+
+def test_sexp_examples():
+    assert sexp('()') == []
+    assert sexp('(())') == [[]]
+    assert sexp('(()  ()  )') == [[], []]
+    assert sexp('(abb()bcc)') == ['abb', [], 'bcc']
+    assert sexp('(abb"bcc"())') == ['abb', '"bcc"', []]
+    assert sexp('(a "b \\" (c" \n(d))') == ['a', '"b \\" (c"', ['d']]
+    for bad in ['(a', 'a)', '("a)', '("a\\']:
+        with pytest.raises(ValueError):
+            sexp(bad)
+
+
+def test_token_arrays_and_structural_queries():
+    data = '(Answer 1(ObjList((CoqString"x y")(CoqString z))))'
+    tokens = tokenize(data)
+    assert tokens.kind.tolist()[:4] == [TOKEN_OPEN_PAR, TOKEN_WORD, TOKEN_WORD, TOKEN_OPEN_PAR]
+    assert tokens.kind[-1] == TOKEN_CLOSE_PAR and tokens.match[0] == len(tokens) - 1
+    assert tokens.roots().tolist() == [0]
+    assert tokens.arity()[0] == 3 and tokens.depth().max() == 4
+    obj_list = tokens.at([2, 1])
+    assert tokens.arity()[obj_list] == 2
+    assert tokens.text(obj_list) == '((CoqString"x y")(CoqString z))'
+    assert [tokens.text(i) for i in tokens.children(tokens.at([2, 1, 0]))] == ['CoqString', '"x y"']
+    assert tokens.to_sexp(tokens.at([2, 1, -1])) == ['CoqString', 'z']
+    assert tokens.to_sexp() == sexp(data)
+    with pytest.raises(IndexError):
+        tokens.at([1, 0])
+
+
+def test_deep_nesting():
+    depth = 100000
+    tokens = tokenize('(' * depth + 'a' + ')' * depth)
+    assert tokens.depth()[depth] == depth
+    value = tokens.to_sexp()
+    for _ in range(depth - 1):
+        value = value[0]
+    assert value == ['a']
@@ -0,0 +1,42 @@
+'''
+tests of the iterative s-expression parser pycoq.sexp_parser
+'''
+import pytest
+
+from pycoq.sexp_parser import loads, loads_at, span, children
+
+
+MESSAGE = (b'(Feedback((doc_id 0)(span_id 9)(route 0)(contents(Message(level Notice)(loc())'
+           b'(str"fun (n : nat) => n")))))')
+
+
+def test_loads():
+    assert loads(b'(ObjList((CoqString"a b")))') == ['ObjList', [['CoqString', 'a b']]]
+    assert loads('(Answer 3 ( Ack ) ())') == ['Answer', '3', ['Ack'], []]
+    assert loads(b'(CoqString"\\n  n : nat\\"\\\\\\\n   ok\\065")') == ['CoqString', '\n  n : nat"\\okA']
+
+
+def test_loads_deep_nesting():
+    depth = 100000
+    sexp = loads(b'(' * depth + b'x' + b')' * depth)
+    for _ in range(depth):
+        sexp = sexp[0]
+    assert sexp == 'x'
+
+
+def test_subtree_at_path():
+    assert loads_at(MESSAGE, [1, 3, 1, -1]) == ['str', 'fun (n : nat) => n']
+    assert loads_at(MESSAGE, [1, 1, 1]) == '9'
+    start, end = span(MESSAGE, [1, 3, 1, 2])
+    assert MESSAGE[start:end] == b'(loc())'
+    assert [MESSAGE[s:e] for s, e in children(MESSAGE, count=2)] == [b'Feedback', MESSAGE[9:-1]]
+
+
+def test_errors():
+    for data in [b'(a b', b'(a))', b'a b', b'(a "b)']:
+        with pytest.raises(ValueError):
+            loads(data)
+    with pytest.raises(IndexError):
+        span(MESSAGE, [1, 7])
+    with pytest.raises(IndexError):
+        span(MESSAGE, [0, 0])
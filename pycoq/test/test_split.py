@@ -0,0 +1,34 @@
+'''
+tests of the whole buffer splitter of pycoq.split
+'''
+import glob
+import os
+
+import pycoq.split
+
+
+def with_prefix(fname):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), fname)
+
+
+def test_offsets_agree_with_lines_split():
+    fnames = glob.glob(with_prefix('lf/*.v'))
+    assert fnames
+    for fname in fnames:
+        with open(fname) as f:
+            expected = list(pycoq.split.coq_stmts_of_lines(f.readlines()))
+        stmts = pycoq.split.coq_stmts_of_source(fname)
+        assert list(stmts) == expected
+        stmts.close()
+
+
+def test_offsets_edge_cases():
+    text = ('Definition a := "x. y". (* b. (* c. *) d. *)\n'
+            'Notation "x .. y" := 0.  \n  Lemma b : True.\nProof. -  auto.\n'
+            '  Qed.   ')
+    source = text.encode()
+    offsets = pycoq.split.coq_stmt_offsets(source)
+    assert offsets.shape == (len(list(pycoq.split.coq_stmts_of_lines(text.splitlines(True)))), 2)
+    assert list(pycoq.split.CoqStmts(source, offsets)) == list(
+        pycoq.split.coq_stmts_of_lines(text.splitlines(True)))
+    assert pycoq.split.CoqStmts(source, offsets)[1:2][0] == '(* b. (* c. *) d. *)\nNotation "x .. y" := 0.  \n'
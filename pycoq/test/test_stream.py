@@ -0,0 +1,94 @@
+'''
+tests of the streaming read of response lines pycoq.stream
+'''
+import asyncio
+
+import pytest
+
+import pycoq.sexp
+import pycoq.sexp_parser
+from pycoq.stream import ChunkedLineReader, LazySexp
+
+
+MESSAGE = (b'(Feedback((doc_id 0)(span_id 7)(route 0)(contents(Message(level Notice)(loc())'
+           b'(pp(Pp_string"fun n : nat => eq_refl"))(str"fun (n : nat) \\"x\\" => eq_refl (n + 0)")))))\n')
+
+
+def test_incremental_parser_across_chunks():
+    data = b'(Answer 3(ObjList((CoqString"a (b) \\" c")(CoqString d))))  '
+    for chunk_size in [1, 2, 3, 7, len(data)]:
+        parser = pycoq.sexp.IncrementalSexpParser(index_depth=3)
+        for offset in range(0, len(data), chunk_size):
+            parser.feed(data[offset:offset + chunk_size])
+        index = parser.close()
+        spans = sorted(zip(index.start.tolist(), index.end.tolist(), index.depth.tolist()))
+        assert spans[:5] == [(0, 57, 0), (1, 7, 1), (8, 9, 1), (9, 56, 1), (10, 17, 2)]
+        assert [data[s:e] for s, e, d in spans if d == 3] == [b'(CoqString"a (b) \\" c")', b'(CoqString d)']
+    for bad in [b'(a', b'a)', b'("a)']:
+        parser = pycoq.sexp.IncrementalSexpParser(index_depth=3)
+        with pytest.raises(ValueError):
+            parser.feed(bad)
+            parser.close()
+
+
+def test_lazy_sexp_paths(tmp_path):
+    for line in [LazySexp(MESSAGE), LazySexp.of_bytes(MESSAGE, spill_threshold=16, dir=tmp_path)]:
+        assert line.loads([1, 3, 1, -1]) == pycoq.sexp_parser.loads_at(MESSAGE, [1, 3, 1, -1])
+        assert line.loads([1, 3, 1, -1, -1]) == 'fun (n : nat) "x" => eq_refl (n + 0)'
+        assert line.raw([1, 1]) == b'(span_id 7)'
+        assert len(line.children([1])) == 4 and line.decode() == MESSAGE.decode()
+        with pytest.raises(IndexError):
+            line.span([1, 4])
+    assert line.spilled
+    line.close()
+
+
+def test_chunked_line_reader():
+    lines = [b'(Answer 0 Ack)\n', MESSAGE, b'(Answer 0 Completed)\n']
+
+    async def read():
+        stream = asyncio.StreamReader()
+        reader = ChunkedLineReader(stream, chunk_size=5)
+        data = b''.join(lines)
+        stream.feed_data(data[:40])
+        assert await reader.readline() == lines[0]
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(reader.readline_sexp(spill_threshold=32), timeout=0.1)
+        stream.feed_data(data[40:])
+        stream.feed_eof()
+        message = await reader.readline_sexp(spill_threshold=32)
+        return message, await reader.readline(), await reader.readline(), await reader.readline_sexp()
+
+    message, completed, eof, eof_sexp = asyncio.run(read())
+    assert message.spilled and message.raw() == MESSAGE.strip()
+    assert message.loads([1, 3, 1, -1, -1]) == 'fun (n : nat) "x" => eq_refl (n + 0)'
+    assert (completed, eof, eof_sexp) == (lines[2], b'', None)
+
+
+def test_chunked_line_reader_whole_lines_without_spill():
+    async def read():
+        stream = asyncio.StreamReader()
+        reader = ChunkedLineReader(stream, chunk_size=5)
+        stream.feed_data(MESSAGE * 2)
+        stream.feed_eof()
+        line = await reader.readline()
+        pending = reader._pending
+        return line, pending, await reader.readline_sexp(spill_threshold=None), await reader.readline_sexp(None)
+
+    line, pending, message, eof = asyncio.run(read())
+    assert (line, pending, message.data, message.spilled, eof) == (MESSAGE, b'', MESSAGE, False, None)
+
+
+def test_chunked_line_reader_frame_header():
+    async def read():
+        stream = asyncio.StreamReader()
+        reader = ChunkedLineReader(stream, chunk_size=5)
+        stream.feed_data(b'OUT 12 ' + MESSAGE + b'OPENED 3 \n')
+        stream.feed_eof()
+        out = await reader.readword(), await reader.readword(), await reader.readline_sexp(spill_threshold=32)
+        opened = await reader.readword(), await reader.readword(), await reader.readline()
+        return out, opened, await reader.readword()
+
+    (op, session, message), opened, eof = asyncio.run(read())
+    assert (op, session, message.spilled, message.raw()) == (b'OUT ', b'12 ', True, MESSAGE.strip())
+    assert (opened, eof) == ((b'OPENED ', b'3 ', b'\n'), b'')
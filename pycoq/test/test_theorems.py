@@ -0,0 +1,94 @@
+'''
+tests of the theorem jobs of a coq file
+'''
+import asyncio
+import os
+
+import pycoq.common
+import pycoq.split
+import pycoq.theorems
+
+
+def with_prefix(fname):
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), fname)
+
+
+SOURCE = ('Require Import Arith.\n'
+          'Lemma a : True.\nProof. auto. Qed.\n'
+          'Lemma b : 0 = 0.\nProof. reflexivity. Qed.\n'
+          'Goal True.\nProof. exact I. Qed.\n'
+          'Definition c := 1.\n'
+          'Lemma d : False.\nAbort.\n'
+          'Theorem e : 0 = 0 /\\ True.\nProof. split. apply b. apply a. Qed.\n'
+          'Lemma f : 0 = 0.\nProof. exact b. Qed.\n')
+
+
+def jobs_of(source, prune):
+    offsets = pycoq.split.coq_stmt_offsets(source.encode())
+    stmts = pycoq.split.CoqStmts(source.encode(), offsets)
+    return stmts, pycoq.theorems.theorem_jobs(stmts, offsets, prune=prune)
+
+
+def test_theorem_jobs():
+    stmts, jobs = jobs_of(SOURCE, prune=False)
+    assert [job.name for job in jobs] == ['a', 'b', None, 'd', 'e', 'f']
+    assert [job.end_keyword for job in jobs] == ['Qed', 'Qed', 'Qed', 'Abort', 'Qed', 'Qed']
+    e = jobs[4]
+    assert SOURCE.encode()[slice(*e.statement_span)].decode().strip() == 'Theorem e : 0 = 0 /\\ True.'
+    assert SOURCE.encode()[slice(*e.proof_span)].decode().strip() == 'Proof. split. apply b. apply a. Qed.'
+    assert jobs[3].proof_span[0] == jobs[3].statement_span[1]
+    assert e.prefix == [(0, e.statement_index)]
+    assert jobs[0].prefix == [(0, 1)]
+
+
+def test_pruned_theorem_jobs():
+    stmts, jobs = jobs_of(SOURCE, prune=True)
+    e, f = jobs[4], jobs[5]
+    kept = [stmts[i].strip() for i in e.prefix_indices()]
+    assert kept[0] == 'Require Import Arith.' and 'Lemma a : True.' in kept and 'Lemma b : 0 = 0.' in kept
+    assert 'Goal True.' not in kept and 'Lemma d : False.' not in kept
+    assert 'Definition c := 1.' in kept
+    assert [stmts[i].strip() for i in f.prefix_indices()] == [
+        'Require Import Arith.', 'Lemma b : 0 = 0.', 'Proof.', 'reflexivity.', 'Qed.', 'Definition c := 1.']
+    assert f.n_prefix() < jobs_of(SOURCE, prune=False)[1][5].n_prefix()
+
+
+def test_theorem_jobs_of_context():
+    coq_ctxt = pycoq.common.CoqContext(pwd=with_prefix('lf'), executable='', target='Basics.v')
+    stmts, jobs = pycoq.theorems.theorem_jobs_of_context(coq_ctxt, prune=True)
+    assert len(jobs) > 50
+    for job in jobs:
+        theorem = [pycoq.split.remove_comment(stmt).split() for stmt in job.theorem_stmts(stmts)]
+        assert theorem[0][0] in ('Theorem', 'Lemma', 'Example', 'Definition', 'Fixpoint')
+        assert theorem[-1][-1] in ('Qed.', 'Defined.', 'Admitted.', 'Abort.')
+        assert all(i < job.statement_index for i in job.prefix_indices())
+    stmts.close()
+
+
+class ReplayCoq():
+    ''' records the replayed sentences, fails on the sentences containing "fail" '''
+
+    def __init__(self):
+        self.live = []
+
+    def tip(self):
+        return len(self.live) or None
+
+    async def execute_many(self, stmts, chunk_size=None, timeout=None):
+        for i, stmt in enumerate(stmts):
+            if 'fail' in stmt:
+                return None, None, ['CoqExn'], [[sid] for sid in range(i)]
+            self.live.append(stmt)
+        return None, None, [], [[sid] for sid in range(len(stmts))]
+
+    async def reset_to(self, sid):
+        del self.live[sid or 0:]
+
+
+def test_verify_job():
+    stmts, jobs = jobs_of(SOURCE, prune=True)
+    coq = ReplayCoq()
+    assert asyncio.run(pycoq.theorems.verify_job(coq, stmts, jobs[5]))
+    assert coq.live == []
+    stmts, jobs = jobs_of(SOURCE.replace('exact b', 'fail b'), prune=True)
+    assert not asyncio.run(pycoq.theorems.verify_job(coq, stmts, jobs[5]))
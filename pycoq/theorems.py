@@ -0,0 +1,185 @@
+'''
+theorems of a coq file as independent jobs
+
+theorem_jobs() finds the top level theorems of the sentences of a file (tagged by
+pycoq.classify) and records for each one its statement and proof, as byte spans in the file and
+as ranges of sentence indices, and the prefix of sentences to replay before its statement so that
+a kernel can check the theorem alone:
+
+    prune=False   the prefix is every sentence before the statement
+    prune=True    the proofs of the earlier theorems the theorem does not use are left out:
+                  going back from the theorem, the sentences out of proofs are kept and an earlier
+                  theorem (statement and proof) is kept if its name occurs in the theorem or in a
+                  sentence already kept; aborted theorems and Goals are left out
+
+the pruning is lexical (Print Assumptions lists only the axioms and section variables a theorem
+relies on, not the lemmas of the file it uses); verify_job() replays a pruned job with a kernel
+
+example:
+    stmts, jobs = theorem_jobs_of_context(coq_ctxt, prune=True)
+    job = jobs[0]
+    job.name, job.statement_span, job.proof_span
+    await coq.execute_many(job.prefix_stmts(stmts) + job.theorem_stmts(stmts))
+'''
+import logging
+import os
+import re
+
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+import pycoq.classify
+import pycoq.common
+import pycoq.split
+
+
+IDENT_PATTERN = re.compile(r"[A-Za-z_][\w']*")
+
+# keywords of statements without a name that are left out of pruned prefixes
+UNNAMED_PRUNED_KEYWORDS = {'Goal'}
+
+
+@dataclass
+class TheoremJob:
+    ''' a top level theorem of a file: its name (None for a Goal or an obligation), the keyword
+    that ends its proof, the byte spans of its statement and proof in the file, the sentence
+    indices of its statement and of the end of its proof, and its prefix as half-open ranges of
+    sentence indices
+    '''
+    name: Optional[str]
+    end_keyword: str
+    statement_span: Tuple[int, int]
+    proof_span: Tuple[int, int]
+    statement_index: int
+    proof_end_index: int
+    prefix: List[Tuple[int, int]]
+
+    def prefix_indices(self) -> List[int]:
+        return [i for start, end in self.prefix for i in range(start, end)]
+
+    def prefix_stmts(self, stmts: Sequence[str]) -> List[str]:
+        return [stmts[i] for i in self.prefix_indices()]
+
+    def theorem_stmts(self, stmts: Sequence[str]) -> List[str]:
+        ''' the statement and the proof sentences '''
+        return [stmts[i] for i in range(self.statement_index, self.proof_end_index + 1)]
+
+    def n_prefix(self) -> int:
+        return sum(end - start for start, end in self.prefix)
+
+
+def theorem_name(stmt: str, tag: pycoq.classify.SentenceTag) -> Optional[str]:
+    ''' the name after the keyword of the statement stmt '''
+    if tag.keyword in UNNAMED_PRUNED_KEYWORDS or tag.keyword == 'Next':
+        return None
+    text = pycoq.split.remove_comment(stmt)
+    match = re.search(re.escape(tag.keyword) + r"\s+([A-Za-z_][\w']*)", text)
+    return match.group(1) if match else None
+
+
+def stmt_idents(stmts: Sequence[str]) -> List[Set[str]]:
+    ''' identifiers (and parts of qualified names) of each sentence '''
+    return [set(IDENT_PATTERN.findall(pycoq.split.remove_comment(stmt))) for stmt in stmts]
+
+
+def ranges(indices: List[int]) -> List[Tuple[int, int]]:
+    ''' increasing indices as half-open ranges of consecutive indices '''
+    result = []
+    for i in indices:
+        if result and result[-1][1] == i:
+            result[-1] = (result[-1][0], i + 1)
+        else:
+            result.append((i, i + 1))
+    return result
+
+
+def theorem_blocks(tags: List[pycoq.classify.SentenceTag]) -> List[Tuple[int, int]]:
+    ''' (statement index, proof end index) of the top level theorems with a closed proof '''
+    blocks = []
+    start = None
+    for i, tag in enumerate(tags):
+        if tag.depth == 0 and tag.opens_proof:
+            start = i
+        elif start is not None and tag.closes_proof and tag.depth == 1:
+            blocks.append((start, i))
+            start = None
+    return blocks
+
+
+def pruned_prefix(idents: List[Set[str]], tags: List[pycoq.classify.SentenceTag], blocks: List[Tuple[int, int]],
+                  names: List[Optional[str]], k: int) -> List[Tuple[int, int]]:
+    ''' the prefix of the k-th block without the earlier blocks it does not need (see the module docstring),
+    idents are the identifiers of each sentence
+    '''
+    statement, proof_end = blocks[k]
+    needed = set().union(*idents[statement:proof_end + 1])
+    kept = []
+    i = statement - 1
+    j = k - 1
+    while i >= 0:
+        if j >= 0 and blocks[j][1] == i:
+            start, end = blocks[j]
+            name, keyword = names[j], tags[start].keyword
+            aborted = tags[end].keyword == 'Abort'
+            if not aborted and (name in needed if name is not None else keyword not in UNNAMED_PRUNED_KEYWORDS):
+                kept.extend(range(end, start - 1, -1))
+                needed.update(*idents[start:end + 1])
+            i, j = start - 1, j - 1
+        else:
+            # out of the top level proofs, or in a proof that is not closed
+            kept.append(i)
+            needed |= idents[i]
+            i -= 1
+    return ranges(kept[::-1])
+
+
+def theorem_jobs(stmts: Sequence[str], offsets: np.ndarray, tags: Optional[List[pycoq.classify.SentenceTag]] = None,
+                 prune: bool = False) -> List[TheoremJob]:
+    '''
+    the jobs of the top level theorems of the sentences stmts of a file at the byte offsets
+    (see pycoq.split.coq_stmt_offsets), tags are classify(stmts) by default
+    '''
+    tags = pycoq.classify.classify(stmts) if tags is None else tags
+    blocks = theorem_blocks(tags)
+    names = [theorem_name(stmts[start], tags[start]) for start, _ in blocks]
+    idents = stmt_idents(stmts) if prune else None
+    jobs = []
+    for k, (statement, proof_end) in enumerate(blocks):
+        prefix = pruned_prefix(idents, tags, blocks, names, k) if prune else ([(0, statement)] if statement else [])
+        proof_start = statement + 1
+        jobs.append(TheoremJob(
+            name=names[k], end_keyword=tags[proof_end].keyword,
+            statement_span=(int(offsets[statement][0]), int(offsets[statement][1])),
+            proof_span=(int(offsets[proof_start][0]) if proof_start <= proof_end else int(offsets[statement][1]),
+                        int(offsets[proof_end][1])),
+            statement_index=statement, proof_end_index=proof_end, prefix=prefix))
+    return jobs
+
+
+def theorem_jobs_of_context(coq_ctxt: pycoq.common.CoqContext,
+                            prune: bool = False) -> Tuple[pycoq.split.CoqStmts, List[TheoremJob]]:
+    '''
+    the sentences of the target file of coq_ctxt (see pycoq.split.coq_stmts_of_source)
+    and the jobs of its theorems
+    '''
+    stmts = pycoq.split.coq_stmts_of_source(os.path.join(coq_ctxt.pwd, coq_ctxt.target))
+    return stmts, theorem_jobs(stmts, stmts.offsets, prune=prune)
+
+
+async def verify_job(coq: 'pycoq.serapi.CoqSerapi', stmts: Sequence[str], job: TheoremJob,
+                     timeout: Optional[float] = None) -> bool:
+    '''
+    replays the prefix and the theorem of job from the current state of coq, which is restored;
+    returns True if every sentence executed without CoqExn
+    '''
+    baseline = coq.tip()
+    try:
+        _, _, coqexns, _ = await coq.execute_many(job.prefix_stmts(stmts) + job.theorem_stmts(stmts),
+                                                  timeout=timeout)
+    finally:
+        await coq.reset_to(baseline)
+    if coqexns:
+        logging.warning(f"pycoq.theorems: replay of {job.name} failed: {coqexns}")
+    return not coqexns
@@ -1,9 +1,11 @@
 import asyncio
 from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Optional
 
 from pycoq.common import CoqContext, LocalKernelConfig
 from pycoq.serapi import CoqSerapi
+from pycoq.pool import KernelPool
 
 import os
 
@@ -11,9 +13,10 @@ from pdb import set_trace as st
 
 
 @asynccontextmanager
-async def get_coq_serapi(coq_ctxt: CoqContext) -> CoqSerapi:
+async def get_coq_serapi(coq_ctxt: CoqContext, pool: Optional[KernelPool] = None) -> CoqSerapi:
     """
     Returns CoqSerapi instance that is closed with a with statement.
+    If a KernelPool is given the kernel is taken prewarmed from the pool and released to it at the end.
     CoqContext for the file is also return since it can be used to manipulate the coq file e.g. return
     the coq statements as in for `stmt in pycoq.split.coq_stmts_of_context(coq_ctxt):`.
 
@@ -54,7 +57,7 @@ async def get_coq_serapi(coq_ctxt: CoqContext) -> CoqSerapi:
         cfg: LocalKernelConfig = opam.get_opam_serapi_cfg_for_coq_ctxt(coq_ctxt)
         logfname = pycoq.common.serapi_log_fname(os.path.join(coq_ctxt.pwd, coq_ctxt.target))
         print(f'{logfname=}')
-        kernel: LocalKernel = LocalKernel(cfg)
+        kernel: LocalKernel = LocalKernel(cfg) if pool is None else await pool.acquire(cfg)
         # - needed to be returned to talk to coq
         coq: CoqSerapi = pycoq.serapi.CoqSerapi(kernel, logfname=logfname)
         await coq.__aenter__()  # calls self.start(), this  must be called by itself in the with stmt beyond yield
@@ -72,6 +75,8 @@ async def get_coq_serapi(coq_ctxt: CoqContext) -> CoqSerapi:
         finally_msg: str = 'Finally exception clause. No error.'
         exception_type, exception_value = ValueError, ValueError(finally_msg)
         await coq.__aexit__(exception_type, exception_value, tb)
+        if pool is not None:
+            pool.release(kernel)
         # coq_ctxt is just a data class so no need to close it, see: https://github.com/brando90/pycoq/blob/main/pycoq/common.py#L32
 
 
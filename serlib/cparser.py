@@ -0,0 +1,288 @@
+'''numpy / numba implementation of the serlib.cparser interface
+
+Provides hash_string, parse, annotate, children, subtree and the
+exceptions BufferOverflow, ParsingError, IndexError with the
+signatures of the C extension in cparser.cpp. If that extension is
+compiled in place it is imported instead of this module (extension
+modules take precedence over source modules of the same name).
+
+The sequential passes (tokenization with address selection, postfix
+annotation) are numba kernels; without numba they run as plain python
+on the same numpy arrays, which is correct but slow. Hashing of the
+words and their interning against the hash list of the dictionary are
+vectorized in numpy.
+
+postfix encoding of an s-expression: a word is encoded by its positive
+index in the dictionary, a list of k elements by the encodings of its
+elements followed by -k (so the empty list is 0)
+
+hash of a word is the polynomial hash of its bytes as signed chars
+(as in cparser.cpp) modulo 2**64:
+  hash(c_1 ... c_n) = 5371 * 257^n + c_1 * 257^(n-1) + ... + c_n
+'''
+import builtins
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        ''' without numba the kernels run as python functions '''
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+
+HASH_CONST = 5371
+HASH_BASE = 257
+HASH_MOD = 2**64
+HASH_BASE_INV = pow(HASH_BASE, -1, HASH_MOD)
+
+# chunk of bytes hashed at once by hash_string
+HASH_CHUNK = 2**18
+
+OPEN_PAR = ord('(')
+CLOSE_PAR = ord(')')
+QUOTE = ord('"')
+BACKSLASH = ord('\\')
+
+# error codes of the scan kernel
+UNMATCHED_OPEN = 1
+UNMATCHED_CLOSE = 2
+UNCLOSED_QUOTE = 3
+
+_SCAN_ERRORS = {UNMATCHED_OPEN: "unmatched '('",
+                UNMATCHED_CLOSE: "unmatched ')'",
+                UNCLOSED_QUOTE: "unexpected EOF while parsing"}
+
+
+class BufferOverflow(OverflowError):
+    ''' the dictionary of words is full '''
+
+
+class ParsingError(ValueError):
+    ''' the input is not a well formed s-expression '''
+
+
+class IndexError(builtins.IndexError):
+    ''' the address or the node index does not exist in the postfix representation '''
+
+
+def _descending_powers(n: int) -> np.ndarray:
+    ''' returns [257^(n-1), ..., 257, 1] modulo 2**64 '''
+    powers = np.full(n, HASH_BASE, dtype=np.uint64)
+    powers[0] = 1
+    return np.cumprod(powers)[::-1].copy()
+
+
+_CHUNK_POWERS = _descending_powers(HASH_CHUNK)
+
+
+def _signed_codes(buf: np.ndarray) -> np.ndarray:
+    ''' bytes as signed chars promoted to unsigned long long as in cparser.cpp '''
+    return buf.view(np.int8).astype(np.uint64)
+
+
+def hash_string(bytestring: bytes) -> int:
+    ''' returns the hash of bytestring, hashed by chunks to bound the memory '''
+    res = HASH_CONST
+    view = memoryview(bytestring).cast('B')
+    for offset in range(0, len(view), HASH_CHUNK):
+        codes = _signed_codes(np.frombuffer(view[offset:offset + HASH_CHUNK], dtype=np.uint8))
+        poly = int((codes * _CHUNK_POWERS[HASH_CHUNK - len(codes):]).sum())
+        res = (res * pow(HASH_BASE, len(codes), HASH_MOD) + poly) % HASH_MOD
+    return res
+
+
+def hash_spans(buf: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    ''' returns the hashes of the words buf[starts[i]:ends[i]] (nonempty), vectorized
+    with the prefix sums of c_j * 257^(-j) (257 is invertible modulo 2**64)
+    '''
+    n = buf.shape[0]
+    inv_powers = np.full(n, HASH_BASE_INV, dtype=np.uint64)
+    if n:
+        inv_powers[0] = 1
+    np.cumprod(inv_powers, out=inv_powers)
+    codes = _signed_codes(buf)
+    codes *= inv_powers
+    del inv_powers
+    prefix = np.zeros(n + 1, dtype=np.uint64)
+    np.cumsum(codes, out=prefix[1:])
+    del codes
+    base = np.uint64(HASH_BASE)
+    lengths = (ends - starts).astype(np.uint64)
+    return (np.uint64(HASH_CONST) * np.power(base, lengths)
+            + np.power(base, (ends - 1).astype(np.uint64)) * (prefix[ends] - prefix[starts]))
+
+
+@njit(cache=True)
+def _matches(counts, depth, address):
+    ''' the position in the tree given by counts[:depth] is inside the address '''
+    if depth < address.shape[0]:
+        return False
+    for i in range(address.shape[0]):
+        if counts[i] != address[i]:
+            return False
+    return True
+
+
+@njit(cache=True)
+def _is_separator(c):
+    return c == 32 or c == 9 or c == 10 or c == 13
+
+
+@njit(cache=True)
+def _scan(buf, address):
+    ''' tokenizes buf, returns the postfix encoding of the subtree at address with the words
+    encoded by their ordinal + 1 among all the words, the spans of all the words,
+    the span of the subtree in buf and an error code with its position
+    '''
+    n = buf.shape[0]
+    postfix = np.empty(n, dtype=np.intc)
+    word_starts = np.empty(n, dtype=np.intp)
+    word_ends = np.empty(n, dtype=np.intp)
+    # counts[i] is the number of elements read so far in the open list of level i
+    counts = np.empty(n + 1, dtype=np.intc)
+    depth = 0
+    n_postfix = 0
+    n_words = 0
+    start_pos = -1
+    end_pos = -1
+    error = 0
+    error_pos = 0
+    pos = 0
+    while pos < n:
+        if start_pos == -1 and _matches(counts, depth, address):
+            start_pos = pos
+        c = buf[pos]
+        if _is_separator(c):
+            pos += 1
+        elif c == OPEN_PAR:
+            counts[depth] = 0
+            depth += 1
+            pos += 1
+        elif c == CLOSE_PAR:
+            if depth == 0:
+                error, error_pos = UNMATCHED_CLOSE, pos
+                break
+            depth -= 1
+            pos += 1
+            if _matches(counts, depth, address):
+                postfix[n_postfix] = -counts[depth]
+                n_postfix += 1
+                end_pos = pos
+            if depth > 0:
+                counts[depth - 1] += 1
+        else:
+            start = pos
+            if c == QUOTE:
+                pos += 1
+                while pos < n and buf[pos] != QUOTE:
+                    if buf[pos] == BACKSLASH:
+                        pos += 1
+                    pos += 1
+                if pos >= n:
+                    error, error_pos = UNCLOSED_QUOTE, start
+                    break
+                pos += 1
+            else:
+                while pos < n and not (_is_separator(buf[pos]) or buf[pos] == OPEN_PAR
+                                       or buf[pos] == CLOSE_PAR or buf[pos] == QUOTE):
+                    pos += 1
+            word_starts[n_words] = start
+            word_ends[n_words] = pos
+            n_words += 1
+            if _matches(counts, depth, address):
+                postfix[n_postfix] = n_words
+                n_postfix += 1
+                end_pos = pos
+            if depth > 0:
+                counts[depth - 1] += 1
+    if error == 0 and depth > 0:
+        error, error_pos = UNMATCHED_OPEN, n
+    return (postfix[:n_postfix].copy(), word_starts[:n_words].copy(), word_ends[:n_words].copy(),
+            start_pos, end_pos, error, error_pos)
+
+
+def intern(hashes: np.ndarray, hash_list: np.ndarray):
+    ''' returns the dictionary indices (from 1) of the words with given hashes, where the word
+    of index i has hash hash_list[i - 1] and the words not in hash_list get the next indices
+    in the order of their first occurrence; and the positions in hashes of these new words
+    '''
+    uniq, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    order = np.argsort(hash_list, kind='stable')
+    sorted_known = hash_list[order]
+    pos = np.searchsorted(sorted_known, uniq)
+    found = pos < sorted_known.shape[0]
+    found[found] = sorted_known[pos[found]] == uniq[found]
+    uniq_ids = np.empty(uniq.shape[0], dtype=np.intc)
+    uniq_ids[found] = order[pos[found]] + 1
+    new = np.flatnonzero(~found)
+    new = new[np.argsort(first[new], kind='stable')]
+    uniq_ids[new] = np.arange(hash_list.shape[0] + 1, hash_list.shape[0] + 1 + new.shape[0])
+    return uniq_ids[inverse.reshape(-1)], first[new]
+
+
+def parse(bytestring: bytes, address: np.ndarray, hash_list: np.ndarray, hash_list_len: int):
+    ''' returns start_pos, end_pos of the subtree at address in bytestring, its postfix
+    representation np.ndarray[np.intc] with the words encoded by their index in the dictionary
+    given by hash_list[:hash_list_len] extended by the new words, and the flat array
+    [start_1, end_1, start_2, end_2, ...] of the spans of the new words in bytestring
+    '''
+    buf = np.frombuffer(bytestring, dtype=np.uint8)
+    address = np.asarray(address, dtype=np.intc)
+    postfix, starts, ends, start_pos, end_pos, error, error_pos = _scan(buf, address)
+    if error:
+        raise ParsingError(f"{_SCAN_ERRORS[error]} at position {error_pos}")
+    ids, new_words = intern(hash_spans(buf, starts, ends), hash_list[:hash_list_len])
+    words = postfix > 0
+    postfix[words] = ids[postfix[words] - 1]
+    add_dict = np.stack([starts[new_words], ends[new_words]], axis=1).reshape(-1).astype(np.intp)
+    return start_pos, end_pos, postfix, add_dict
+
+
+@njit(cache=True)
+def _annotate(postfix, ann):
+    for i in range(postfix.shape[0]):
+        start = i
+        for _ in range(-postfix[i]):
+            start = ann[start - 1]
+        ann[i] = start
+
+
+def annotate(postfix: np.ndarray) -> np.ndarray:
+    ''' returns ann with ann[i] the start index in postfix of the subtree that ends at i '''
+    ann = np.empty(postfix.shape[0], dtype=np.intc)
+    _annotate(postfix, ann)
+    return ann
+
+
+def children(postfix: np.ndarray, ann: np.ndarray, node_index: int) -> np.ndarray:
+    ''' returns the indices in postfix of the ends of the children of the list that ends at node_index '''
+    if not 0 <= node_index < postfix.shape[0]:
+        raise IndexError("node index is out of bound")
+    breadth = -int(postfix[node_index])
+    if breadth < 0:
+        raise IndexError("this node is not a list (it must be atom)")
+    res = np.empty(breadth, dtype=np.intc)
+    for i in range(breadth - 1, -1, -1):
+        node_index -= 1
+        res[i] = node_index
+        node_index = ann[node_index]
+    return res
+
+
+def subtree(postfix: np.ndarray, ann: np.ndarray, address: np.ndarray):
+    ''' returns the slice start, end of postfix that encodes the subtree at address '''
+    end_pos = postfix.shape[0]
+    for index in address:
+        end_pos -= 1
+        if end_pos < 0:
+            raise IndexError("index address is too long")
+        breadth = -int(postfix[end_pos])
+        if not 0 <= index < breadth:
+            raise IndexError("index address is out of bounds")
+        for _ in range(breadth - index - 1):
+            end_pos = ann[end_pos - 1]
+    return int(ann[end_pos - 1]), end_pos
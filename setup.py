@@ -37,7 +37,7 @@ setuptools.setup(
     author='Vasily Pestun, Fidel I. Schaposnik Massolo',
     author_email='pestun@ihes.fr',
     packages=['pycoq',
-              # 'serlib',
+              'serlib',
               'pycoq.test'],
     # ext_modules=[serlib_cparser],
     license='MIT License',
@@ -51,7 +51,7 @@ setuptools.setup(
                             'test/lf/*',
                             'test/coq-bignums/*',
                             'test/query_goals/*',
-                            # 'test/serlib/*',
+                            'test/serlib/*',
                             'test/trace/*']},
     install_requires=['lark-parser',
                       'pylint',
@@ -66,10 +66,13 @@ setuptools.setup(
                       'strace-parser',
                       'pytest-benchmark',
                       'dataclasses-json',
-                      'numpy'
+                      'numpy',
                       'sexpdata==0.0.4',
                       ],
-        entry_points={'console_scripts': ['pycoq-trace=pycoq.pycoq_trace:main']},
+    extras_require={'numba': ['numba']},
+        entry_points={'console_scripts': ['pycoq-trace=pycoq.pycoq_trace:main',
+                                          'pycoq-kernel-server=pycoq.remote:main',
+                                          'pycoq-sentence-index=pycoq.sentence_index:main']},
     project_urls={
         'Source': 'https://github.com/pestun/pycoq'
     },